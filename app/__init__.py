@@ -1,7 +1,8 @@
 """
     This module creates and configures instances of the Flask app, cache, and
     database connection, for global access and use by other modules. View
-    blueprints and models are registered in their respective __init__ modules.
+    blueprints and models are registered in their respective __init__ modules,
+    and CLI commands in the cli module.
 """
 
 from .config import get_config
@@ -18,8 +19,11 @@ app.config.from_object(get_config())
 
 db = create_db(app)
 cache = create_cache(app, db)
-sql = get_statements()
+sql = get_statements(db.engine.dialect.name)
 init_db(db)
 
 from .views import init_views
 init_views(app)
+
+from .cli import init_cli
+init_cli(app)
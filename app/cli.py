@@ -0,0 +1,321 @@
+"""
+    This module registers custom commands to the Flask CLI, for operations that
+    are more convenient (or only feasible) to run from the command line than
+    through the browser, e.g.
+
+        flask shares issue 1000000 --share-class A --date 2018-06-01
+        flask register checkpoint
+        flask register export transactions --format ndjson --output tx.ndjson
+        flask register import shareholders shareholders.csv --dry-run
+        flask db benchmark --profile default --profile sqlite
+"""
+
+import datetime
+import click
+import dateutil.parser as dtp
+
+from app.util.export import (
+    EXPORTS,
+    FORMATS,
+    generate_export
+)
+from flask.cli import AppGroup
+
+cache_cli = AppGroup(
+    "cache",
+    help = "Inspect the cache."
+)
+db_cli = AppGroup(
+    "db",
+    help = "Inspect and benchmark the DB engine."
+)
+register_cli = AppGroup(
+    "register",
+    help = "Manage the register of shareholders."
+)
+shares_cli = AppGroup(
+    "shares",
+    help = "Manage shares."
+)
+
+
+
+def init_cli(app):
+    app.cli.add_command(cache_cli)
+    app.cli.add_command(db_cli)
+    app.cli.add_command(register_cli)
+    app.cli.add_command(shares_cli)
+
+
+
+@cache_cli.command("stats")
+def show_cache_stats():
+    """
+    Show hits, misses, computing time etc. of each cached function. Only
+    meaningful with a shared cache (e.g. in production), since otherwise this
+    command has a cache of its own.
+    """
+    from app import cache
+
+    row = "{:<48} {:>7} {:>7} {:>6} {:>9} {:>9} {:>6} {:>7}"
+    click.echo(row.format(
+        "Function", "Hits", "Misses", "Ratio", "Avg (ms)", "Size (B)",
+        "Evict", "Avoided"
+    ))
+    for (name, m,) in cache.metrics.get_all().items():
+        click.echo(row.format(
+            name[-48:],
+            m["hits"],
+            m["misses"],
+            "%.2f" % m["hit_ratio"] if m["hit_ratio"] is not None else "-",
+            "%.1f" % m["mean_compute_time"] \
+                if m["mean_compute_time"] is not None else "-",
+            m["size"],
+            m["evictions"],
+            m["stale_served"] + m["waited"]
+        ))
+
+    usage = cache.metrics.get_backend_usage()
+    if usage:
+        click.echo("Cache holds %s entries, %s bytes" % (
+            usage["entries"], usage["bytes"],))
+
+
+
+@db_cli.command("benchmark")
+@click.option(
+    "--profile",
+    help = "Engine profile to benchmark, can be given several times (defaults"
+           " to 'default' and the profile in use).",
+    multiple = True
+)
+@click.option(
+    "--rounds",
+    default = 100,
+    help = "Number of times each workload is run (defaults to 100).",
+    type = click.IntRange(1)
+)
+def benchmark_profiles(profile, rounds):
+    """
+    Time typical workloads against the DB with each of given engine profiles,
+    side by side. Writes go to a scratch table, which is dropped afterwards.
+    """
+    from app import db
+    from app.config import DB_PROFILES
+    from app.util.engine import (
+        benchmark,
+        create_profiled_engine
+    )
+
+    names = profile or sorted(set(("default", db.profile_name,)))
+    for name in names:
+        if name not in DB_PROFILES:
+            raise click.BadParameter("No such profile", param_hint = "--profile")
+
+    results = []
+    for name in names:
+        engine = create_profiled_engine(db.engine.url, {}, DB_PROFILES[name])
+        try:
+            results.append(benchmark(engine, rounds))
+        finally:
+            engine.dispose()
+
+    row = "{:<12}" + " {:>12}" * len(names)
+    click.echo("Median ms per operation, %s rounds" % rounds)
+    click.echo(row.format("Workload", *names))
+    for (i, (workload, ms,),) in enumerate(results[0]):
+        click.echo(row.format(
+            workload,
+            *[ "%.3f" % r[i][1] for r in results ]
+        ))
+
+
+
+@db_cli.command("profile")
+def show_profile():
+    """
+    Show the engine profile in use, and the settings that the DB actually runs
+    with (as read back from the pool and the DB).
+    """
+    from app import db
+    from app.util.engine import report_engine
+
+    click.echo("Engine profile: %s" % db.profile_name)
+    for (setting, value,) in report_engine(db.engine):
+        click.echo("  %s = %s" % (setting, value,))
+
+
+
+@register_cli.command("checkpoint")
+@click.option(
+    "--date",
+    default = None,
+    help = "Date of checkpoint as YYYY-MM-DD (defaults to today)."
+)
+def take_checkpoint(date):
+    """
+    Take a snapshot of ownership at the end of given date, to speed up looking
+    up the register as of later dates. Meant to be run periodically.
+    """
+    from app.models.checkpoint import Checkpoint
+
+    taken_on = dtp.parse(date).date() if date else datetime.date.today()
+    if taken_on > datetime.date.today():
+        raise click.BadParameter("Cannot be in the future", param_hint = "--date")
+
+    Checkpoint.take(taken_on)
+    click.echo("Checkpoint taken as of %s" % taken_on)
+
+
+
+@register_cli.command("export")
+@click.argument(
+    "name",
+    type = click.Choice(sorted(EXPORTS))
+)
+@click.option(
+    "--format",
+    default = "csv",
+    help = "Format of the export (defaults to csv).",
+    type = click.Choice(FORMATS)
+)
+@click.option(
+    "--output",
+    default = "-",
+    help = "File to write to (defaults to standard output).",
+    type = click.File("w")
+)
+def export_table(name, format, output):
+    """
+    Write a whole table of the register (NAME) to a file, streaming it so that
+    memory usage stays flat no matter the size of the register.
+    """
+    for chunk in generate_export(name, format):
+        output.write(chunk)
+
+
+
+@register_cli.command("import")
+@click.argument(
+    "name",
+    type = click.Choice(("history", "shareholders",))
+)
+@click.argument(
+    "file",
+    type = click.File("r", encoding = "utf-8-sig")
+)
+@click.option(
+    "--dry-run",
+    help = "Only check the file, without importing anything.",
+    is_flag = True
+)
+def import_file(name, file, dry_run):
+    """
+    Import shareholders, or the history of certificates and transactions, from
+    a CSV file (see the manual for columns). Invalid rows are skipped, and
+    listed by line number along with what is wrong with them.
+    """
+    from app.util.importer import (
+        import_history,
+        import_shareholders
+    )
+
+    if name == "history":
+        report = import_history(file, dry_run)
+    else:
+        report = import_shareholders(file, dry_run)
+
+    for e in report.errors:
+        click.echo("Line %s: %s" % (e.line, e.message,), err = True)
+    click.echo("%s rows %s, %s rows invalid" % (
+        report.imported,
+        "valid" if dry_run else "imported",
+        len(report.errors),
+    ))
+
+
+
+@shares_cli.command("issue")
+@click.argument("upper", type = int)
+@click.option(
+    "--share-class",
+    help = "Name of the share class of the new shares.",
+    required = True
+)
+@click.option(
+    "--date",
+    default = None,
+    help = "Date of issue as YYYY-MM-DD (defaults to today)."
+)
+def issue_shares(upper, share_class, date):
+    """
+    Issue new shares numbered from the next free number up to UPPER.
+    """
+    from app.models.share import Share
+    from app.models.shareclass import ShareClass
+
+    lower = Share.get_last_share_number() + 1
+    issued_on = dtp.parse(date).date() if date else datetime.date.today()
+    sc = ShareClass.query.filter_by(name = share_class).first()
+
+    if not sc:
+        raise click.BadParameter("No such share class", param_hint = "--share-class")
+    elif upper < lower:
+        raise click.BadParameter("Must be at least %s" % lower, param_hint = "UPPER")
+    elif issued_on < Share.get_latest_issue_date():
+        raise click.BadParameter("Cannot be earlier than date of the latest issue", param_hint = "--date")
+    elif issued_on > datetime.date.today():
+        raise click.BadParameter("Cannot be in the future", param_hint = "--date")
+
+    click.echo("Issuing shares %s—%s (%s shares) in class %s ..." % (
+        lower, upper, upper - lower + 1, sc.name,))
+    Share.issue(lower, upper, sc.id, issued_on)
+    click.echo("Done, shares now issued up to %s" % Share.get_last_share_number())
+
+
+
+@shares_cli.command("reclassify")
+@click.argument("lower", type = int)
+@click.argument("upper", type = int)
+@click.option(
+    "--share-class",
+    help = "Name of the share class to move the shares into.",
+    required = True
+)
+def reclassify_shares(lower, upper, share_class):
+    """
+    Move already issued shares numbered LOWER to UPPER into another class.
+    """
+    from app.models.share import Share
+    from app.models.shareclass import ShareClass
+
+    cap = Share.get_last_share_number()
+    sc = ShareClass.query.filter_by(name = share_class).first()
+
+    if not sc:
+        raise click.BadParameter("No such share class", param_hint = "--share-class")
+    elif lower < 1:
+        raise click.BadParameter("Numbering of shares starts from 1", param_hint = "LOWER")
+    elif upper < lower:
+        raise click.BadParameter("Must be at least %s" % lower, param_hint = "UPPER")
+    elif upper > cap:
+        raise click.BadParameter("Shares have only been issued up to %s" % cap, param_hint = "UPPER")
+
+    click.echo("Moving shares %s—%s (%s shares) into class %s ..." % (
+        lower, upper, upper - lower + 1, sc.name,))
+    Share.reclassify(lower, upper, sc.id)
+    click.echo("Done")
+
+
+
+@shares_cli.command("rebuild-unbound")
+def rebuild_unbound_ranges():
+    """
+    Work out the ranges of unbound shares from scratch.
+    """
+    from app import db
+    from app.models.unboundrange import UnboundRange
+
+    UnboundRange.rebuild()
+    db.commit_and_invalidate()
+    click.echo("Unbound ranges: %s" % (UnboundRange.get_all() or "none",))
@@ -1,14 +1,76 @@
 """
     Object-based configuration. Use HerokuConfig in production, BaseConfig
     otherwise.
+
+    How the DB engine behaves (connection pool, SQLite PRAGMAs, statement time
+    limits) is set by named engine profiles, see DB_PROFILES.
 """
 
 import os
+import tempfile
+
+from sqlalchemy.pool import QueuePool
+
+# Engine profiles, by name (see util/engine): options to SQLAlchemy's
+# create_engine, the number of compiled statements kept for reuse (see sql),
+# PRAGMAs run on each new SQLite connection, and the time limit (ms) of each
+# statement on PostgreSQL. DB_PROFILE picks one; if not set, the
+# profile named after the DB backend is used. 'default' leaves everything to
+# SQLAlchemy, for comparison (see 'flask db benchmark').
+DB_PROFILES = {
+    "default" : {},
+    # Heroku's smallest PostgreSQL plans allow 20 connections, to be shared by
+    # all web workers (3 by default, see Procfile) and one-off dynos
+    "postgresql" : {
+        "compiled_cache" : 1000,
+        "engine" : {
+            "max_overflow" : 2,
+            "pool_pre_ping" : True,
+            "pool_recycle" : 1800,
+            "pool_size" : 3,
+            "pool_timeout" : 10
+        },
+        "statement_timeout" : 30000
+    },
+    # Keep connections open rather than reconnect (and re-run PRAGMAs) on each
+    # checkout. A pooled connection is only used by one thread at a time, so
+    # it may be handed to another thread later. In WAL mode, synchronous =
+    # NORMAL only syncs to disk at checkpoints, which is still safe from
+    # corruption (though not the last commits, on power loss).
+    "sqlite" : {
+        "compiled_cache" : 1000,
+        "engine" : {
+            "connect_args" : { "check_same_thread" : False },
+            "max_overflow" : 10,
+            "pool_size" : 5,
+            "poolclass" : QueuePool
+        },
+        "pragmas" : {
+            "busy_timeout" : 5000,
+            "cache_size" : -8000,
+            "journal_mode" : "wal",
+            "mmap_size" : 268435456,
+            "synchronous" : 1 # NORMAL
+        }
+    }
+}
 
 
 
 class BaseConfig(object):
     BCRYPT_LOG_ROUNDS = 10
+    CACHE_DEFAULT_TIMEOUT = 900
+    CACHE_TYPE = "simple"
+    CACHE_WARM_UP = (
+        "certificate_rows",
+        "find_all_unbound",
+        "share_class_dropdown",
+        "shareholder_dropdown",
+        "shareholder_rows",
+        "transaction_rows"
+    )
+    CACHE_WARM_UP_WORKERS = 2
+    DB_PROFILE = os.environ.get("DB_PROFILE")
     DEBUG = True
     SECRET_KEY = "AllYourBaseAreBelongToUs"
     SQLALCHEMY_DATABASE_URI = "sqlite:///sholdr.db"
@@ -18,6 +80,14 @@ class BaseConfig(object):
 
 
 class HerokuConfig(BaseConfig):
+    """
+    Several workers serve requests, so the cache must be one they all share:
+    Redis if available, otherwise files on local disk.
+    """
+    CACHE_DIR = os.path.join(tempfile.gettempdir(), "sholdr-cache")
+    CACHE_REDIS_URL = os.environ.get("REDIS_URL")
+    CACHE_THRESHOLD = 10000
+    CACHE_TYPE = "redis" if os.environ.get("REDIS_URL") else "filesystem"
     DEBUG = False
     SECRET_KEY = os.environ.get("SECRET_KEY")
     SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL")
@@ -0,0 +1,24 @@
+"""
+    This module contains the WTForm class that handles picking the date as of
+    which the register of shareholders is shown. The form is submitted with GET,
+    so that any past register has a URL of its own.
+"""
+
+from .validators import NotFutureDate
+from flask_wtf import FlaskForm
+from wtforms import DateField
+
+
+
+class RegisterForm(FlaskForm):
+    date = DateField(
+        label = "Show register as of",
+        render_kw = {
+            "placeholder" : "Pick a date",
+            "type" : "date"
+        },
+        validators = [ NotFutureDate() ]
+    )
+
+    class Meta:
+        csrf = False
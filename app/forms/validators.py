@@ -185,11 +185,11 @@ class Unique(object):
         self.stmt = sql["_COMMON"]["CHECK_IF_UNIQUE"](table, column)
 
     def __call__(self, form, field):
-        stmt = self.stmt.params(
+        rs = db.engine.execute(
+            self.stmt,
             id = form.id.data,
             unique_value = field.data
-        )
-        rs = db.engine.execute(stmt).fetchone()
+        ).fetchone()
         if rs.count:
             raise ValidationError(self.message)
 
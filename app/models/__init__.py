@@ -3,6 +3,13 @@
     customization of the ORM model classes.
 """
 
+from app.config import DB_PROFILES
+from app.util.engine import (
+    create_profiled_engine,
+    find_mismatches,
+    get_profile,
+    report_engine
+)
 from flask_sqlalchemy import (
     BaseQuery,
     Model,
@@ -11,7 +18,8 @@ from flask_sqlalchemy import (
 from sqlalchemy import (
     Column,
     DateTime,
-    func
+    func,
+    inspect
 )
 
 
@@ -21,7 +29,7 @@ def create_db(app):
     Create DB instance, passing in slightly customized base model and query
     classes.
     """
-    return SQLAlchemy(
+    return ProfiledSQLAlchemy(
         app,
         model_class = CustomModel,
         query_class = GetOrDefaultQuery
@@ -31,23 +39,76 @@ def create_db(app):
 
 def init_db(db):
     """
-    Fetch all models and create DB tables accordingly, if none exist. Also, if
-    needed, add one initial Shareholder to DB for handling the first login.
+    Fetch all models and create DB tables accordingly, if none exist, then bring
+    data from older schema versions up to date, and warn about any indexes that
+    are still missing. Also, if needed, add one initial Shareholder to DB for
+    handling the first login.
     """
     from . import (
         certificate,
+        checkpoint,
         share,
         shareclass,
         shareholder,
-        transaction
+        transaction,
+        unboundrange
+    )
+    from .migrations import (
+        find_missing_indexes,
+        migrate_db
     )
 
     try:
+        tables = inspect(db.engine).get_table_names()
         db.create_all()
+    except:
+        tables = None
+
+    # A failed migration is logged and stops the app, rather than letting it
+    # start on a half-migrated schema
+    if tables is not None:
+        try:
+            migrate_db(db, tables)
+        except:
+            db.app.logger.exception("Migrating the DB failed")
+            raise
+
+    try:
+        for index in find_missing_indexes(db):
+            db.app.logger.warning(
+                "Missing index %s on table %s" % (index.name, index.table.name,)
+            )
         create_initial_user(db)
     except:
         pass
 
+    # Reporting on the engine reads settings from the DB, which should not fail
+    # silently either, but neither should it stop the app
+    try:
+        log_engine_profile(db)
+    except Exception:
+        db.app.logger.exception("Reporting on the DB engine failed")
+
+    # Do not hand pooled connections down to workers forked after this (e.g.
+    # with gunicorn --preload), since they cannot share them
+    db.engine.dispose()
+
+
+
+def log_engine_profile(db):
+    """
+    Report the engine profile in use, and the settings that the DB actually
+    runs with. Warn if some of the profile did not take effect.
+    """
+    report = report_engine(db.engine)
+    db.app.logger.info("DB engine profile '%s': %s" % (
+        db.profile_name,
+        ", ".join([ "%s = %s" % (k, v,) for (k, v,) in report ]),
+    ))
+
+    for mismatch in find_mismatches(report, DB_PROFILES[db.profile_name]):
+        db.app.logger.warning("DB engine runs with %s" % mismatch)
+
 
 
 class CustomModel(Model):
@@ -66,6 +127,28 @@ class CustomModel(Model):
         onupdate = func.current_timestamp()
     )
 
+    def get_cache_tags(self):
+        """
+        Return the cache tags (see util/cache) that a write of this instance
+        affects. None by default; models with cached data override this.
+        """
+        return ()
+
+
+
+class ProfiledSQLAlchemy(SQLAlchemy):
+    """
+    Create the engine according to the engine profile set in config (see
+    config.DB_PROFILES), on top of the options flask-sqlalchemy works out.
+    """
+    def create_engine(self, sa_url, engine_opts):
+        (self.profile_name, profile,) = get_profile(
+            DB_PROFILES,
+            self.get_app().config.get("DB_PROFILE"),
+            sa_url
+        )
+        return create_profiled_engine(sa_url, engine_opts, profile)
+
 
 
 class GetOrDefaultQuery(BaseQuery):
@@ -98,6 +181,7 @@ def create_initial_user(db):
         s.pw_hash = "$2b$12$z1rBZ0ymCMCQtcVeZL0Oyu1Zzs1ypPrDPG0IbMsnok4HwdjCm3yzm"
         s.street = "43D Flarhgunnstow Avenue"
         s.zip_code = "4D3D3D3"
+        s.update_display_name()
 
         db.session.add(s)
         db.session.commit()
@@ -14,19 +14,23 @@
     Certificate's Shares are released, which then may be bundled to new/other
     Certificate(s).
 
-    The collection of Shares connected to a Certificate is fixed: therefore,
-    Certificates memorize some key points about that relationship (first_share,
-    last_share, share_count) to avoid having to query the DB over and again for
-    the same unchanging information.
+    The collection of Shares connected to a Certificate is fixed, and always
+    forms an uninterrupted sequence: therefore, the Certificate's own range
+    (first_share, last_share) IS the binding, and there is no need to store the
+    relationship share by share. Certificates also memorize their share_count
+    to avoid having to calculate the same unchanging information over and again.
+
+    The same goes for votes: the breakdown of a Certificate's shares by class
+    (and the votes they carry) is worked out once when the shares are bound, and
+    stored in a separate composition table, with the vote total also stored on
+    the Certificate itself. These only need recalculating when the number of
+    votes per share of some class changes (see ShareClass).
 
     Also, to simplify life a bit, Certificates remember their current owner.
     Doing this with a 'max-where-join' query through Transactions is needlessly
     heavy and results in bloated, hard-to-read queries.
 """
 
-import datetime
-import dateutil.parser as dtp
-
 from .mixins import (
     BaseMixin,
     IssuableMixin,
@@ -37,31 +41,59 @@ from app import (
     db,
     sql
 )
+from app.models.checkpoint import Checkpoint
 from app.models.share import Share
-from app.models.util import rs_to_dict_with_certificate_titles
+from app.models.unboundrange import UnboundRange
+from app.models.util import (
+    count_list_rows,
+    find_list_page,
+    rs_to_dict_with_certificate_titles
+)
 from app.util.util import (
+    find_overlapping_ranges,
     format_share_range,
-    rs_to_dict
+    rs_to_dict,
+    to_date
 )
 from sqlalchemy import (
     BigInteger,
     Column,
     ForeignKey,
-    String
+    Index,
+    inspect,
+    String,
+    text
 )
 
-# Join table handling many-to-many between Certificates and Shares
-shares = db.Table(
-    "certificate_share",
+# Table holding the number of shares and votes per class in each Certificate
+composition = db.Table(
+    "certificate_composition",
     Column(
-        "share_id",
-        BigInteger,
-        ForeignKey("share.id")
+        "certificate_id",
+        String(32),
+        ForeignKey("certificate.id"),
+        primary_key = True
     ),
     Column(
-        "certificate_id",
+        "share_class_id",
         String(32),
-        ForeignKey("certificate.id")
+        ForeignKey("share_class.id"),
+        primary_key = True
+    ),
+    Column(
+        "share_count",
+        BigInteger,
+        nullable = False
+    ),
+    Column(
+        "votes",
+        BigInteger,
+        nullable = False
+    ),
+    Index(
+        "ix_certificate_composition_share_class_id",
+        "share_class_id",
+        "certificate_id"
     )
 )
 
@@ -85,6 +117,41 @@ class Certificate(BaseMixin, IssuableMixin, UuidMixin, db.Model):
         ForeignKey("shareholder.id"),
         nullable = False
     )
+    votes = Column(
+        BigInteger,
+        default = 0,
+        nullable = False
+    )
+
+    __table_args__ = (
+        Index(
+            "ix_certificate_owner_id",
+            "owner_id",
+            "canceled_on",
+            "share_count"
+        ),
+        Index(
+            "ix_certificate_share_range",
+            "first_share",
+            "last_share",
+            "canceled_on"
+        ),
+        Index(
+            "ix_certificate_valid_share_range",
+            "first_share",
+            "last_share",
+            postgresql_where = text("canceled_on IS NULL"),
+            sqlite_where = text("canceled_on IS NULL")
+        )
+    )
+
+    def get_cache_tags(self):
+        owners = set(inspect(self).attrs.owner_id.history.deleted)
+        owners.add(self.owner_id)
+
+        return [ "certificate", "certificate:%s" % self.id, "shareholder" ] + [
+            "shareholder:%s" % id for id in owners if id
+        ]
 
     def get_status(self):
         if not self.canceled_on:
@@ -104,81 +171,99 @@ class Certificate(BaseMixin, IssuableMixin, UuidMixin, db.Model):
     @staticmethod
     def bind_shares(certificate):
         """
-        Handle the binding of a new certificate's (given as parameter) shares.
-        This is done with two custom statements that process several rows in one
-        query: one for updating the join table, and another for updating the
-        'is_bound' flag of all affected shares.
+        Save a new certificate (given as parameter) and handle the binding of
+        its shares, as one unit of work. Shares are bound simply by virtue of
+        falling within the range of a valid certificate, so nothing needs to be
+        written share by share; only the certificate's range is cut out of the
+        unbound ranges.
+
+        This is also the one time that the certificate's share composition and
+        total votes are calculated, with two custom statements. Ownership
+        checkpoints from the issue date onwards no longer hold, so those are
+        thrown away.
         """
-        stmt1 = sql["CERTIFICATE"]["BUNDLE_JOIN"].params(
-            id = certificate.id,
-            lower = certificate.first_share,
-            upper = certificate.last_share
-        )
-        stmt2 = sql["SHARE"]["BIND_OR_RELEASE_RANGE"].params(
-            is_bound = True,
-            lower = certificate.first_share,
-            upper = certificate.last_share
-        )
-        db.engine.execute(stmt1)
-        db.engine.execute(stmt2)
-        db.commit_and_flush_cache()
+        with db.unit_of_work():
+            certificate.save_or_update()
+            Checkpoint.invalidate_from(certificate.issued_on)
+            UnboundRange.remove(certificate.first_share, certificate.last_share)
+            db.session.execute(
+                sql["CERTIFICATE"]["COMPOSE"],
+                { "id" : certificate.id }
+            )
+            db.session.execute(
+                sql["CERTIFICATE"]["UPDATE_VOTES"],
+                { "id" : certificate.id }
+            )
 
 
 
     @staticmethod
-    @cache.cached(key_prefix = "certificate_list")
-    def get_all_for_list():
+    @cache.memoize(tags = ("certificate", "share", "shareholder",))
+    def count_for_list(search = ""):
         """
-        Fetch all certificates for the list view. Use a custom aggregate JOIN
-        query to include sum of votes per certificate in the result set.
+        Count valid certificates on the list, or those matching given search.
         """
-        stmt = sql["CERTIFICATE"]["FIND_ALL_FOR_LIST"]
-        rs = db.engine.execute(stmt)
+        return count_list_rows(sql["CERTIFICATE"]["COUNT_FOR_LIST"], search)
+
 
-        return rs_to_dict_with_certificate_titles(rs, "title")
+
+    @staticmethod
+    @cache.memoize(tags = ("certificate:{0}", "shareholder",))
+    def count_transactions(id, search = ""):
+        """
+        Count transactions done on a given certificate, or those matching given
+        search.
+        """
+        stmt = sql["CERTIFICATE"]["COUNT_TRANSACTION_HISTORY"]
+
+        return count_list_rows(stmt, search, id = id)
 
 
 
     @staticmethod
-    @cache.memoize()
+    @cache.memoize(tags = ("certificate:{0}", "shareholder",))
     def get_current_owner(id):
-        stmt = sql["CERTIFICATE"]["FIND_CURRENT_OWNER"].params(id = id)
-        rs = db.engine.execute(stmt).fetchone()
+        stmt = sql["CERTIFICATE"]["FIND_CURRENT_OWNER"]
+        rs = db.engine.execute(stmt, id = id).fetchone()
 
         return { "id" : rs.id, "name" : rs.name }
 
 
 
     @staticmethod
-    @cache.memoize()
+    @cache.memoize(tags = ("certificate", "share",))
     def get_earliest_possible_bundle_date(lower, upper):
         """
         For the given range of shares, find:
           1. the latest cancellation date of all certificates those shares have
              been part of;
-          2. the latest issue date of those shares (by definition the issue date
-             of the upper-bound share)
+          2. the latest issue date of those shares
         and return the maximum of those dates. This is the earliest date that
         all the shares in the range exist and are unbound; in other words, the
         earliest date that it is logically possible to bind them together.
+
+        Issue dates are looked up from the (cached, sorted) issued ranges with
+        binary search, so only past certificates need to be queried.
         """
-        stmt = sql["CERTIFICATE"]["FIND_EARLIEST_BUNDLE_DATE"].params(
-            lower = lower,
-            upper = upper
-        )
-        rs = db.engine.execute(stmt).fetchone()
+        stmt = sql["CERTIFICATE"]["FIND_LATEST_CANCELLATION"]
+        rs = db.engine.execute(stmt, lower = lower, upper = upper).fetchone()
 
-        if not rs.max:
+        dates = [ d for (a, b, d,) in find_overlapping_ranges(
+            (lower, upper,),
+            Share.get_issued_ranges()
+        ) ]
+        dates.append(to_date(rs.max))
+        dates = [ d for d in dates if d ]
+
+        if not dates:
             return None
-        elif isinstance(rs.max, datetime.date):
-            return rs.max
         else:
-            return dtp.parse(rs.max).date()
+            return max(dates)
 
 
 
     @staticmethod
-    @cache.memoize()
+    @cache.memoize(tags = ("certificate:{0}",))
     def get_last_transaction_date(id):
         """
         Fetch the date of the latest transaction done on a given certificate.
@@ -187,41 +272,53 @@ class Certificate(BaseMixin, IssuableMixin, UuidMixin, db.Model):
             table = "_transaction",
             column = "recorded_on",
             where = "certificate_id"
-        ).params(value = id)
-        rs = db.engine.execute(stmt).fetchone()
+        )
+        rs = db.engine.execute(stmt, value = id).fetchone()
 
-        if not rs.max:
-            return None
-        elif isinstance(rs.max, datetime.date):
-            return rs.max
-        else:
-            return dtp.parse(rs.max).date()
+        return to_date(rs.max)
 
 
 
     @staticmethod
-    @cache.memoize()
+    @cache.memoize(
+        stale = True,
+        tags = ("certificate", "share", "shareholder",)
+    )
+    def get_page_for_list(page):
+        """
+        Fetch one page of valid certificates (see util/paging) for the list
+        view, including owner names and (stored) sum of votes per certificate.
+        """
+        rs = find_list_page(sql["CERTIFICATE"]["FIND_PAGE_FOR_LIST"], page)
+
+        return rs_to_dict_with_certificate_titles(rs, "title")
+
+
+
+    @staticmethod
+    @cache.memoize(tags = ("certificate:{0}", "share_class",))
     def get_share_composition(id):
         """
         Fetch the quantity and sum votes of shares bound to given certificate,
-        broken down by share class.
+        broken down by share class (as stored when the shares were bound).
         """
-        stmt = sql["CERTIFICATE"]["CALCULATE_SHARE_COMPOSITION"].params(id = id)
-        rs = db.engine.execute(stmt)
+        stmt = sql["CERTIFICATE"]["FIND_SHARE_COMPOSITION"]
+        rs = db.engine.execute(stmt, id = id)
 
         return rs_to_dict(rs)
 
 
 
     @staticmethod
-    @cache.memoize()
-    def get_transactions(id):
+    @cache.memoize(tags = ("certificate:{0}", "shareholder",))
+    def get_transactions(id, page):
         """
-        Fetch all transactions done on a given certificate. Part of the needed
-        information requires join/aggregate querying.
+        Fetch one page (see util/paging) of transactions done on a given
+        certificate, in order of date (and id, for a stable order within one
+        day). Part of the needed information requires join querying.
         """
-        stmt = sql["CERTIFICATE"]["FIND_TRANSACTIONS"].params(id = id)
-        rs = db.engine.execute(stmt)
+        stmt = sql["CERTIFICATE"]["FIND_TRANSACTION_HISTORY_PAGE"]
+        rs = find_list_page(stmt, page, id = id)
 
         return rs_to_dict(rs)
 
@@ -231,12 +328,22 @@ class Certificate(BaseMixin, IssuableMixin, UuidMixin, db.Model):
     def release_shares(certificate):
         """
         Release the range of shares bound to a canceled certificate (given as
-        parameter) by setting the 'is_bound' flag of affected shares to 'false'.
+        parameter). Once the cancellation date is stored, the range no longer
+        counts as bound, so all that is left is to return it to the unbound
+        ranges, and to throw away ownership checkpoints that no longer hold.
         """
-        stmt = sql["SHARE"]["BIND_OR_RELEASE_RANGE"].params(
-            is_bound = False,
-            lower = certificate.first_share,
-            upper = certificate.last_share
-        )
-        db.engine.execute(stmt)
-        db.commit_and_flush_cache()
+        with db.unit_of_work():
+            Checkpoint.invalidate_from(certificate.canceled_on)
+            UnboundRange.add(certificate.first_share, certificate.last_share)
+
+
+
+    @staticmethod
+    def transfer(certificate, transaction):
+        """
+        Record given transaction on given certificate, and hand the certificate
+        over to the buyer, as one unit of work.
+        """
+        with db.unit_of_work():
+            certificate.owner_id = transaction.buyer_id
+            transaction.save_or_update()
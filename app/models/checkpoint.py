@@ -0,0 +1,132 @@
+"""
+    This module contains the Checkpoint model, which makes it possible to look
+    at the register as it stood on any given date (e.g. the record date of a
+    general meeting).
+
+    Ownership over time is recorded only implicitly: Certificates have issue
+    and cancellation dates, and Transactions tell when they changed hands. So in
+    principle, holdings on any date can be worked out by replaying all of that
+    history from the very beginning. To avoid doing so, Checkpoints store a
+    snapshot of who held which (valid) Certificate at the end of a given date.
+    Holdings on a later date are then worked out by starting from the latest
+    checkpoint before it, and replaying only the events in between.
+
+    Checkpoints are meant to be taken periodically (e.g. daily, from the CLI).
+    Since events can be recorded retroactively (a Transaction recorded today can
+    be dated last month), any write dated on or before a checkpoint makes that
+    checkpoint obsolete, and it is thrown away.
+"""
+
+import datetime
+
+from app import (
+    cache,
+    db,
+    sql
+)
+from app.models.util import rs_to_dict_with_certificate_titles
+from app.util.util import to_date
+from itertools import groupby
+from sqlalchemy import (
+    Column,
+    Date,
+    ForeignKey,
+    String
+)
+
+# Date from before any possible event, standing in for 'no checkpoint'
+NO_CHECKPOINT = datetime.date(1900, 1, 1)
+
+
+
+class Checkpoint(db.Model):
+    taken_on = Column(
+        Date,
+        primary_key = True
+    )
+    certificate_id = Column(
+        String(32),
+        ForeignKey("certificate.id"),
+        primary_key = True
+    )
+    owner_id = Column(
+        String(32),
+        ForeignKey("shareholder.id"),
+        nullable = False
+    )
+
+    __tablename__ = "ownership_checkpoint"
+
+
+
+    @staticmethod
+    def find_latest(date):
+        """
+        Return the date of the latest checkpoint on or before given date, or a
+        stand-in date preceding all events if there is none.
+        """
+        stmt = sql["CHECKPOINT"]["FIND_LATEST"]
+        rs = db.session.execute(stmt, { "date" : date }).fetchone()
+
+        return to_date(rs.max) or NO_CHECKPOINT
+
+
+
+    @staticmethod
+    @cache.memoize(tags = ("certificate", "share", "shareholder", "transaction",))
+    def get_holdings_as_of(date):
+        """
+        Work out which certificates were valid, and who held them, at the end of
+        given date. Return the result grouped by shareholder, as a list of dicts
+        with keys 'id', 'name', 'share_count', 'votes' and 'certificates'.
+        """
+        rs = db.session.execute(sql["CHECKPOINT"]["FIND_HOLDINGS_AS_OF"], {
+            "checkpoint" : Checkpoint.find_latest(date),
+            "date" : date
+        })
+        certificates = rs_to_dict_with_certificate_titles(rs, "title")
+
+        holdings = []
+        for (id, cs,) in groupby(certificates, key = lambda c: c["owner_id"]):
+            cs = list(cs)
+            holdings.append({
+                "certificates" : cs,
+                "id" : id,
+                "name" : cs[0]["owner"],
+                "share_count" : sum([ c["share_count"] for c in cs ]),
+                "votes" : sum([ c["votes"] for c in cs ])
+            })
+
+        return holdings
+
+
+
+    @staticmethod
+    def invalidate_from(date):
+        """
+        Throw away all checkpoints that an event on given date makes obsolete,
+        i.e. those taken on or after that date. This only stages the change:
+        committing is on method caller's responsibility.
+        """
+        if date:
+            db.session.execute(sql["CHECKPOINT"]["DELETE_FROM"], {
+                "date" : date
+            })
+
+
+
+    @staticmethod
+    def take(date):
+        """
+        Take a checkpoint of holdings at the end of given date (replacing one
+        already taken on that date, if any), and commit. The snapshot itself is
+        worked out from the previous checkpoint, so taking checkpoints regularly
+        keeps each one cheap. Checkpoints do not change what holdings are, so no
+        cached data is invalidated.
+        """
+        db.session.execute(sql["CHECKPOINT"]["DELETE_ON"], { "date" : date })
+        db.session.execute(sql["CHECKPOINT"]["INSERT_AS_OF"], {
+            "checkpoint" : Checkpoint.find_latest(date),
+            "date" : date
+        })
+        db.commit_and_invalidate()
@@ -0,0 +1,243 @@
+"""
+    This module handles migrating data from older versions of the DB schema to
+    the current one. db.create_all() only ever creates missing tables, so any
+    reshaping of existing data (or existing tables) has to be done here.
+
+    Migrations are numbered, and the DB keeps a record of which ones have been
+    applied in table 'schema_version'. On startup, every migration newer than
+    the latest applied one is run in order. (A DB that predates versioning
+    altogether counts as version 0.) On top of that, each migration checks for
+    itself whether the DB at hand needs it, so running one twice does no harm.
+
+    To evolve the schema, add a function with signature (db, tables) below and
+    append it to get_migrations(). Never renumber or remove old ones.
+"""
+
+import warnings
+
+from app import (
+    db,
+    sql
+)
+from sqlalchemy import (
+    Column,
+    DateTime,
+    exc,
+    func,
+    inspect,
+    Integer,
+    String
+)
+
+# Table recording which migrations have been applied, and when
+schema_version = db.Table(
+    "schema_version",
+    Column(
+        "version",
+        Integer,
+        primary_key = True
+    ),
+    Column(
+        "name",
+        String(64),
+        nullable = False
+    ),
+    Column(
+        "applied_on",
+        DateTime,
+        default = func.current_timestamp()
+    )
+)
+
+
+
+def get_migrations():
+    return [
+        (1, migrate_share_ledger,),
+        (2, populate_unbound_ranges,),
+        (3, populate_certificate_votes,),
+        (4, populate_shareholder_names,),
+        (5, create_missing_indexes,),
+        (6, replace_shareholder_name_index,),
+        (7, replace_transaction_indexes,)
+    ]
+
+
+
+def migrate_db(db, tables):
+    """
+    Run all migrations not yet applied to the DB at hand, given the names of the
+    tables that existed before db.create_all(). If there were none, the DB was
+    just created in its current form, so all migrations are only recorded as
+    applied without running them.
+    """
+    stmt = sql["_COMMON"]["FIND_MAX"]("schema_version", "version")
+    current = db.engine.execute(stmt).fetchone().max or 0
+
+    for (version, migration,) in get_migrations():
+        if version <= current:
+            continue
+        if tables:
+            migration(db, tables)
+
+        db.engine.execute(
+            sql["MIGRATION"]["RECORD_SCHEMA_VERSION"],
+            name = migration.__name__,
+            version = version
+        )
+
+
+
+def find_missing_indexes(db):
+    """
+    Compare the indexes declared on models against those that actually exist
+    in the DB, and return a list of the missing ones.
+    """
+    insp = inspect(db.engine)
+    tables = insp.get_table_names()
+    missing = []
+
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+
+        # reflecting partial indexes gives a harmless warning on PostgreSQL
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category = exc.SAWarning)
+            existing = [ i["name"] for i in insp.get_indexes(table.name) ]
+
+        missing.extend(sorted(
+            [ i for i in table.indexes if i.name not in existing ],
+            key = lambda i: i.name
+        ))
+
+    return missing
+
+
+
+def create_missing_indexes(db, tables):
+    """
+    Older versions declared no secondary indexes at all, and db.create_all()
+    does not add indexes to existing tables. So create whichever declared
+    indexes are missing.
+    """
+    with db.engine.begin() as conn:
+        for index in find_missing_indexes(db):
+            index.create(conn)
+
+
+
+def migrate_share_ledger(db, tables):
+    """
+    Older versions stored one row per share in table 'share', plus one row per
+    bound share in join table 'certificate_share'. Collapse the former into
+    ranges of consecutive shares with the same class and dates, and drop both
+    tables. (The join table holds nothing that the certificates' own ranges do
+    not already tell.) Everything is done in one transaction, so that a failed
+    migration leaves the old tables untouched.
+    """
+    if "share" not in tables:
+        return
+
+    with db.engine.begin() as conn:
+        conn.execute(sql["MIGRATION"]["COALESCE_LEGACY_SHARES"])
+        if "certificate_share" in tables:
+            conn.execute(sql["MIGRATION"]["DROP_LEGACY_JOIN_TABLE"])
+        conn.execute(sql["MIGRATION"]["DROP_LEGACY_SHARES"])
+
+
+
+def populate_unbound_ranges(db, tables):
+    """
+    Older versions had no table for unbound ranges, so when it has just been
+    created on top of existing shares, fill it in from scratch.
+    """
+    from .unboundrange import UnboundRange
+
+    if "unbound_range" in tables:
+        return
+    elif "share" not in tables and "share_range" not in tables:
+        return
+
+    UnboundRange.rebuild()
+    db.session.commit()
+
+
+
+def populate_certificate_votes(db, tables):
+    """
+    Older versions calculated certificates' share composition and votes on the
+    fly. When the composition table has just been created on top of existing
+    certificates, add the missing votes column (create_all does not touch
+    existing tables) and calculate everything in one go.
+    """
+    if "certificate_composition" in tables or "certificate" not in tables:
+        return
+
+    columns = [ c["name"] for c in inspect(db.engine).get_columns("certificate") ]
+
+    with db.engine.begin() as conn:
+        if "votes" not in columns:
+            conn.execute(sql["MIGRATION"]["ADD_CERTIFICATE_VOTES"])
+        conn.execute(sql["MIGRATION"]["COMPOSE_ALL_CERTIFICATES"])
+        conn.execute(sql["MIGRATION"]["UPDATE_ALL_CERTIFICATE_VOTES"])
+
+
+
+def populate_shareholder_names(db, tables):
+    """
+    Older versions had no display name or type-specific ID on the shareholder
+    table. Add the columns if missing, and fill them in from the subclass
+    tables.
+    """
+    if "shareholder" not in tables:
+        return
+
+    columns = [ c["name"] for c in inspect(db.engine).get_columns("shareholder") ]
+    if "display_name" in columns:
+        return
+
+    with db.engine.begin() as conn:
+        conn.execute(sql["MIGRATION"]["ADD_SHAREHOLDER_DISPLAY_NAME"])
+        conn.execute(sql["MIGRATION"]["ADD_SHAREHOLDER_TYPE_ID"])
+        conn.execute(sql["MIGRATION"]["SET_JURIDICAL_PERSON_NAMES"])
+        conn.execute(sql["MIGRATION"]["SET_NATURAL_PERSON_NAMES"])
+
+
+
+def replace_shareholder_name_index(db, tables):
+    """
+    The shareholder list is paged in order of (display_name, id), so the index
+    by display name now ends with id as well. Drop the older one and create
+    the new one.
+    """
+    if "shareholder" not in tables:
+        return
+
+    with db.engine.begin() as conn:
+        conn.execute(
+            sql["MIGRATION"]["DROP_INDEX"]("ix_shareholder_display_name")
+        )
+
+    create_missing_indexes(db, tables)
+
+
+
+def replace_transaction_indexes(db, tables):
+    """
+    Transaction histories are paged in order of (recorded_on, id), so indexes
+    by buyer, seller and certificate now end with id as well. Drop the older
+    ones, which only went as far as recorded_on, and create the new ones.
+    """
+    if "_transaction" not in tables:
+        return
+
+    with db.engine.begin() as conn:
+        for name in (
+            "ix_transaction_buyer_id",
+            "ix_transaction_certificate_id",
+            "ix_transaction_seller_id"
+        ):
+            conn.execute(sql["MIGRATION"]["DROP_INDEX"](name))
+
+    create_missing_indexes(db, tables)
@@ -23,14 +23,14 @@ class BaseMixin(object):
     def delete_if_exists(self):
         if inspect(self).persistent:
             db.session.delete(self)
-            db.commit_and_flush_cache()
+            db.commit_and_invalidate()
             return True
         return False
 
     def save_or_update(self):
         if inspect(self).transient:
             db.session.add(self)
-        db.commit_and_flush_cache()
+        db.commit_and_invalidate()
 
 
 
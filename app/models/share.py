@@ -1,7 +1,10 @@
 """
-    This module contains the Share model. Unlike other models, Shares use
-    sequential integers as the primary key, because this is how they are
-    identified and named in real life as well.
+    This module contains the Share model. Shares are identified and named by
+    sequential integers in real life, but they are NOT stored one row per share:
+    each row of the Share model stands for a contiguous range of shares [first,
+    last] that were issued on the same date and belong to the same share class.
+    This way the size of the table grows with the number of issuances, not with
+    the number of shares.
 
     Shares are THE key concept of the app, however they hold very little
     information or functionality. An individual Share is hardly interesting at
@@ -11,41 +14,59 @@
 
     The only reason Share is distinguished as a model in its own right, is that
     Certificates are not fixed over time (if they were, this would be soooo much
-    simpler...) i.e. one Share can over time "move" between Certificates.
+    simpler...) i.e. one Share can over time "move" between Certificates. Which
+    shares are bound at any given time is simply read off the ranges of valid
+    Certificates, so there is no need for a 'bound' flag or join table. (The
+    complement, i.e. which shares are unbound, is kept up to date separately by
+    the UnboundRange model.)
 
     Shares are a temporal entity: they are valid only between their dates of
     issuance and cancellation. Once canceled, a Share no longer can be bound to
     a Certificate.
 """
 
-import datetime
 import dateutil.parser as dtp
 
 from .mixins import IssuableMixin
+from .unboundrange import UnboundRange
 from app import (
     cache,
     db,
     sql
 )
-from app.util.util import get_consecutive_ranges
+from app.util.util import to_date
 from sqlalchemy import (
     BigInteger,
-    Boolean,
     Column,
     ForeignKey,
+    Index,
+    Integer,
     String
 )
 
+# Cache tags affected by writes that change the votes of any number of
+# Certificates at once, e.g. moving shares from one class to another
+CERTIFICATE_VOTES_TAGS = (
+    "certificate",
+    "certificate:*",
+    "share_class",
+    "shareholder",
+    "shareholder:*"
+)
+
 
 
 class Share(IssuableMixin, db.Model):
     id = Column(
-        BigInteger,
+        Integer,
         primary_key = True
     )
-    is_bound = Column(
-        Boolean,
-        default = False,
+    first_share = Column(
+        BigInteger,
+        nullable = False
+    )
+    last_share = Column(
+        BigInteger,
         nullable = False
     )
     share_class_id = Column(
@@ -54,16 +75,63 @@ class Share(IssuableMixin, db.Model):
         nullable = False
     )
 
+    __tablename__ = "share_range"
+    __table_args__ = (
+        Index(
+            "ix_share_range_last_share",
+            "last_share"
+        ),
+        Index(
+            "ix_share_range_share_class_id",
+            "share_class_id",
+            "first_share",
+            "last_share"
+        ),
+        Index(
+            "ix_share_range_share_range",
+            "first_share",
+            "last_share",
+            "issued_on"
+        )
+    )
+
+    def get_cache_tags(self):
+        return ("share",)
+
+
+
+    @staticmethod
+    @cache.cached(
+        key_prefix = "issued_share_ranges",
+        tags = ("share",)
+    )
+    def get_issued_ranges():
+        """
+        Return all issued ranges of shares as a sorted list of tuples (a, b, d)
+        where a = number of first and b = number of last share in range, and d =
+        date of issue. Use e.g. util.find_overlapping_ranges() to look up the
+        ranges relevant to some shares.
+        """
+        rs = db.engine.execute(sql["SHARE"]["FIND_ISSUED_RANGES"])
+
+        return [
+            (r.first_share, r.last_share, to_date(r.issued_on),)
+            for r in rs
+        ]
+
 
 
     @staticmethod
-    @cache.cached(key_prefix = "last_share_number")
+    @cache.cached(
+        key_prefix = "last_share_number",
+        tags = ("share",)
+    )
     def get_last_share_number():
         """
         Return the id number up to which shares have been issued, or zero if no
         shares have been issued.
         """
-        stmt = sql["_COMMON"]["FIND_MAX"]("share", "id")
+        stmt = sql["_COMMON"]["FIND_MAX"]("share_range", "last_share")
         rs = db.engine.execute(stmt).fetchone()
 
         if not rs.max:
@@ -74,36 +142,73 @@ class Share(IssuableMixin, db.Model):
 
 
     @staticmethod
-    @cache.cached(key_prefix = "latest_share_issue")
+    @cache.cached(
+        key_prefix = "latest_share_issue",
+        tags = ("share",)
+    )
     def get_latest_issue_date():
         """
         Return the date on which shares last were issued. If no shares have been
         issued, return a ridiculously ancient date.
         """
-        stmt = sql["_COMMON"]["FIND_MAX"]("share", "issued_on")
+        stmt = sql["_COMMON"]["FIND_MAX"]("share_range", "issued_on")
         rs = db.engine.execute(stmt).fetchone()
 
         if not rs.max:
             return dtp.parse("1900-01-01").date()
-        elif isinstance(rs.max, datetime.date):
-            return rs.max
         else:
-            return dtp.parse(rs.max).date()
+            return to_date(rs.max)
 
 
 
     @staticmethod
-    @cache.cached(key_prefix = "find_all_unbound")
+    @cache.cached(
+        key_prefix = "find_all_unbound",
+        tags = ("unbound_range",)
+    )
     def get_unbound_ranges():
         """
         Return ranges of shares currently not bound to a certificate. The ranges
         are indicated as a list of tuples (a, b) where a = number of first and
         b = number of last share in range.
+
+        The ranges are read off the maintained list of unbound ranges, so this
+        never needs to look at shares or certificates.
+        """
+        return UnboundRange.get_all()
+
+
+
+    @staticmethod
+    def issue(lower, upper, share_class_id, issued_on):
         """
-        stmt = sql["SHARE"]["FIND_ALL_BOUND_OR_UNBOUND"]
-        rs = db.engine.execute(stmt.params(is_bound = False))
+        Create new shares numbered lower to upper (inclusive) in the given class
+        and on the given date, and commit them in one go. Checking that the
+        numbers continue the existing sequence is on method caller's
+        responsibility.
+
+        The whole issue is recorded as one range, no matter how many shares it
+        holds. If it directly continues the previous issue (same date and class),
+        that range is extended instead. Return the range.
+        """
+        with db.unit_of_work():
+            s = Share.query.filter_by(
+                issued_on = issued_on,
+                last_share = lower - 1,
+                share_class_id = share_class_id
+            ).first()
+
+            if not s:
+                s = Share()
+                s.first_share = lower
+                s.issued_on = issued_on
+                s.share_class_id = share_class_id
+                db.session.add(s)
+
+            s.last_share = upper
+            UnboundRange.add(lower, upper)
 
-        return get_consecutive_ranges([ r.id for r in rs ])
+        return s
 
 
 
@@ -114,12 +219,69 @@ class Share(IssuableMixin, db.Model):
         as parameter. Note that checking form validity is on method caller's
         responsibility.
         """
-        lower = f.lower_bound.data
-        upper = f.upper_bound.data + 1
-
-        for i in range(lower, upper):
-            s = Share()
-            f.populate_obj(s)
-            s.id = i
-            db.session.add(s)
-        db.commit_and_flush_cache()
+        return Share.issue(
+            lower = f.lower_bound.data,
+            upper = f.upper_bound.data,
+            share_class_id = f.share_class_id.data,
+            issued_on = f.issued_on.data
+        )
+
+
+
+    @staticmethod
+    def reclassify(lower, upper, share_class_id):
+        """
+        Move shares numbered lower to upper (inclusive) into the given class,
+        and commit. Checking that the shares have been issued is on method
+        caller's responsibility.
+
+        Issued ranges are split where needed so that each range still has one
+        class, and then pieces that ended up adjacent with the same class and
+        issue date are joined back together. Finally, the share composition and
+        total votes of every valid certificate touching the range are worked
+        out again.
+        """
+        ranges = Share.query.filter(
+            Share.first_share <= upper + 1,
+            Share.last_share >= lower - 1
+        ).order_by(Share.first_share).all()
+
+        pieces = []
+        for r in ranges:
+            for (a, b, sc,) in (
+                (r.first_share, min(r.last_share, lower - 1), r.share_class_id,),
+                (max(r.first_share, lower), min(r.last_share, upper), share_class_id,),
+                (max(r.first_share, upper + 1), r.last_share, r.share_class_id,)
+            ):
+                if a > b:
+                    continue
+                elif pieces and pieces[-1][1:] == [ sc, r.issued_on ] \
+                        and pieces[-1][0][1] + 1 == a:
+                    pieces[-1][0] = (pieces[-1][0][0], b,)
+                else:
+                    pieces.append([ (a, b,), sc, r.issued_on ])
+
+        for (i, ((a, b,), sc, d,),) in enumerate(pieces):
+            if i < len(ranges):
+                s = ranges[i]
+            else:
+                s = Share()
+                db.session.add(s)
+            s.first_share = a
+            s.last_share = b
+            s.share_class_id = sc
+            s.issued_on = d
+        for s in ranges[len(pieces):]:
+            db.session.delete(s)
+
+        db.session.flush()
+        for stmt in (
+            "DELETE_COMPOSITIONS_IN_RANGE",
+            "COMPOSE_IN_RANGE",
+            "UPDATE_VOTES_IN_RANGE"
+        ):
+            db.session.execute(sql["CERTIFICATE"][stmt], {
+                "lower" : lower,
+                "upper" : upper
+            })
+        db.commit_and_invalidate(*CERTIFICATE_VOTES_TAGS)
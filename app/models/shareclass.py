@@ -4,20 +4,30 @@
     Share Classes are used to categorize Shares in terms of privilege: that is,
     Shares of different Classes confer different rights to their owner. For the
     purposes of this app, Share Class just quantifies voting rights.
+
+    Certificates store their votes (see Certificate), so whenever the number of
+    votes per share of a class changes, the stored votes of all Certificates
+    with shares of that class are recalculated along with it.
 """
 
 from .mixins import (
     BaseMixin,
     UuidMixin
 )
+from .share import CERTIFICATE_VOTES_TAGS
 from app import (
     cache,
     db,
     sql
 )
+from app.models.util import (
+    count_list_rows,
+    find_list_page
+)
 from app.util.util import rs_to_dict
 from sqlalchemy import (
     Column,
+    inspect,
     Integer,
     String
 )
@@ -37,36 +47,45 @@ class ShareClass(BaseMixin, UuidMixin, db.Model):
     )
     remarks = Column(String(255))
 
+    def get_cache_tags(self):
+        if inspect(self).persistent and inspect(self).attrs.votes.history.has_changes():
+            return ("share_class",) + CERTIFICATE_VOTES_TAGS
+        return ("share_class",)
+
+    def save_or_update(self):
+        if inspect(self).persistent and inspect(self).attrs.votes.history.has_changes():
+            ShareClass.update_certificate_votes(self.id, self.votes)
+        BaseMixin.save_or_update(self)
+
 
 
     @staticmethod
-    def count_shares_in_class(id):
+    @cache.memoize(tags = ("share", "share_class",))
+    def count_for_list(search = ""):
         """
-        Count how many shares belong to a given class.
+        Count share classes on the list, or those matching given search.
         """
-        stmt = sql["_COMMON"]["COUNT_WHERE"]("share", "share_class_id")
-        rs = db.engine.execute(stmt.params(value = id)).fetchone()
-
-        return rs.count
+        return count_list_rows(sql["SHARE_CLASS"]["COUNT_FOR_LIST"], search)
 
 
 
     @staticmethod
-    @cache.cached(key_prefix = "share_class_list")
-    def get_all_for_list():
+    def count_shares_in_class(id):
         """
-        Fetch all share classes for the list view, including number of shares
-        per class.
+        Count how many shares belong to a given class.
         """
-        stmt = sql["SHARE_CLASS"]["FIND_ALL_FOR_LIST"]
-        rs = db.engine.execute(stmt)
+        stmt = sql["SHARE_CLASS"]["COUNT_SHARES"]
+        rs = db.engine.execute(stmt, id = id).fetchone()
 
-        return rs_to_dict(rs)
+        return rs.count
 
 
 
     @staticmethod
-    @cache.cached(key_prefix = "share_class_dropdown")
+    @cache.cached(
+        key_prefix = "share_class_dropdown",
+        tags = ("share_class",)
+    )
     def get_dropdown_options():
         """
         Fetch all share classes with a simple query, and return an array of
@@ -76,3 +95,53 @@ class ShareClass(BaseMixin, UuidMixin, db.Model):
             (s.id, "%s (%s votes / share)" % (s.name, s.votes),)
             for s in db.engine.execute(sql["SHARE_CLASS"]["FIND_ALL_FOR_DROPDOWN"])
         ]
+
+
+
+    @staticmethod
+    @cache.memoize(tags = ("certificate", "share_class", "shareholder",))
+    def get_holders(id):
+        """
+        Fetch shareholders who currently own at least one share of a given
+        class, with the number of such shares and votes they grant per holder.
+        This is read off the stored certificate compositions, so shares and
+        share ranges need not be looked at.
+        """
+        stmt = sql["SHARE_CLASS"]["FIND_HOLDERS"]
+        rs = db.engine.execute(stmt, id = id)
+
+        return rs_to_dict(rs)
+
+
+
+    @staticmethod
+    @cache.memoize(
+        stale = True,
+        tags = ("share", "share_class",)
+    )
+    def get_page_for_list(page):
+        """
+        Fetch one page of share classes (see util/paging) for the list view,
+        including number of shares per class.
+        """
+        rs = find_list_page(sql["SHARE_CLASS"]["FIND_PAGE_FOR_LIST"], page)
+
+        return rs_to_dict(rs)
+
+
+
+    @staticmethod
+    def update_certificate_votes(id, votes):
+        """
+        Recalculate the stored votes of all certificates with shares of a given
+        class, according to the given number of votes per share. This only
+        stages the changes: committing is on method caller's responsibility.
+        """
+        db.session.execute(sql["SHARE_CLASS"]["UPDATE_COMPOSITION_VOTES"], {
+            "id" : id,
+            "votes" : votes
+        })
+        db.session.execute(
+            sql["SHARE_CLASS"]["UPDATE_CERTIFICATE_VOTES"],
+            { "id" : id }
+        )
@@ -10,6 +10,11 @@
     implements the methods required by flask-login. Email is used in place of
     username when logging in, possibly at some point also for verifying new
     users and/or resetting passwords.
+
+    Each subclass names its entities differently (e.g. 'last, first' vs. legal
+    entity name), so to keep queries from having to consult the subclass tables
+    just for a name, the base table carries a ready-made display name and type-
+    specific ID (NIN or business ID). These are refreshed on every save.
 """
 
 from .mixins import (
@@ -21,12 +26,23 @@ from app import (
     db,
     sql
 )
-from app.models.util import rs_to_dict_with_certificate_titles
-from app.util.util import rs_to_dict
+from app.models.share import Share
+from app.models.util import (
+    count_list_rows,
+    find_list_page,
+    rs_to_dict_with_certificate_titles
+)
+from app.util.util import (
+    format_share_range,
+    rs_to_dict
+)
+from itertools import groupby
 from sqlalchemy import (
     Boolean,
     Column,
     ForeignKey,
+    Index,
+    inspect,
     String
 )
 
@@ -70,11 +86,61 @@ class Shareholder(BaseMixin, UuidMixin, db.Model):
         nullable = False
     )
     type = Column(String(16))
+    display_name = Column(
+        String(255),
+        nullable = False
+    )
+    type_id = Column(
+        String(32),
+        nullable = False
+    )
+
+    # Formats of display name and type-specific ID, filled in with the entity
+    display_name_format = "{0.email}"
+    type_id_format = ""
 
     __mapper_args__ = {
         "polymorphic_identity" : "shareholder",
         "polymorphic_on" : type
     }
+    __table_args__ = (
+        Index(
+            "ix_shareholder_display_name_id",
+            "display_name",
+            "id"
+        ),
+    )
+
+    def get_cache_tags(self):
+        """
+        A change of name shows in pages of other entities too (e.g. as seller
+        or buyer of a transaction), so it affects all of them. The principal
+        (see get_principal) is affected only by changes to access rights.
+        """
+        state = inspect(self)
+        tags = ("shareholder", "shareholder:%s" % self.id,)
+
+        if not state.persistent:
+            return tags
+        if state.attrs.display_name.history.has_changes():
+            tags += ("certificate", "certificate:*", "shareholder:*", "transaction",)
+        if state.attrs.has_access.history.has_changes() \
+                or state.attrs.is_admin.history.has_changes() \
+                or self in state.session.deleted:
+            tags += ("principal:%s" % self.id,)
+        return tags
+
+    def save_or_update(self):
+        self.update_display_name()
+        BaseMixin.save_or_update(self)
+
+    def update_display_name(self):
+        """
+        Refresh display name and type-specific ID from the fields named in the
+        (subclass-specific) formats.
+        """
+        self.display_name = self.display_name_format.format(self)
+        self.type_id = self.type_id_format.format(self)
 
     def get_id(self):
         return self.id
@@ -103,21 +169,78 @@ class Shareholder(BaseMixin, UuidMixin, db.Model):
 
 
     @staticmethod
-    @cache.cached(key_prefix = "shareholder_list")
-    def get_all_for_list():
+    @cache.memoize(tags = ("shareholder",))
+    def count_for_list(search = ""):
         """
-        Fetch all shareholders with an aggregate/join query that gets the exact
-        fields and calculations needed on the list view.
+        Count shareholders on the list, or those matching given search.
         """
-        stmt = sql["SHAREHOLDER"]["FIND_ALL_FOR_LIST"]
-        rs = db.engine.execute(stmt)
+        return count_list_rows(sql["SHAREHOLDER"]["COUNT_FOR_LIST"], search)
+
+
+
+    @staticmethod
+    @cache.memoize(tags = ("share", "shareholder:{0}",))
+    def count_shareholder_transactions(id, search = ""):
+        """
+        Count transactions where given shareholder is either buyer or seller,
+        or those matching given search.
+        """
+        stmt = sql["SHAREHOLDER"]["COUNT_TRANSACTION_HISTORY"]
+
+        return count_list_rows(stmt, search, id = id)
+
 
-        return rs_to_dict(rs)
+
+    @staticmethod
+    def generate_cap_table():
+        """
+        Generate the cap table, i.e. all shareholders in possession of shares,
+        one at a time as dicts of basic information, with the shareholder's
+        valid certificates (and votes per certificate) under 'certificates'.
+
+        The whole table is read with one ordered query, and rows are grouped by
+        shareholder on the fly, so only one shareholder's rows are held in
+        memory at a time no matter the size of the register.
+        """
+        places = len(str(Share.get_last_share_number()))
+        stmt = sql["SHAREHOLDER"]["FIND_CAP_TABLE"]
+
+        with db.engine.connect() as conn:
+            rs = conn.execution_options(stream_results = True).execute(stmt)
+            for (id, rows,) in groupby(rs, key = lambda r: r.id):
+                rows = list(rows)
+                s = rows[0]
+                yield {
+                    "certificates" : [ {
+                        "id" : r.certificate_id,
+                        "share_count" : r.share_count,
+                        "title" : format_share_range(
+                            lower = r.first_share,
+                            upper = r.last_share,
+                            places = places
+                        ),
+                        "votes" : r.votes
+                    } for r in rows ],
+                    "city" : s.city,
+                    "country" : s.country,
+                    "email" : s.email,
+                    "id" : id,
+                    "name" : s.name,
+                    "share_count" : sum([ r.share_count for r in rows ]),
+                    "street" : s.street,
+                    "street_ext" : s.street_ext,
+                    "type_id" : s.type_id,
+                    "votes" : sum([ r.votes for r in rows ]),
+                    "zip_code" : s.zip_code
+                }
 
 
 
     @staticmethod
-    @cache.cached(key_prefix = "shareholder_dropdown")
+    @cache.cached(
+        key_prefix = "shareholder_dropdown",
+        tags = ("shareholder",)
+    )
     def get_dropdown_options():
         """
         Fetch all shareholders with a simple query, and return an array of
@@ -131,38 +254,74 @@ class Shareholder(BaseMixin, UuidMixin, db.Model):
 
 
     @staticmethod
-    @cache.memoize()
+    @cache.memoize(
+        stale = True,
+        tags = ("shareholder",)
+    )
+    def get_page_for_list(page):
+        """
+        Fetch one page of shareholders (see util/paging) with an aggregate/join
+        query that gets the exact fields and calculations needed on the list.
+        """
+        rs = find_list_page(sql["SHAREHOLDER"]["FIND_PAGE_FOR_LIST"], page)
+
+        return rs_to_dict(rs)
+
+
+
+    @staticmethod
+    @cache.memoize(tags = ("principal:{0}",))
+    def get_principal(id):
+        """
+        Fetch only what is needed to authenticate and authorize given
+        shareholder, i.e. a tuple (id, is_admin, has_access), or None if there
+        is no such shareholder. This is cached under tags of its own, so it
+        stays cached across writes, except those changing access rights.
+        """
+        stmt = sql["SHAREHOLDER"]["FIND_PRINCIPAL"]
+        rs = db.engine.execute(stmt, id = id).fetchone()
+
+        if not rs:
+            return None
+        else:
+            return (rs.id, rs.is_admin, rs.has_access,)
+
+
+
+    @staticmethod
+    @cache.memoize(tags = ("share", "shareholder:{0}",))
     def get_shareholder_certificates(id):
         """
         Fetch certificates (and some related aggregate data) currently owned by
         given shareholder.
         """
-        stmt = sql["SHAREHOLDER"]["FIND_CURRENT_CERTIFICATES"].params(id = id)
-        rs = db.engine.execute(stmt)
+        stmt = sql["SHAREHOLDER"]["FIND_CURRENT_CERTIFICATES"]
+        rs = db.engine.execute(stmt, id = id)
 
         return rs_to_dict_with_certificate_titles(rs, "title")
 
 
 
     @staticmethod
-    @cache.memoize()
+    @cache.memoize(tags = ("shareholder:{0}",))
     def get_shareholder_details(id):
         """
         Fetch the data of one shareholder needed on the details page.
         """
-        stmt = sql["SHAREHOLDER"]["FIND_DETAILS"].params(id = id)
-        return db.engine.execute(stmt).fetchone()
+        stmt = sql["SHAREHOLDER"]["FIND_DETAILS"]
+        return db.engine.execute(stmt, id = id).fetchone()
 
 
 
     @staticmethod
-    @cache.memoize()
-    def get_shareholder_transactions(id):
+    @cache.memoize(tags = ("share", "shareholder:{0}",))
+    def get_shareholder_transactions(id, page):
         """
-        Fetch transactions where given shareholder is either buyer or seller.
+        Fetch one page (see util/paging) of transactions where given shareholder
+        is either buyer or seller, in order of date (and id).
         """
-        stmt = sql["SHAREHOLDER"]["FIND_TRANSACTIONS"].params(id = id)
-        rs = db.engine.execute(stmt)
+        stmt = sql["SHAREHOLDER"]["FIND_TRANSACTION_HISTORY_PAGE"]
+        rs = find_list_page(stmt, page, id = id)
 
         return rs_to_dict_with_certificate_titles(rs, "certificate")
 
@@ -174,8 +333,8 @@ class Shareholder(BaseMixin, UuidMixin, db.Model):
         Check if shareholder either is current owner of a certificate, or has
         transaction history. If yes, return True; otherwise False.
         """
-        stmt = sql["SHAREHOLDER"]["COUNT_TRANSACTIONS"].params(id = id)
-        rs = db.engine.execute(stmt).fetchone()
+        stmt = sql["SHAREHOLDER"]["COUNT_TRANSACTIONS"]
+        rs = db.engine.execute(stmt, id = id).fetchone()
 
         return rs.count > 0
 
@@ -204,6 +363,9 @@ class NaturalPerson(Shareholder):
         nullable = False
     )
 
+    display_name_format = "{0.last_name}, {0.first_name}"
+    type_id_format = "{0.nin}"
+
     __mapper_args__ = {
         "polymorphic_identity" : "natural_person"
     }
@@ -230,6 +392,9 @@ class JuridicalPerson(Shareholder):
         nullable = False
     )
 
+    display_name_format = "{0.name}"
+    type_id_format = "{0.business_id}"
+
     __mapper_args__ = {
         "polymorphic_identity" : "juridical_person"
     }
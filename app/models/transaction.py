@@ -24,12 +24,18 @@ from app import (
     db,
     sql
 )
-from app.models.util import rs_to_dict_with_certificate_titles
+from app.models.checkpoint import Checkpoint
+from app.models.util import (
+    count_list_rows,
+    find_list_page,
+    rs_to_dict_with_certificate_titles
+)
 from sqlalchemy import (
     BigInteger,
     Column,
     Date,
     ForeignKey,
+    Index,
     String
 )
 
@@ -66,30 +72,85 @@ class Transaction(BaseMixin, UuidMixin, db.Model):
     remarks = Column(String(255))
 
     __tablename__ = "_transaction"
+    __table_args__ = (
+        Index(
+            "ix_transaction_buyer_history",
+            "buyer_id",
+            "recorded_on",
+            "id"
+        ),
+        Index(
+            "ix_transaction_certificate_history",
+            "certificate_id",
+            "recorded_on",
+            "id"
+        ),
+        Index(
+            "ix_transaction_recorded_on",
+            "recorded_on"
+        ),
+        Index(
+            "ix_transaction_seller_history",
+            "seller_id",
+            "recorded_on",
+            "id"
+        )
+    )
+
+
+
+    def get_cache_tags(self):
+        return (
+            "certificate:%s" % self.certificate_id,
+            "shareholder:%s" % self.buyer_id,
+            "shareholder:%s" % self.seller_id,
+            "transaction",
+            "transaction:%s" % self.id
+        )
+
+    def save_or_update(self):
+        """
+        A transaction changes ownership as of its date, so throw away ownership
+        checkpoints from that date onwards before saving.
+        """
+        Checkpoint.invalidate_from(self.recorded_on)
+        BaseMixin.save_or_update(self)
 
 
 
     @staticmethod
-    @cache.cached(key_prefix = "transaction_list")
-    def get_all_for_list():
+    @cache.memoize(tags = ("share", "shareholder", "transaction",))
+    def count_for_list(search = ""):
+        """
+        Count transactions on the list, or those matching given search.
+        """
+        return count_list_rows(sql["TRANSACTION"]["COUNT_FOR_LIST"], search)
+
+
+
+    @staticmethod
+    @cache.memoize(
+        stale = True,
+        tags = ("share", "shareholder", "transaction",)
+    )
+    def get_page_for_list(page):
         """
-        Fetch all transactions for the list view.
+        Fetch one page of transactions (see util/paging) for the list view.
         """
-        stmt = sql["TRANSACTION"]["FIND_ALL_FOR_LIST"]
-        rs = db.engine.execute(stmt)
+        rs = find_list_page(sql["TRANSACTION"]["FIND_PAGE_FOR_LIST"], page)
 
         return rs_to_dict_with_certificate_titles(rs, "title")
 
 
 
     @staticmethod
-    @cache.memoize()
+    @cache.memoize(tags = ("share", "shareholder", "transaction:{0}",))
     def get_transaction_details(id):
         """
         Fetch the data of one transaction needed on the details page.
         """
-        stmt = sql["TRANSACTION"]["FIND_DETAILS"].params(id = id)
-        rs = db.engine.execute(stmt)
+        stmt = sql["TRANSACTION"]["FIND_DETAILS"]
+        rs = db.engine.execute(stmt, id = id)
         t = rs_to_dict_with_certificate_titles(rs, "certificate")
 
         if not t:
@@ -0,0 +1,151 @@
+"""
+    This module contains the UnboundRange model, which is a maintained 'free
+    list' of shares that are issued but currently not bound to any Certificate.
+    Each row is one maximal range of such shares, i.e. ranges never overlap or
+    touch one another.
+
+    The same information could be worked out from Shares and Certificates at
+    any time (and rebuild() does just that), but doing so on every request is
+    wasteful. Instead, the ranges are updated incrementally whenever shares are
+    issued, bound or released: binding splits a range, while issuing and
+    releasing add a range and coalesce it with its neighbours.
+
+    Note that the methods here only stage changes in the DB session, and it is
+    on method caller's responsibility to commit.
+"""
+
+from app import (
+    db,
+    sql
+)
+from app.util.util import (
+    merge_ranges,
+    subtract_ranges
+)
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    Index,
+    Integer
+)
+
+
+
+class UnboundRange(db.Model):
+    id = Column(
+        Integer,
+        primary_key = True
+    )
+    first_share = Column(
+        BigInteger,
+        nullable = False
+    )
+    last_share = Column(
+        BigInteger,
+        nullable = False
+    )
+
+    __tablename__ = "unbound_range"
+    __table_args__ = (
+        Index(
+            "ix_unbound_range_last_share",
+            "last_share"
+        ),
+        Index(
+            "ix_unbound_range_share_range",
+            "first_share",
+            "last_share"
+        )
+    )
+
+    def get_cache_tags(self):
+        return ("unbound_range",)
+
+
+
+    @staticmethod
+    def add(lower, upper):
+        """
+        Mark shares lower to upper as unbound. If the range directly continues
+        an existing unbound range on either side, merge them into one.
+        """
+        left = UnboundRange.query.filter_by(last_share = lower - 1).first()
+        right = UnboundRange.query.filter_by(first_share = upper + 1).first()
+
+        if left and right:
+            left.last_share = right.last_share
+            db.session.delete(right)
+        elif left:
+            left.last_share = upper
+        elif right:
+            right.first_share = lower
+        else:
+            r = UnboundRange()
+            r.first_share = lower
+            r.last_share = upper
+            db.session.add(r)
+
+
+
+    @staticmethod
+    def get_all():
+        """
+        Return all unbound ranges as a sorted list of tuples (a, b) where a =
+        number of first and b = number of last share in range.
+        """
+        rs = db.engine.execute(sql["UNBOUND_RANGE"]["FIND_ALL"])
+        return [ (r.first_share, r.last_share,) for r in rs ]
+
+
+
+    @staticmethod
+    def rebuild():
+        """
+        Throw away the current unbound ranges, and work them out anew from
+        issued share ranges and the ranges of valid certificates. Both come out
+        of the DB sorted, so the difference is found in one pass over the two.
+        """
+        issued = db.session.execute(sql["SHARE"]["FIND_ISSUED_RANGES"])
+        bound = db.session.execute(sql["SHARE"]["FIND_BOUND_RANGES"])
+        ranges = subtract_ranges(
+            merge_ranges([ (r.first_share, r.last_share,) for r in issued ]),
+            [ (r.first_share, r.last_share,) for r in bound ]
+        )
+
+        UnboundRange.query.delete()
+        for (a, b,) in ranges:
+            r = UnboundRange()
+            r.first_share = a
+            r.last_share = b
+            db.session.add(r)
+
+
+
+    @staticmethod
+    def remove(lower, upper):
+        """
+        Mark shares lower to upper as bound, by cutting them out of the unbound
+        range that contains them. What is left on either side (if anything) stays
+        unbound. Checking that the whole range actually is unbound is on method
+        caller's responsibility.
+        """
+        r = UnboundRange.query.filter(
+            UnboundRange.first_share <= lower,
+            UnboundRange.last_share >= upper
+        ).first()
+
+        if not r:
+            return
+
+        if r.first_share < lower and upper < r.last_share:
+            right = UnboundRange()
+            right.first_share = upper + 1
+            right.last_share = r.last_share
+            db.session.add(right)
+            r.last_share = lower - 1
+        elif r.first_share < lower:
+            r.last_share = lower - 1
+        elif upper < r.last_share:
+            r.first_share = upper + 1
+        else:
+            db.session.delete(r)
@@ -1,11 +1,12 @@
 """
-    This module contains utility functions needed by more than one model class
-    (currently only one such function). The only reason for having this as a
-    separate module is that trying to stuff the function either into /util/util
-    or /models/__init__ causes cyclical dependencies, which seems to suggest
-    that the way I've organized my code is somehow flawed.
+    This module contains utility functions needed by more than one model class.
+    The only reason for having this as a separate module is that trying to stuff
+    the functions either into /util/util or /models/__init__ causes cyclical
+    dependencies, which seems to suggest that the way I've organized my code is
+    somehow flawed.
 """
 
+from app import db
 from app.models.share import Share
 from app.util.util import (
     format_share_range,
@@ -14,6 +15,40 @@ from app.util.util import (
 
 
 
+def count_list_rows(count, search = "", **params):
+    """
+    Count the rows of a list that match given search term, if any, with given
+    statement (see sql.count_list_rows) and parameters of the list query.
+    """
+    if search:
+        params["search"] = to_like_pattern(search)
+
+    return db.engine.execute(count(bool(search)), params).fetchone().count
+
+
+
+def find_list_page(find, page, **params):
+    """
+    Fetch one page (see util/paging) of a list with given statement (see
+    sql.find_list_page) and parameters of the list query. Return resultproxy,
+    so that the caller can convert the rows.
+    """
+    stmt = find(
+        after = bool(page.after),
+        descending = page.descending,
+        order = page.order,
+        search = bool(page.search)
+    )
+    params.update(limit = page.limit, offset = page.offset)
+    if page.after:
+        params.update(after_id = page.after[1], after_value = page.after[0])
+    if page.search:
+        params["search"] = to_like_pattern(page.search)
+
+    return db.engine.execute(stmt, params)
+
+
+
 def rs_to_dict_with_certificate_titles(rs, key):
     """
     Takes a query resultproxy, expecting that 'first_share' and 'last_share' are
@@ -34,3 +69,15 @@ def rs_to_dict_with_certificate_titles(rs, key):
         ) })
 
     return entities
+
+
+
+def to_like_pattern(search):
+    """
+    Turn search term into a LIKE pattern matching anything containing it, with
+    wildcards escaped (with '!') so that they are searched for as such.
+    """
+    for c in ("!", "%", "_",):
+        search = search.replace(c, "!" + c)
+
+    return "%%%s%%" % search
@@ -2,20 +2,42 @@
     This module collects all custom SQL statements into one dictionary, indexed
     by database entity. Statements are accessed with relevant entity name as
     first key, and reference to desired statement as second key, for example
-    sql["CERTIFICATE"]["FIND_ALL_FOR_LIST"].
+    sql["CERTIFICATE"]["FIND_CURRENT_OWNER"].
 
     Statements with variable table and/or column references are defined 'up
     front' as functions and then passed into the statement dictionary, so that
     the table/column names can be passed as parameters depending on context.
     Also, a couple of recurring subqueries are defined once and then plugged in
     to statements where applicable.
+
+    Statement functions are memoized, so that each distinct statement is built
+    only once, and the same statement object is handed out on every call. Along
+    with parameters being passed to execute (rather than bound to a copy of the
+    statement with .params), this lets SQLAlchemy compile each statement once
+    and then reuse the compiled form from the engine's compiled cache (see
+    models.ProfiledSQLAlchemy).
+
+    Statements are built for one DB dialect, so that where a dialect has a
+    faster way to say something, it can be used.
 """
 
-from sqlalchemy.sql import text
+from functools import (
+    lru_cache,
+    partial
+)
+from sqlalchemy import (
+    Date,
+    Integer
+)
+from sqlalchemy.sql import (
+    bindparam,
+    text
+)
 
 
 
-def get_statements():
+def get_statements(dialect = None):
+    @lru_cache(maxsize = None)
     def check_if_unique(table, column):
         return text(
             "SELECT"
@@ -25,6 +47,7 @@ def get_statements():
             " AND %s = :unique_value" % (table, column,)
         )
 
+    @lru_cache(maxsize = None)
     def count_all(table):
         return text(
             "SELECT"
@@ -32,6 +55,16 @@ def get_statements():
             " FROM %s" % table
         )
 
+    @lru_cache(maxsize = None)
+    def count_list_rows(query, search_columns, search):
+        return text(
+            "SELECT"
+            " COUNT(*) AS count"
+            " FROM ( %s ) _q"
+            " WHERE %s" % (query, match_search(search_columns, search),)
+        )
+
+    @lru_cache(maxsize = None)
     def count_where(table, column):
         return text(
             "SELECT"
@@ -40,6 +73,41 @@ def get_statements():
             " WHERE %s = :value" % (table, column,)
         )
 
+    def drop_index(name):
+        return text(
+            "DROP INDEX IF EXISTS %s" % name
+        )
+
+    # Those of given values that are found in given column, for checking many
+    # values at once (e.g. on import) instead of one query per value
+    @lru_cache(maxsize = None)
+    def find_existing(table, column):
+        return text(
+            "SELECT"
+            " %s AS value"
+            " FROM %s"
+            " WHERE %s IN :values" % (column, table, column,)
+        ).bindparams(bindparam("values", expanding = True))
+
+    # One page of a list (see util/paging), sorted by given column of the list
+    # query and then by id, starting either after the row with sort key
+    # :after_value and id :after_id, or at :offset
+    @lru_cache(maxsize = None)
+    def find_list_page(query, search_columns, order, descending, after, search):
+        return text(select_page(
+            query,
+            search_columns,
+            order,
+            descending,
+            after,
+            search,
+            "LIMIT :limit OFFSET :offset"
+        )).bindparams(
+            bindparam("limit", type_ = Integer),
+            bindparam("offset", type_ = Integer)
+        )
+
+    @lru_cache(maxsize = None)
     def find_max(table, column):
         return text(
             "SELECT"
@@ -47,6 +115,7 @@ def get_statements():
             " FROM %s" % (column, table,)
         )
 
+    @lru_cache(maxsize = None)
     def find_max_where(table, column, where):
         return text(
             "SELECT"
@@ -55,164 +124,601 @@ def get_statements():
             " WHERE %s = :value" % (column, table, where,)
         )
 
+    # Same as find_list_page, but for a list made up of several queries (e.g.
+    # one per indexed column, instead of an OR that no index can serve). Each
+    # query seeks and limits on its own, and their pages are merged.
+    @lru_cache(maxsize = None)
+    def find_merged_page(
+        queries,
+        search_columns,
+        order,
+        descending,
+        after,
+        search
+    ):
+        direction = "DESC" if descending else "ASC"
+
+        return text(
+            "SELECT"
+            " *"
+            " FROM ( %s ) _m"
+            " ORDER BY _m.%s %s, _m.id %s"
+            " LIMIT :limit OFFSET :offset" % (
+                " UNION ALL ".join([ "SELECT * FROM ( %s ) _p%s" % (
+                    select_page(
+                        query,
+                        search_columns,
+                        order,
+                        descending,
+                        after,
+                        search,
+                        "LIMIT :limit + :offset"
+                    ),
+                    i,
+                ) for (i, query,) in enumerate(queries) ]),
+                order,
+                direction,
+                direction,
+            )
+        ).bindparams(
+            bindparam("limit", type_ = Integer),
+            bindparam("offset", type_ = Integer)
+        )
+
+    def match_search(columns, search):
+        if not search:
+            return "1 = 1"
+
+        return "( %s )" % " OR ".join([
+            "LOWER(_q.%s) LIKE :search ESCAPE '!'" % c for c in columns
+        ])
+
+    def select_page(
+        query,
+        search_columns,
+        order,
+        descending,
+        after,
+        search,
+        limit
+    ):
+        (direction, op,) = ("DESC", "<",) if descending else ("ASC", ">",)
+        seek = "1 = 1"
+        if after:
+            # The first comparison alone is a range that an index can seek to,
+            # e.g. one on (column, id)
+            seek = ("_q.%s %s= :after_value"
+                " AND ( _q.%s %s :after_value OR _q.id %s :after_id )" % (
+                    order, op, order, op, op,
+                )
+            )
+
+        return (
+            "SELECT"
+            " *"
+            " FROM ( %s ) _q"
+            " WHERE %s"
+            " AND %s"
+            " ORDER BY _q.%s %s, _q.id %s"
+            " %s" % (
+                query,
+                match_search(search_columns, search),
+                seek,
+                order,
+                direction,
+                direction,
+                limit,
+            )
+        )
+
+    # Shares held are summed per shareholder with a correlated subquery (over
+    # the owner index on certificate), so that a page of the list only sums
+    # the certificates of the shareholders on it
     GET_SHAREHOLDER_DETAILS = ("SELECT"
-        " s.id, s.country, s.email, s.type, _s.name, _s.type_id,"
-        " COALESCE(_c.shares, 0) AS share_count"
+        " s.id, s.country, s.email, s.type, s.display_name AS name, s.type_id,"
+        " COALESCE(( SELECT"
+        " SUM(c.share_count)"
+        " FROM certificate c"
+        " WHERE c.owner_id = s.id"
+        " AND c.canceled_on IS NULL ), 0) AS share_count"
         " FROM shareholder s"
-        " JOIN ( SELECT"
-        " id, name, business_id AS type_id"
-        " FROM juridical_person"
-        " UNION SELECT"
-        " id, last_name || ', ' || first_name, nin"
-        " FROM natural_person ) _s"
-        " ON s.id = _s.id"
-        " LEFT JOIN ( SELECT"
-        " owner_id AS id, SUM(share_count) AS shares"
-        " FROM certificate"
-        " WHERE canceled_on IS NULL"
-        " GROUP BY owner_id ) _c"
-        " ON s.id = _c.id"
     )
 
-    GET_SHAREHOLDER_NAMES = ("SELECT"
-        " id, name FROM juridical_person"
-        " UNION SELECT id, last_name || ', ' || first_name"
-        " FROM natural_person"
+    LIST_CERTIFICATES = ("SELECT"
+        " c.id, c.first_share, c.last_share, c.share_count,"
+        " c.votes, _sh.display_name AS owner"
+        " FROM certificate c"
+        " JOIN shareholder _sh"
+        " ON _sh.id = c.owner_id"
+        " WHERE c.canceled_on IS NULL"
+    )
+
+    LIST_SHARE_CLASSES = ("SELECT"
+        " sc.id, sc.name, sc.votes, COALESCE(_s.count, 0) AS count"
+        " FROM share_class sc"
+        " LEFT JOIN ( SELECT"
+        " share_class_id AS id,"
+        " SUM(last_share - first_share + 1) AS count"
+        " FROM share_range"
+        " GROUP BY share_class_id ) _s"
+        " ON sc.id = _s.id"
     )
 
     GET_SELLERS_AND_BUYERS = (
-        " _s.name AS seller, _b.name AS buyer"
+        " _s.display_name AS seller, _b.display_name AS buyer"
         " FROM _transaction t"
-        " JOIN ( %s ) _s"
+        " JOIN shareholder _s"
         " ON _s.id = t.seller_id"
-        " JOIN ( %s ) _b"
+        " JOIN shareholder _b"
         " ON _b.id = t.buyer_id"
         " JOIN certificate c"
-        " ON c.id = t.certificate_id" % (GET_SHAREHOLDER_NAMES, GET_SHAREHOLDER_NAMES,)
+        " ON c.id = t.certificate_id"
+    )
+
+    LIST_TRANSACTIONS = ("SELECT"
+        " t.id, t.price, t.price_per_share, t.recorded_on,"
+        " c.first_share, c.last_share,"
+        " %s" % GET_SELLERS_AND_BUYERS
     )
 
-    GET_VOTES_PER_CERTIFICATE = ("SELECT"
-        " cs.certificate_id AS _id, SUM(sc.votes) AS votes"
-        " FROM certificate_share cs"
-        " JOIN share s"
-        " ON s.id = cs.share_id"
+    # Transaction histories, to be paged in order of (recorded_on, id) with
+    # the matching indexes on _transaction
+    CERTIFICATE_TRANSACTIONS = ("SELECT"
+        " t.id, t.price, t.price_per_share, t.recorded_on,"
+        " _s.display_name AS seller, _b.display_name AS buyer"
+        " FROM _transaction t"
+        " JOIN shareholder _s"
+        " ON _s.id = t.seller_id"
+        " JOIN shareholder _b"
+        " ON _b.id = t.buyer_id"
+        " WHERE t.certificate_id = :id"
+    )
+
+    SHAREHOLDER_TRANSACTIONS = (
+        "%s WHERE t.seller_id = :id"
+        " OR t.buyer_id = :id" % LIST_TRANSACTIONS
+    )
+
+    # The same history as one query per side of the transaction, each of which
+    # can be paged along its own index
+    SHAREHOLDER_SALES_AND_PURCHASES = (
+        "%s WHERE t.seller_id = :id" % LIST_TRANSACTIONS,
+        "%s WHERE t.buyer_id = :id"
+        " AND t.seller_id <> :id" % LIST_TRANSACTIONS,
+    )
+
+    # Number of shares in the overlap of certificate 'c' and share range 's'
+    # (i.e. MIN of last shares - MAX of first shares + 1), with the dialect's
+    # own functions for the smaller and larger of two values if it has them,
+    # and with CASE otherwise
+    if dialect == "postgresql":
+        OVERLAP_COUNT = ("(LEAST(c.last_share, s.last_share)"
+            " - GREATEST(c.first_share, s.first_share) + 1)"
+        )
+    elif dialect == "sqlite":
+        OVERLAP_COUNT = ("(MIN(c.last_share, s.last_share)"
+            " - MAX(c.first_share, s.first_share) + 1)"
+        )
+    else:
+        OVERLAP_COUNT = ("(CASE WHEN c.last_share < s.last_share"
+            " THEN c.last_share ELSE s.last_share END"
+            " - CASE WHEN c.first_share > s.first_share"
+            " THEN c.first_share ELSE s.first_share END + 1)"
+        )
+
+    JOIN_SHARE_RANGES = (
+        " JOIN share_range s"
+        " ON s.first_share <= c.last_share"
+        " AND s.last_share >= c.first_share"
         " JOIN share_class sc"
         " ON sc.id = s.share_class_id"
-        " GROUP BY _id"
     )
 
+    # Number of shares and votes per share class within certificate(s) 'c'
+    COMPOSE_CERTIFICATES = ("SELECT"
+        " c.id, sc.id, SUM(%s), SUM(%s * sc.votes)"
+        " FROM certificate c"
+        " %s" % (OVERLAP_COUNT, OVERLAP_COUNT, JOIN_SHARE_RANGES,)
+    )
+
+    # Valid certificates with at least one share within range :lower to :upper
+    VALID_CERTIFICATES_IN_RANGE = (
+        " c.canceled_on IS NULL"
+        " AND c.first_share <= :upper"
+        " AND c.last_share >= :lower"
+    )
+
+    SUM_CERTIFICATE_VOTES = ("SELECT"
+        " COALESCE(SUM(cc.votes), 0)"
+        " FROM certificate_composition cc"
+        " WHERE cc.certificate_id = certificate.id"
+    )
+
+    # Last transaction on each certificate between :checkpoint and :date, which
+    # PostgreSQL can pick in one pass with DISTINCT ON
+    if dialect == "postgresql":
+        LAST_TRANSACTIONS_AS_OF = ("SELECT"
+            " DISTINCT ON (t.certificate_id) t.certificate_id, t.buyer_id"
+            " FROM _transaction t"
+            " WHERE t.recorded_on > :checkpoint"
+            " AND t.recorded_on <= :date"
+            " ORDER BY t.certificate_id,"
+            " t.recorded_on DESC, t.created_on DESC, t.id DESC"
+        )
+    else:
+        LAST_TRANSACTIONS_AS_OF = ("SELECT"
+            " t.certificate_id, t.buyer_id"
+            " FROM _transaction t"
+            " WHERE t.recorded_on > :checkpoint"
+            " AND t.recorded_on <= :date"
+            " AND NOT EXISTS ( SELECT"
+            " _t.id"
+            " FROM _transaction _t"
+            " WHERE _t.certificate_id = t.certificate_id"
+            " AND _t.recorded_on <= :date"
+            " AND ( _t.recorded_on > t.recorded_on"
+            " OR ( _t.recorded_on = t.recorded_on"
+            " AND ( _t.created_on > t.created_on"
+            " OR ( _t.created_on = t.created_on AND _t.id > t.id ) ) ) ) )"
+        )
+
+    # Valid certificates and their owners at the end of :date, worked out from
+    # the checkpoint taken on :checkpoint, plus certificates issued and the last
+    # transaction on each certificate in between
+    HOLDINGS_AS_OF = ("SELECT"
+        " c.id, c.first_share, c.last_share, c.share_count, c.votes,"
+        " COALESCE(_t.buyer_id, _h.owner_id) AS owner_id"
+        " FROM ( SELECT"
+        " certificate_id AS id, owner_id"
+        " FROM ownership_checkpoint"
+        " WHERE taken_on = :checkpoint"
+        " UNION ALL SELECT"
+        " c.id, COALESCE(( SELECT"
+        " t.seller_id"
+        " FROM _transaction t"
+        " WHERE t.certificate_id = c.id"
+        " ORDER BY t.recorded_on ASC, t.created_on ASC, t.id ASC"
+        " LIMIT 1 ), c.owner_id)"
+        " FROM certificate c"
+        " WHERE c.issued_on > :checkpoint"
+        " AND c.issued_on <= :date ) _h"
+        " JOIN certificate c"
+        " ON c.id = _h.id"
+        " LEFT JOIN ( %s ) _t"
+        " ON _t.certificate_id = c.id"
+        " WHERE c.canceled_on IS NULL"
+        " OR c.canceled_on > :date" % LAST_TRANSACTIONS_AS_OF
+    )
+
+    # Dates of holdings and checkpoints, bound as dates so that they compare as
+    # such on every dialect
+    AS_OF_DATE = bindparam("date", type_ = Date)
+    CHECKPOINT_DATE = bindparam("checkpoint", type_ = Date)
+
     return {
         "_COMMON" : {
             "CHECK_IF_UNIQUE" : check_if_unique,
             "COUNT_ALL" : count_all,
             "COUNT_WHERE" : count_where,
+            "FIND_EXISTING" : find_existing,
             "FIND_MAX" : find_max,
             "FIND_MAX_WHERE" : find_max_where
         },
         "CERTIFICATE" : {
-            "BUNDLE_JOIN" : text(
+            "COMPOSE" : text(
                 "INSERT INTO"
-                " certificate_share (share_id, certificate_id)"
-                " SELECT s.id, :id"
-                " FROM share s"
-                " WHERE s.id >= :lower AND s.id <= :upper"
+                " certificate_composition"
+                " (certificate_id, share_class_id, share_count, votes)"
+                " %s"
+                " WHERE c.id = :id"
+                " GROUP BY c.id, sc.id" % COMPOSE_CERTIFICATES
             ),
-            "CALCULATE_SHARE_COMPOSITION" : text(
-                "SELECT"
-                " name, COUNT(*) AS count, SUM(votes) AS votes"
-                " FROM ( SELECT"
-                " sc.name, sc.votes"
-                " FROM certificate_share cs"
-                " JOIN share s"
-                " ON s.id = cs.share_id"
-                " JOIN share_class sc"
-                " ON sc.id = s.share_class_id"
-                " WHERE cs.certificate_id = :id ) _s"
-                " GROUP BY name"
+            "COMPOSE_IN_RANGE" : text(
+                "INSERT INTO"
+                " certificate_composition"
+                " (certificate_id, share_class_id, share_count, votes)"
+                " %s"
+                " WHERE %s"
+                " GROUP BY c.id, sc.id" % (
+                    COMPOSE_CERTIFICATES,
+                    VALID_CERTIFICATES_IN_RANGE,
+                )
+            ),
+            "COUNT_FOR_LIST" : partial(
+                count_list_rows,
+                LIST_CERTIFICATES,
+                ("owner",)
+            ),
+            "COUNT_TRANSACTION_HISTORY" : partial(
+                count_list_rows,
+                CERTIFICATE_TRANSACTIONS,
+                ("buyer", "seller",)
+            ),
+            "DELETE_COMPOSITIONS_IN_RANGE" : text(
+                "DELETE FROM certificate_composition"
+                " WHERE certificate_id IN ( SELECT"
+                " c.id"
+                " FROM certificate c"
+                " WHERE %s )" % VALID_CERTIFICATES_IN_RANGE
             ),
-            "FIND_ALL_FOR_LIST" : text(
+            "EXPORT" : text(
                 "SELECT"
-                " c.id, c.first_share, c.last_share, c.share_count,"
-                " _s.votes, _sh.name AS owner"
+                " c.id, c.first_share, c.last_share, c.share_count, c.votes,"
+                " c.issued_on, c.canceled_on,"
+                " c.owner_id, _sh.display_name AS owner"
                 " FROM certificate c"
-                " JOIN ( %s ) _s"
-                " ON c.id = _s._id"
-                " JOIN ( %s ) _sh"
+                " JOIN shareholder _sh"
                 " ON _sh.id = c.owner_id"
-                " WHERE c.canceled_on IS NULL"
-                " ORDER BY c.first_share ASC" % (GET_VOTES_PER_CERTIFICATE, GET_SHAREHOLDER_NAMES,)
+                " ORDER BY c.first_share ASC, c.issued_on ASC, c.id ASC"
+            ),
+            "FIND_CANCELED_IN_RANGE" : text(
+                "SELECT"
+                " first_share, last_share, canceled_on"
+                " FROM certificate"
+                " WHERE canceled_on IS NOT NULL"
+                " AND first_share <= :upper AND last_share >= :lower"
             ),
             "FIND_CURRENT_OWNER" : text(
                 "SELECT"
-                " c.owner_id AS id, _s.name"
+                " c.owner_id AS id, _s.display_name AS name"
                 " FROM certificate c"
-                " JOIN ( %s ) _s"
+                " JOIN shareholder _s"
                 " ON _s.id = c.owner_id"
-                " WHERE c.id = :id" % GET_SHAREHOLDER_NAMES
+                " WHERE c.id = :id"
             ),
-            "FIND_EARLIEST_BUNDLE_DATE" : text(
+            "FIND_LATEST_CANCELLATION" : text(
                 "SELECT"
-                " MAX(_s.date) AS max"
-                " FROM ( SELECT"
-                " MAX(issued_on) AS date"
-                " FROM share"
-                " WHERE id = :upper"
-                " UNION SELECT"
-                " MAX(c.canceled_on)"
+                " MAX(canceled_on) AS max"
+                " FROM certificate"
+                " WHERE first_share <= :upper AND last_share >= :lower"
+            ),
+            "FIND_PAGE_FOR_LIST" : partial(
+                find_list_page,
+                LIST_CERTIFICATES,
+                ("owner",)
+            ),
+            "FIND_SHARE_COMPOSITION" : text(
+                "SELECT"
+                " sc.name, cc.share_count AS count, cc.votes"
+                " FROM certificate_composition cc"
+                " JOIN share_class sc"
+                " ON sc.id = cc.share_class_id"
+                " WHERE cc.certificate_id = :id"
+                " ORDER BY sc.name ASC"
+            ),
+            "FIND_TRANSACTION_HISTORY_PAGE" : partial(
+                find_list_page,
+                CERTIFICATE_TRANSACTIONS,
+                ("buyer", "seller",)
+            ),
+            "FIND_VALID_BY_FIRST_SHARE" : text(
+                "SELECT"
+                " c.id, c.first_share, c.last_share, c.share_count,"
+                " c.owner_id, c.issued_on,"
+                " MAX(t.recorded_on) AS last_transaction"
                 " FROM certificate c"
-                " JOIN ( SELECT"
-                " DISTINCT(certificate_id) AS id"
-                " FROM certificate_share"
-                " WHERE share_id >= :lower AND share_id <= :upper ) cs"
-                " ON c.id = cs.id ) _s"
+                " LEFT JOIN _transaction t"
+                " ON t.certificate_id = c.id"
+                " WHERE c.canceled_on IS NULL"
+                " AND c.first_share IN :values"
+                " GROUP BY c.id, c.first_share, c.last_share, c.share_count,"
+                " c.owner_id, c.issued_on"
+            ).bindparams(bindparam("values", expanding = True)),
+            "UPDATE_OWNER" : text(
+                "UPDATE certificate"
+                " SET owner_id = :owner_id"
+                " WHERE id = :id"
             ),
-            "FIND_TRANSACTIONS" : text(
+            "UPDATE_VOTES" : text(
+                "UPDATE certificate"
+                " SET votes = ( %s )"
+                " WHERE id = :id" % SUM_CERTIFICATE_VOTES
+            ),
+            "UPDATE_VOTES_IN_RANGE" : text(
+                "UPDATE certificate"
+                " SET votes = ( %s )"
+                " WHERE id IN ( SELECT"
+                " c.id"
+                " FROM certificate c"
+                " WHERE %s )" % (
+                    SUM_CERTIFICATE_VOTES,
+                    VALID_CERTIFICATES_IN_RANGE,
+                )
+            )
+        },
+        "CHECKPOINT" : {
+            "DELETE_FROM" : text(
+                "DELETE FROM ownership_checkpoint"
+                " WHERE taken_on >= :date"
+            ).bindparams(AS_OF_DATE),
+            "DELETE_ON" : text(
+                "DELETE FROM ownership_checkpoint"
+                " WHERE taken_on = :date"
+            ).bindparams(AS_OF_DATE),
+            "FIND_HOLDINGS_AS_OF" : text(
+                "SELECT"
+                " _a.id, _a.first_share, _a.last_share, _a.share_count,"
+                " _a.votes, _a.owner_id, s.display_name AS owner"
+                " FROM ( %s ) _a"
+                " JOIN shareholder s"
+                " ON s.id = _a.owner_id"
+                " ORDER BY s.display_name ASC, _a.owner_id ASC,"
+                " _a.first_share ASC" % HOLDINGS_AS_OF
+            ).bindparams(AS_OF_DATE, CHECKPOINT_DATE),
+            "FIND_LATEST" : text(
                 "SELECT"
-                " t.price, t.price_per_share, t.recorded_on,"
-                " _s.name AS seller, _b.name AS buyer"
-                " FROM _transaction t"
-                " JOIN ( %s ) _s"
-                " ON _s.id = t.seller_id"
-                " JOIN ( %s ) _b"
-                " ON _b.id = t.buyer_id"
-                " WHERE t.certificate_id = :id"
-                " ORDER BY t.recorded_on ASC" % (GET_SHAREHOLDER_NAMES, GET_SHAREHOLDER_NAMES,)
+                " MAX(taken_on) AS max"
+                " FROM ownership_checkpoint"
+                " WHERE taken_on <= :date"
+            ).bindparams(AS_OF_DATE),
+            "INSERT_AS_OF" : text(
+                "INSERT INTO"
+                " ownership_checkpoint"
+                " (taken_on, certificate_id, owner_id, created_on, updated_on)"
+                " SELECT"
+                " :date, _a.id, _a.owner_id, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP"
+                " FROM ( %s ) _a" % HOLDINGS_AS_OF
+            ).bindparams(AS_OF_DATE, CHECKPOINT_DATE)
+        },
+        "MIGRATION" : {
+            "ADD_CERTIFICATE_VOTES" : text(
+                "ALTER TABLE certificate"
+                " ADD COLUMN votes BIGINT NOT NULL DEFAULT 0"
+            ),
+            "ADD_SHAREHOLDER_DISPLAY_NAME" : text(
+                "ALTER TABLE shareholder"
+                " ADD COLUMN display_name VARCHAR(255) NOT NULL DEFAULT ''"
+            ),
+            "ADD_SHAREHOLDER_TYPE_ID" : text(
+                "ALTER TABLE shareholder"
+                " ADD COLUMN type_id VARCHAR(32) NOT NULL DEFAULT ''"
+            ),
+            "COALESCE_LEGACY_SHARES" : text(
+                "INSERT INTO share_range"
+                " (first_share, last_share, share_class_id, issued_on,"
+                " canceled_on, created_on, updated_on)"
+                " SELECT"
+                " MIN(id), MAX(id), share_class_id, issued_on,"
+                " canceled_on, MIN(created_on), MAX(updated_on)"
+                " FROM ( SELECT"
+                " id, share_class_id, issued_on, canceled_on,"
+                " created_on, updated_on, id - ROW_NUMBER() OVER ("
+                " PARTITION BY share_class_id, issued_on, canceled_on"
+                " ORDER BY id ) AS grp"
+                " FROM share ) _s"
+                " GROUP BY grp, share_class_id, issued_on, canceled_on"
+            ),
+            "COMPOSE_ALL_CERTIFICATES" : text(
+                "INSERT INTO"
+                " certificate_composition"
+                " (certificate_id, share_class_id, share_count, votes)"
+                " %s"
+                " GROUP BY c.id, sc.id" % COMPOSE_CERTIFICATES
+            ),
+            "DROP_INDEX" : drop_index,
+            "DROP_LEGACY_JOIN_TABLE" : text(
+                "DROP TABLE certificate_share"
+            ),
+            "DROP_LEGACY_SHARES" : text(
+                "DROP TABLE share"
+            ),
+            "RECORD_SCHEMA_VERSION" : text(
+                "INSERT INTO"
+                " schema_version (version, name, applied_on)"
+                " VALUES (:version, :name, CURRENT_TIMESTAMP)"
+            ),
+            "SET_JURIDICAL_PERSON_NAMES" : text(
+                "UPDATE shareholder"
+                " SET display_name = ( SELECT"
+                " name"
+                " FROM juridical_person j"
+                " WHERE j.id = shareholder.id ),"
+                " type_id = ( SELECT"
+                " business_id"
+                " FROM juridical_person j"
+                " WHERE j.id = shareholder.id )"
+                " WHERE type = 'juridical_person'"
+            ),
+            "SET_NATURAL_PERSON_NAMES" : text(
+                "UPDATE shareholder"
+                " SET display_name = ( SELECT"
+                " last_name || ', ' || first_name"
+                " FROM natural_person n"
+                " WHERE n.id = shareholder.id ),"
+                " type_id = ( SELECT"
+                " nin"
+                " FROM natural_person n"
+                " WHERE n.id = shareholder.id )"
+                " WHERE type = 'natural_person'"
+            ),
+            "UPDATE_ALL_CERTIFICATE_VOTES" : text(
+                "UPDATE certificate"
+                " SET votes = ( %s )" % SUM_CERTIFICATE_VOTES
             )
         },
         "SHARE" : {
-            "BIND_OR_RELEASE_RANGE" : text(
-                "UPDATE share"
-                " SET is_bound = :is_bound"
-                " WHERE id >= :lower AND id <= :upper"
-            ),
-            "FIND_ALL_BOUND_OR_UNBOUND" : text(
-                "SELECT id FROM share"
-                " WHERE is_bound = :is_bound"
-                " ORDER BY id ASC"
+            "EXPORT" : text(
+                "SELECT"
+                " s.first_share, s.last_share,"
+                " s.last_share - s.first_share + 1 AS share_count,"
+                " sc.name AS share_class, sc.votes AS votes_per_share,"
+                " s.issued_on, s.canceled_on"
+                " FROM share_range s"
+                " JOIN share_class sc"
+                " ON sc.id = s.share_class_id"
+                " ORDER BY s.first_share ASC"
+            ),
+            "FIND_BOUND_RANGES" : text(
+                "SELECT"
+                " first_share, last_share"
+                " FROM certificate"
+                " WHERE canceled_on IS NULL"
+                " ORDER BY first_share ASC"
+            ),
+            "FIND_ISSUED_RANGES" : text(
+                "SELECT"
+                " first_share, last_share, issued_on"
+                " FROM share_range"
+                " ORDER BY first_share ASC"
             )
         },
         "SHARE_CLASS" : {
+            "COUNT_FOR_LIST" : partial(
+                count_list_rows,
+                LIST_SHARE_CLASSES,
+                ("name",)
+            ),
+            "COUNT_SHARES" : text(
+                "SELECT"
+                " COALESCE(SUM(last_share - first_share + 1), 0) AS count"
+                " FROM share_range"
+                " WHERE share_class_id = :id"
+            ),
             "FIND_ALL_FOR_DROPDOWN" : text(
                 "SELECT"
                 " id, name, votes"
                 " FROM share_class"
                 " ORDER BY name ASC"
             ),
-            "FIND_ALL_FOR_LIST" : text(
+            "FIND_HOLDERS" : text(
                 "SELECT"
-                " sc.id, sc.name, sc.votes, _s.count"
-                " FROM share_class sc"
-                " JOIN ( SELECT"
-                " sc.id, COUNT(s.id) AS count"
-                " FROM share_class sc"
-                " LEFT JOIN share s"
-                " ON sc.id = s.share_class_id"
-                " GROUP BY sc.id ) _s"
-                " ON sc.id = _s.id"
-                " ORDER BY sc.name ASC"
+                " s.id, s.display_name AS name, s.type_id,"
+                " SUM(cc.share_count) AS share_count, SUM(cc.votes) AS votes"
+                " FROM certificate_composition cc"
+                " JOIN certificate c"
+                " ON c.id = cc.certificate_id"
+                " JOIN shareholder s"
+                " ON s.id = c.owner_id"
+                " WHERE cc.share_class_id = :id"
+                " AND c.canceled_on IS NULL"
+                " GROUP BY s.id, s.display_name, s.type_id"
+                " ORDER BY s.display_name ASC"
+            ),
+            "FIND_PAGE_FOR_LIST" : partial(
+                find_list_page,
+                LIST_SHARE_CLASSES,
+                ("name",)
+            ),
+            "UPDATE_CERTIFICATE_VOTES" : text(
+                "UPDATE certificate"
+                " SET votes = ( %s )"
+                " WHERE id IN ( SELECT"
+                " certificate_id"
+                " FROM certificate_composition"
+                " WHERE share_class_id = :id )" % SUM_CERTIFICATE_VOTES
+            ),
+            "UPDATE_COMPOSITION_VOTES" : text(
+                "UPDATE certificate_composition"
+                " SET votes = share_count * :votes"
+                " WHERE share_class_id = :id"
             )
         },
         "SHAREHOLDER" : {
+            "COUNT_FOR_LIST" : partial(
+                count_list_rows,
+                GET_SHAREHOLDER_DETAILS,
+                ("country", "name", "type_id",)
+            ),
             "COUNT_TRANSACTIONS" : text(
                 "SELECT"
                 " COUNT(*) AS count"
@@ -224,45 +730,100 @@ def get_statements():
                 " WHERE seller_id = :id"
                 " OR buyer_id = :id ) _s"
             ),
+            "COUNT_TRANSACTION_HISTORY" : partial(
+                count_list_rows,
+                SHAREHOLDER_TRANSACTIONS,
+                ("buyer", "seller",)
+            ),
+            "EXPORT" : text(
+                "SELECT"
+                " s.id, s.type, s.display_name AS name, s.type_id, s.email,"
+                " s.street, s.street_ext, s.zip_code, s.city, s.country"
+                " FROM shareholder s"
+                " ORDER BY s.display_name ASC, s.id ASC"
+            ),
             "FIND_ALL_FOR_DROPDOWN" : text(
-                "%s ORDER BY name ASC" % GET_SHAREHOLDER_NAMES
+                "SELECT"
+                " id, display_name AS name"
+                " FROM shareholder"
+                " ORDER BY display_name ASC"
             ),
-            "FIND_ALL_FOR_LIST" : text(
-                "%s ORDER BY _s.name ASC" % GET_SHAREHOLDER_DETAILS
+            "FIND_BY_EMAIL" : text(
+                "SELECT"
+                " id, email"
+                " FROM shareholder"
+                " WHERE email IN :values"
+            ).bindparams(bindparam("values", expanding = True)),
+            "FIND_CAP_TABLE" : text(
+                "SELECT"
+                " s.id, s.display_name AS name, s.type_id, s.email,"
+                " s.street, s.street_ext, s.zip_code, s.city, s.country,"
+                " c.id AS certificate_id, c.first_share, c.last_share,"
+                " c.share_count, c.votes"
+                " FROM shareholder s"
+                " JOIN certificate c"
+                " ON c.owner_id = s.id"
+                " WHERE c.canceled_on IS NULL"
+                " ORDER BY s.display_name ASC, s.id ASC, c.first_share ASC"
             ),
             "FIND_CURRENT_CERTIFICATES" : text(
                 "SELECT"
-                " c.id, c.first_share, c.last_share, c.share_count, _s.votes"
+                " c.id, c.first_share, c.last_share, c.share_count, c.votes"
                 " FROM certificate c"
-                " JOIN ( %s ) _s"
-                " ON c.id = _s._id"
                 " WHERE c.canceled_on IS NULL"
-                " AND c.owner_id = :id" % GET_VOTES_PER_CERTIFICATE
+                " AND c.owner_id = :id"
             ),
             "FIND_DETAILS" : text(
                 "%s WHERE s.id = :id" % GET_SHAREHOLDER_DETAILS
             ),
-            "FIND_TRANSACTIONS" : text(
+            "FIND_PAGE_FOR_LIST" : partial(
+                find_list_page,
+                GET_SHAREHOLDER_DETAILS,
+                ("country", "name", "type_id",)
+            ),
+            "FIND_PRINCIPAL" : text(
                 "SELECT"
-                " t.price, t.price_per_share, t.recorded_on,"
-                " c.first_share, c.last_share,"
-                " %s WHERE t.seller_id = :id"
-                " OR t.buyer_id = :id"
-                " ORDER BY t.recorded_on ASC" % GET_SELLERS_AND_BUYERS
+                " id, has_access, is_admin"
+                " FROM shareholder"
+                " WHERE id = :id"
+            ),
+            "FIND_TRANSACTION_HISTORY_PAGE" : partial(
+                find_merged_page,
+                SHAREHOLDER_SALES_AND_PURCHASES,
+                ("buyer", "seller",)
             )
         },
         "TRANSACTION" : {
-            "FIND_ALL_FOR_LIST" : text(
+            "COUNT_FOR_LIST" : partial(
+                count_list_rows,
+                LIST_TRANSACTIONS,
+                ("buyer", "seller",)
+            ),
+            "EXPORT" : text(
                 "SELECT"
-                " t.id, t.price, t.price_per_share, t.recorded_on,"
-                " c.first_share, c.last_share,"
-                " %s ORDER BY t.recorded_on ASC" % GET_SELLERS_AND_BUYERS
+                " t.id, t.recorded_on, t.certificate_id, c.first_share,"
+                " c.last_share, t.seller_id, t.buyer_id, t.price,"
+                " t.price_per_share,"
+                " %s ORDER BY t.recorded_on ASC, t.id ASC" % GET_SELLERS_AND_BUYERS
             ),
             "FIND_DETAILS" : text(
                 "SELECT"
                 " t.price, t.price_per_share, t.recorded_on, t.remarks,"
                 " c.first_share, c.last_share,"
                 " %s WHERE t.id = :id" % GET_SELLERS_AND_BUYERS
+            ),
+            "FIND_PAGE_FOR_LIST" : partial(
+                find_list_page,
+                LIST_TRANSACTIONS,
+                ("buyer", "seller",)
+            )
+        },
+        "UNBOUND_RANGE" : {
+            "FIND_ALL" : text(
+                "SELECT"
+                " first_share, last_share"
+                " FROM unbound_range"
+                " ORDER BY first_share ASC"
             )
         }
     }
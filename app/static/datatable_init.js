@@ -2,15 +2,64 @@ var hack = $( 'script[src *= datatable_init]' );
 var root = hack.attr( 'data-root' );
 var tableIds = hack.attr( 'data-tableIds' ).split( ';' );
 
+/*
+ * Fetch pages of tables with a data source from the server (see util/paging).
+ * When moving on to a page whose preceding row is known from an earlier
+ * response, the sort key of that row is sent along ('after'), so that the
+ * server can seek straight to it. Cursors are forgotten whenever sorting or
+ * search changes.
+ */
+var pageLoader = function( source ) {
+    var cursors = {};
+    var query = null;
+
+    return function( data, callback ) {
+        var q = JSON.stringify( [ data.order, data.search.value, data.length ] );
+        if ( q !== query ) {
+            cursors = {};
+            query = q;
+        }
+
+        var params = {
+            'draw' : data.draw,
+            'length' : data.length,
+            'order[0][column]' : data.order[ 0 ].column,
+            'order[0][dir]' : data.order[ 0 ].dir,
+            'search[value]' : data.search.value,
+            'start' : data.start
+        };
+        if ( cursors[ data.start ] ) {
+            params[ 'after' ] = cursors[ data.start ];
+        }
+
+        $.getJSON( source, params, function( json ) {
+            cursors[ data.start + data.length ] = json.next;
+            callback( json );
+        });
+    };
+};
+
 $( document ).ready( function() {
     $.map( tableIds, function( tableId, i ) {
-        $( '#' + tableId ).DataTable( {
+        var table = $( '#' + tableId );
+        var options = {
             'lengthChange' : false
-        } );
+        };
+
+        if ( table.data( 'source' ) ) {
+            $.extend( options, {
+                'ajax' : pageLoader( table.data( 'source' ) ),
+                'deferLoading' : table.data( 'deferLoading' ),
+                'searchDelay' : 400,
+                'serverSide' : true
+            });
+        }
+
+        table.DataTable( options );
 
-        $( '#' + tableId ).on( 'click', 'tbody tr', function() {
+        table.on( 'click', 'tbody tr', function() {
             var href = $( this ).data( 'href' );
-            if ( href ) {
+            if ( href && root ) {
                 window.location.href = root + href;
             }
         });
@@ -29,18 +29,43 @@ login_manager.session_protection = "strong"
 
 
 
+class Principal(object):
+    """
+    Lightweight stand-in for a logged in Shareholder, holding only what is
+    needed for authentication and authorization. Implements the same methods
+    required by flask-login as the Shareholder model.
+    """
+    def __init__(self, id, is_admin, has_access):
+        self.has_access = has_access
+        self.id = id
+        self.is_admin = is_admin
+
+    def get_id(self):
+        return self.id
+
+    def is_active(self):
+        return self.has_access
+
+    def is_anonymous(self):
+        return False
+
+    def is_authenticated(self):
+        return True
+
+
+
 @login_manager.user_loader
-@cache.memoize()
 def load_user(user_id):
-    return Shareholder.query.get(user_id)
+    p = Shareholder.get_principal(user_id)
+    if not p:
+        return None
+
+    return Principal(*p)
 
 
 
 def logout_user_memoized():
-    cache.delete_memoized(
-        load_user,
-        current_user.id
-    )
+    cache.invalidate("principal:%s" % current_user.id)
     logout_user()
 
 
@@ -1,28 +1,397 @@
 """
-    This module sets up a cache instance using flask-caching. Timeout is quite
-    long (15 minutes), but this should not be a problem because the entire cache
-    is flushed at every non-read DB operation: this is done by defining a 'cache
-    clear + DB commit' function, which is then monkey patched to DB instance
-    ( ... :D )
+    This module sets up a cache instance using flask-caching, configured from
+    app config (CACHE_TYPE etc.) Timeout is quite long (15 minutes), but this
+    should not be a problem because cached data is invalidated at every non-read
+    DB operation that affects it.
+
+    Rather than flushing the entire cache on each write, cached entries carry
+    dependency 'tags', e.g. an entity type ("shareholder") or one entity of that
+    type ("shareholder:{0}", where {0} is filled in with the first argument of
+    the cached call). Each tag has a version number kept in the cache itself,
+    and the versions of an entry's tags are part of its key. A write then only
+    bumps the versions of the tags it affects, which leaves the entries that
+    depend on those tags unreachable (until they time out), and the rest intact.
+
+    Tags for one entity (e.g. "shareholder:42") also depend on the wildcard tag
+    of their type ("shareholder:*"), for writes that touch all entities of that
+    type at once.
+
+    Since tag versions are stored along with the data, invalidation is coherent
+    across processes whenever the cache itself is shared (e.g. a filesystem or
+    Redis cache), so the app can run with several workers.
+
+    Finally, the heaviest entries (listed in config as CACHE_WARM_UP) are
+    recomputed in background threads right after a write invalidates them, so
+    that the next visitor does not have to wait for them.
+
+    All of the above is instrumented per cached function, see util/metrics.
+
+    Tag versions also serve as ETags for whole pages (see conditional), so that
+    browsers can be told 'Not Modified' without rendering anything.
+
+    Models say which tags a write to them affects by implementing get_cache_tags.
+    Writes are committed with a 'collect tags + DB commit + invalidate tags'
+    function, which is monkey patched to DB instance ( ... :D ) So is a 'unit of
+    work' context manager, for operations that consist of several such writes
+    but should be committed (and invalidated) as one.
 """
 
+import datetime
+import hashlib
+import time
+
+from .metrics import CacheMetrics
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from flask import (
+    g,
+    make_response,
+    request,
+    Response,
+    session
+)
 from flask_caching import Cache
+from flask_login import current_user
+from functools import wraps
+from itertools import (
+    chain,
+    count
+)
+from sqlalchemy import event
+
+# Seconds between checks while waiting for someone else to compute an entry
+POLL_INTERVAL = 0.05
+
+
+
+class TaggedCache(Cache):
+    """
+    Extend the standard cache so that both @cache.cached and @cache.memoize
+    take a 'tags' parameter. Without tags, they work exactly as usual.
+
+    Tagged entries are also protected from stampedes: when an entry is missing,
+    only one caller (across all workers) computes it, while the others wait for
+    the result. With 'stale = True', the others get the previous value at once
+    instead, which suits heavy list queries whose results are only displayed.
+    (Do not use it for data that validation relies on.)
+    """
+    def __init__(self, *args, **kwargs):
+        self.metrics = CacheMetrics(self)
+        self.warm_up_counter = count(1)
+        self.warm_up_generations = {}
+        self.warm_up_pool = None
+        self.warmers = {}
+        Cache.__init__(self, *args, **kwargs)
+
+    def init_app(self, app, config = None):
+        Cache.init_app(self, app, config)
+        self.app = app
+        self.lock_timeout = app.config.get("CACHE_LOCK_TIMEOUT", 30)
+        self.warm_up_keys = app.config.get("CACHE_WARM_UP", ())
+
+        if self.warm_up_keys:
+            self.warm_up_pool = ThreadPoolExecutor(
+                max_workers = app.config.get("CACHE_WARM_UP_WORKERS", 2)
+            )
+
+    def cached(
+        self,
+        timeout = None,
+        key_prefix = "view/%s",
+        tags = (),
+        stale = False,
+        **kwargs
+    ):
+        if not tags:
+            return Cache.cached(self, timeout, key_prefix, **kwargs)
+
+        decorator = self.tagged(
+            tags,
+            timeout,
+            stale,
+            lambda f: key_prefix,
+            lambda f, args, kwargs: key_prefix
+        )
+
+        def register_warmer(f):
+            decorated_function = decorator(f)
+            self.warmers[key_prefix] = (decorated_function, set(tags),)
+            return decorated_function
+        return register_warmer
+
+    def memoize(self, timeout = None, tags = (), stale = False, **kwargs):
+        if not tags:
+            return Cache.memoize(self, timeout, **kwargs)
+
+        def make_key(f, args, kwargs):
+            return "%s.%s%s%s" % (
+                f.__module__,
+                f.__qualname__,
+                repr(args),
+                repr(sorted(kwargs.items())),
+            )
+
+        return self.tagged(
+            tags,
+            timeout,
+            stale,
+            lambda f: f.__qualname__,
+            make_key
+        )
+
+    def tagged(self, tags, timeout, stale, make_name, make_key):
+        def decorator(f):
+            name = make_name(f)
+
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                versions = self.get_tag_versions([
+                    tag.format(*args, **kwargs) for tag in tags
+                ])
+                return self.get_or_compute(
+                    name,
+                    make_key(f, args, kwargs),
+                    versions,
+                    lambda: f(*args, **kwargs),
+                    timeout,
+                    stale
+                )
+            return decorated_function
+        return decorator
+
+    def conditional(self, *tags):
+        """
+        Decorate view so that its response carries an ETag (and Last-Modified
+        date) derived from the versions of given tags, which may refer to view
+        arguments, e.g. "shareholder:{id}". If the browser already has a page
+        with that ETag, answer '304 Not Modified' without calling the view at
+        all. ETags are per user, since pages differ by user rights.
+
+        Views that render forms (with CSRF tokens) must not use this. Pages are
+        always rendered when there are flashed messages waiting to be shown.
+        Pages rendered with stale entries (see get_or_compute) get no ETag, so
+        that the browser does not hold on to them as current.
+        """
+        def decorator(f):
+            @wraps(f)
+            def decorated_view(*args, **kwargs):
+                if session.get("_flashes"):
+                    return f(*args, **kwargs)
+
+                user_id = current_user.get_id()
+                versions = self.get_tag_versions([
+                    tag.format(**kwargs) for tag in tags
+                ] + [ "principal:%s" % user_id ])
+                etag = hashlib.md5(("%s|%s|%s" % (
+                    request.full_path,
+                    user_id,
+                    versions,
+                )).encode("utf-8")).hexdigest()
+                modified = datetime.datetime.utcfromtimestamp(
+                    max([ int(v) for v in versions.split(".") ]) / 1000
+                )
+
+                if request.if_none_match.contains(etag):
+                    rv = Response(status = 304)
+                else:
+                    g.pop("cache_served_stale", None)
+                    rv = make_response(f(*args, **kwargs))
+                    if rv.status_code != 200:
+                        return rv
+                    if g.pop("cache_served_stale", False):
+                        rv.headers["Cache-Control"] = "no-store"
+                        return rv
+
+                rv.set_etag(etag)
+                rv.last_modified = modified
+                rv.headers["Cache-Control"] = "private, no-cache"
+                return rv
+            return decorated_view
+        return decorator
+
+    def get_or_compute(self, name, base_key, versions, compute, timeout, stale):
+        """
+        Return cached value for given key and tag versions, computing it if
+        needed, but only if no one else already is. Values are stored wrapped
+        in a tuple, so that None can be cached too. Serving a stale value is
+        noted on flask.g, for conditional.
+        """
+        key = "%s/%s" % (base_key, versions)
+        rv = self.get(key)
+        if rv is not None:
+            self.metrics.record(name, hits = 1)
+            return rv[0]
+
+        self.metrics.record_miss(name, key)
+        lock = "lock/%s" % key
+        locked = self.add(lock, True, timeout = self.lock_timeout)
+        if not locked:
+            rv = self.get("stale/%s" % base_key) if stale else None
+            if rv is not None:
+                self.metrics.record(name, stale_served = 1)
+                g.cache_served_stale = True
+                return rv[0]
+
+            rv = self.wait_for(key, lock)
+            if rv is not None:
+                self.metrics.record(name, waited = 1)
+                return rv[0]
+
+            # No value came, so compute it here, taking over the lock if it
+            # has been released (but never releasing someone else's)
+            locked = self.add(lock, True, timeout = self.lock_timeout)
+
+        try:
+            started = time.time()
+            rv = (compute(),)
+            self.metrics.record_computed(name, key, rv, time.time() - started)
+            self.set(key, rv, timeout = timeout)
+            if stale:
+                self.set("stale/%s" % base_key, rv, timeout = timeout)
+        finally:
+            if locked:
+                self.delete(lock)
+
+        return rv[0]
+
+    def wait_for(self, key, lock):
+        """
+        Poll until a value appears under given key, or until given lock has
+        been released (or has expired) without one. Return value or None.
+        """
+        deadline = time.time() + self.lock_timeout
+        while time.time() < deadline:
+            time.sleep(POLL_INTERVAL)
+            rv = self.get(key)
+            if rv is not None or self.get(lock) is None:
+                return rv
+
+        return None
+
+    def warm_up(self, tags):
+        """
+        Recompute, in the background, those entries listed for warm-up which
+        depend on given (just invalidated) tags. A warm-up of the same entry
+        still queued from an earlier write is dropped, since this supersedes
+        it; warm-ups of other entries are left alone.
+
+        A warm-up that is already running is let finish. It read the tag
+        versions before computing, so should a newer write come in meanwhile,
+        its result is stored under the older versions and never served.
+        """
+        if not self.warm_up_pool:
+            return
+
+        for key in self.warm_up_keys:
+            (f, dependencies,) = self.warmers.get(key, (None, set(),))
+            if f and dependencies & set(tags):
+                generation = next(self.warm_up_counter)
+                self.warm_up_generations[key] = generation
+                self.warm_up_pool.submit(self.run_warm_up, generation, key, f)
+
+    def run_warm_up(self, generation, key, f):
+        if generation != self.warm_up_generations.get(key):
+            self.metrics.record(key, warm_ups_canceled = 1)
+            return
+
+        with self.app.app_context():
+            try:
+                f()
+                self.metrics.record(key, warmed_up = 1)
+            except Exception as e:
+                self.app.logger.warning("Warm-up of %s failed: %s" % (key, e,))
+
+    def get_tag_versions(self, tags):
+        """
+        Return the current versions of given tags (and the wildcard tags they
+        imply) as one string. Tags with no version yet get one.
+        """
+        tags = sorted(set(tags) | set([
+            "%s:*" % tag.split(":")[0] for tag in tags if ":" in tag
+        ]))
+        versions = self.get_many(*[ "tag/%s" % tag for tag in tags ])
+
+        for (i, v,) in enumerate(versions):
+            if v is None:
+                self.add("tag/%s" % tags[i], get_fresh_version(), timeout = 0)
+                versions[i] = self.get("tag/%s" % tags[i])
+
+        return ".".join([ str(v) for v in versions ])
+
+    def invalidate(self, *tags):
+        """
+        Bump the versions of given tags. A version never goes backwards, even if
+        the old one has been evicted, because it is seeded with current time.
+        """
+        for tag in set(tags):
+            v = self.get("tag/%s" % tag) or 0
+            self.set("tag/%s" % tag, max(v + 1, get_fresh_version()), timeout = 0)
 
 
 
 def create_cache(app, db):
-    cache = Cache(config = {
-        "CACHE_DEFAULT_TIMEOUT" : 900,
-        "CACHE_TYPE" : "simple"
-    })
+    cache = TaggedCache()
     cache.init_app(app)
 
     with app.app_context():
         cache.clear()
 
-    def commit_and_flush_cache():
-        cache.clear()
+    @event.listens_for(db.session, "before_flush")
+    def collect_cache_tags(session, context, instances):
+        """
+        Collect tags from pending changes as they are flushed, while change
+        history still is available, so that tags are not lost when changes get
+        (auto)flushed before commit.
+        """
+        tags = session.info.setdefault("cache_tags", set())
+        for o in chain(session.new, session.dirty, session.deleted):
+            tags.update(o.get_cache_tags())
+
+    def commit_and_invalidate(*tags):
+        """
+        Commit, then invalidate cache tags affected by the committed changes,
+        plus given extra tags (for changes made with raw SQL statements).
+        Within a unit of work, only flush, and leave the rest to the unit.
+        """
+        db.session.flush()
+        tags = set(tags) | db.session.info.pop("cache_tags", set())
+        if db.session.info.get("units_of_work"):
+            db.session.info["cache_tags"] = tags
+            return
+
         db.session.commit()
+        cache.invalidate(*tags)
+        cache.warm_up(tags)
+
+    @contextmanager
+    def unit_of_work(*tags):
+        """
+        Run the writes within the block in one DB transaction, committed once at
+        the end of the block, after which the tags collected on the way (plus
+        given extra tags) are invalidated once. If the block raises, everything
+        is rolled back and nothing invalidated. Within an enclosing unit, the
+        outermost one commits.
+        """
+        info = db.session.info
+        depth = info.get("units_of_work", 0)
+        info["units_of_work"] = depth + 1
+        try:
+            yield
+        except:
+            if not depth:
+                db.session.rollback()
+                info.pop("cache_tags", None)
+            raise
+        finally:
+            info["units_of_work"] = depth
+
+        commit_and_invalidate(*tags)
 
-    db.commit_and_flush_cache = commit_and_flush_cache
+    db.commit_and_invalidate = commit_and_invalidate
+    db.unit_of_work = unit_of_work
     return cache
+
+
+
+def get_fresh_version():
+    return int(time.time() * 1000)
@@ -0,0 +1,185 @@
+"""
+    This module creates DB engines according to the engine profiles in config
+    (see config.DB_PROFILES), reports what settings an engine actually runs
+    with, and benchmarks profiles against each other.
+
+    A profile is applied on top of what flask-sqlalchemy would do anyway, so an
+    empty profile ('default') gives the plain engine. SQLite PRAGMAs are per
+    connection (except journal_mode, which sticks to the DB file), so they are
+    run on every new connection, which is also why the SQLite profile pools its
+    connections instead of opening a new one for each checkout.
+
+    Statements are compiled once and then reused from the engine's compiled
+    cache, which is bounded (least recently used statements are dropped) since
+    list queries come in many variants (see sql.find_list_page).
+"""
+
+import sqlalchemy
+import statistics
+import time
+
+from sqlalchemy import event
+from sqlalchemy.util import LRUCache
+
+# Backends that DB URLs may still name by an older alias (e.g. Heroku's
+# DATABASE_URL, which starts with 'postgres://')
+BACKEND_ALIASES = {
+    "postgres" : "postgresql"
+}
+
+# PRAGMAs read back when reporting on a SQLite engine
+REPORTED_PRAGMAS = (
+    "busy_timeout",
+    "cache_size",
+    "journal_mode",
+    "mmap_size",
+    "synchronous"
+)
+
+# Scratch table written to (and dropped) by benchmarks
+SCRATCH_TABLE = "benchmark_scratch"
+
+
+
+def get_backend(sa_url):
+    """
+    Return the name of the DB backend of given DB URL, e.g. 'postgresql'.
+    """
+    name = sa_url.get_backend_name()
+    return BACKEND_ALIASES.get(name, name)
+
+
+
+def get_profile(profiles, name, sa_url):
+    """
+    Return the name and contents of the profile to use for given DB URL: the
+    one with given name, or if no name is given, the one named after the DB
+    backend (e.g. 'sqlite'), or failing that, 'default'.
+    """
+    if not name:
+        name = get_backend(sa_url)
+        if name not in profiles:
+            name = "default"
+    elif name not in profiles:
+        raise ValueError("No such engine profile: %s" % name)
+
+    return (name, profiles[name],)
+
+
+
+def create_profiled_engine(sa_url, options, profile):
+    """
+    Create an engine for given DB URL with given create_engine options, as
+    overridden and extended by given profile.
+    """
+    options = dict(options, **profile.get("engine", {}))
+    backend = get_backend(sa_url)
+
+    if backend == "postgresql" and profile.get("statement_timeout"):
+        options["connect_args"] = dict(
+            options.get("connect_args", {}),
+            options = "-c statement_timeout=%s" % profile["statement_timeout"]
+        )
+
+    engine = sqlalchemy.create_engine(sa_url, **options)
+    if profile.get("compiled_cache"):
+        engine.update_execution_options(
+            compiled_cache = LRUCache(profile["compiled_cache"])
+        )
+
+    pragmas = profile.get("pragmas")
+
+    if backend == "sqlite" and pragmas:
+        @event.listens_for(engine, "connect")
+        def set_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for (pragma, value,) in sorted(pragmas.items()):
+                cursor.execute("PRAGMA %s = %s" % (pragma, value,))
+            cursor.close()
+
+    return engine
+
+
+
+def report_engine(engine):
+    """
+    Return the settings that given engine actually runs with, as read back from
+    the pool and the DB, as a list of (setting, value) tuples.
+    """
+    report = [ ("pool", engine.pool.status(),) ]
+
+    with engine.connect() as conn:
+        if engine.dialect.name == "sqlite":
+            for pragma in REPORTED_PRAGMAS:
+                report.append((
+                    pragma,
+                    conn.execute("PRAGMA %s" % pragma).scalar(),
+                ))
+        elif engine.dialect.name == "postgresql":
+            report.append((
+                "statement_timeout",
+                conn.execute("SHOW statement_timeout").scalar(),
+            ))
+
+    return report
+
+
+
+def find_mismatches(report, profile):
+    """
+    Return the PRAGMAs of given profile that given report shows did not take
+    effect (e.g. WAL mode on a file system that does not support it).
+    """
+    wanted = profile.get("pragmas", {})
+
+    return [
+        "%s = %s (wanted %s)" % (setting, value, wanted[setting],)
+        for (setting, value,) in report
+        if setting in wanted and str(value).lower() != str(wanted[setting])
+    ]
+
+
+
+def benchmark(engine, rounds):
+    """
+    Time a few typical workloads on given engine: checking out a connection,
+    fetching the first page of the shareholder list, counting transactions,
+    reading the whole cap table, and committing one-row writes (to a scratch
+    table). Return the median time of each in milliseconds, as a list of
+    (workload, ms) tuples.
+    """
+    from app import sql
+
+    page = sql["SHAREHOLDER"]["FIND_PAGE_FOR_LIST"]("name", False, None, "")
+    workloads = (
+        ("connect", lambda conn: conn.execute("SELECT 1").scalar(),),
+        ("list page", lambda conn: conn.execute(page, {
+            "limit" : 10,
+            "offset" : 0
+        }).fetchall(),),
+        ("count", lambda conn: conn.execute(
+            sql["TRANSACTION"]["COUNT_FOR_LIST"]("")
+        ).scalar(),),
+        ("cap table", lambda conn: conn.execute(
+            sql["SHAREHOLDER"]["FIND_CAP_TABLE"]
+        ).fetchall(),),
+        ("write", lambda conn: conn.execute(
+            "INSERT INTO %s (id) VALUES (1)" % SCRATCH_TABLE
+        ),)
+    )
+
+    engine.execute("CREATE TABLE IF NOT EXISTS %s (id INTEGER)" % SCRATCH_TABLE)
+    try:
+        results = []
+        for (name, run,) in workloads:
+            times = []
+            for i in range(rounds):
+                started = time.perf_counter()
+                with engine.begin() as conn:
+                    run(conn)
+                times.append(time.perf_counter() - started)
+            results.append((name, 1000 * statistics.median(times),))
+    finally:
+        engine.execute("DROP TABLE %s" % SCRATCH_TABLE)
+
+    return results
@@ -0,0 +1,91 @@
+"""
+    This module contains the export of whole tables of the register (e.g. for
+    auditors) as CSV or NDJSON (one JSON object per line), both through the
+    browser (see views/report) and from the command line (see cli).
+
+    Exports are never held in memory as a whole: rows are read from the DB in
+    batches through a server-side cursor, and written out as they come, in
+    chunks of lines. So memory usage stays flat no matter the size of the
+    register.
+"""
+
+import csv
+import json
+
+from .util import to_json_value
+from app import (
+    db,
+    sql
+)
+from itertools import islice
+
+# Number of rows fetched from the DB at a time
+BATCH_SIZE = 1000
+
+# Number of lines written out at a time
+CHUNK_SIZE = 500
+
+# Exportable tables, by name, with the entity under which each one's 'EXPORT'
+# statement is found
+EXPORTS = {
+    "certificates" : "CERTIFICATE",
+    "share_ranges" : "SHARE",
+    "shareholders" : "SHAREHOLDER",
+    "transactions" : "TRANSACTION"
+}
+
+FORMATS = ("csv", "ndjson",)
+
+
+
+class LineBuffer(object):
+    """
+    Stand-in for a file, so that csv.writer hands back each written row as is,
+    instead of collecting them anywhere.
+    """
+    def write(self, line):
+        return line
+
+
+
+def generate_export(name, format):
+    """
+    Generate the export of given table in given format, as chunks of text.
+    """
+    rows = generate_rows(sql[EXPORTS[name]]["EXPORT"])
+    columns = next(rows)
+
+    if format == "csv":
+        w = csv.writer(LineBuffer())
+        lines = (w.writerow(r) for r in rows)
+        yield w.writerow(columns)
+    else:
+        lines = (json.dumps(
+            dict(zip(columns, r)),
+            default = to_json_value
+        ) + "\n" for r in rows)
+
+    while True:
+        chunk = "".join(islice(lines, CHUNK_SIZE))
+        if not chunk:
+            break
+        yield chunk
+
+
+
+def generate_rows(stmt):
+    """
+    Generate the names of the columns of given statement's result, and then
+    the rows themselves as tuples, fetched from a server-side cursor in batches.
+    (SQLite has no such thing, but iterates its results lazily anyway.)
+    """
+    with db.engine.connect() as conn:
+        rs = conn.execution_options(stream_results = True).execute(stmt)
+        yield tuple(rs.keys())
+
+        while True:
+            rows = rs.fetchmany(BATCH_SIZE)
+            if not rows:
+                break
+            for r in rows:
+                yield tuple(r)
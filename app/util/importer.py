@@ -0,0 +1,526 @@
+"""
+    This module contains the bulk import of shareholders and of historical
+    certificates and transactions from CSV files, for onboarding a company whose
+    register so far has been kept elsewhere (see cli).
+
+    Entering hundreds of entities through the forms one at a time is slow, as
+    each one goes through its own uniqueness queries, password hashing, commit
+    and cache invalidation. Here, each of these is done for the whole file at
+    once instead:
+
+      - every row is first validated on its own, with the same forms as in the
+        browser, but without the uniqueness checks, which are then done for
+        all rows with a few 'IN' queries
+      - the dates before which shares cannot be bound to a new certificate (as
+        issued, and as last freed by a canceled certificate) are looked up for
+        all rows in one go, and then checked row by row in memory
+      - only then are the passwords of valid rows hashed, in a thread pool
+      - entities are inserted in batches, and the cache is invalidated once, at
+        the very end, for whole entity types
+
+    Invalid rows are skipped, and reported back by line number along with what
+    is wrong with them.
+"""
+
+import csv
+import datetime
+import decimal
+
+from .auth import hashPassword
+from .util import (
+    find_overlapping_ranges,
+    flatten_dated_ranges,
+    is_within_range,
+    subtract_ranges,
+    to_date
+)
+from app import (
+    db,
+    sql
+)
+from app.forms.shareholder import (
+    JuridicalPersonForm,
+    NaturalPersonForm
+)
+from app.forms.validators import Unique
+from app.models.certificate import Certificate
+from app.models.checkpoint import Checkpoint
+from app.models.share import Share
+from app.models.shareholder import (
+    JuridicalPerson,
+    NaturalPerson
+)
+from app.models.transaction import Transaction
+from app.models.unboundrange import UnboundRange
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.datastructures import MultiDict
+
+# Number of rows inserted (or values looked up) at a time
+BATCH_SIZE = 500
+
+# Number of threads hashing passwords (bcrypt lets go of the GIL meanwhile)
+HASH_WORKERS = 4
+
+SHAREHOLDER_FORMS = {
+    "juridical" : (JuridicalPersonForm, JuridicalPerson,),
+    "natural" : (NaturalPersonForm, NaturalPerson,)
+}
+
+ImportReport = namedtuple("ImportReport", ("errors", "imported",))
+
+RowError = namedtuple("RowError", ("line", "message",))
+
+
+
+def import_history(lines, dry_run = False):
+    """
+    Import certificates and transactions from CSV lines with columns
+    recorded_on, first_share, last_share, seller, buyer, price and remarks, in
+    order of date. Shares are referred to by range, and shareholders by email.
+    A row without seller records the issue of a certificate to buyer, and a row
+    with seller a transaction on an earlier issued certificate.
+
+    Rows are checked against the register as it would be after the preceding
+    rows, so e.g. a transaction on a certificate whose issue was invalid is
+    invalid too. Unlike shareholders, the history is imported in one DB
+    transaction, so that the register is never seen half way through.
+    """
+    rows = read_rows(lines, ("buyer", "first_share", "last_share",
+                             "recorded_on",))
+    if isinstance(rows, RowError):
+        return ImportReport(errors = [ rows ], imported = 0)
+
+    emails = set()
+    first_shares = set()
+    for (line, row,) in rows:
+        for key in ("buyer", "seller",):
+            if key in row:
+                row[key] = row[key].lower()
+                emails.add(row[key])
+        first_shares.add(row.get("first_share"))
+
+    owners = find_shareholder_ids(emails)
+    certificates = find_valid_certificates(first_shares)
+    state = {
+        "canceled" : find_latest_cancellations([
+            (row.get("first_share"), row.get("last_share"),)
+            for (line, row,) in rows if not row.get("seller")
+        ]),
+        "cap" : Share.get_last_share_number(),
+        "issued" : Share.get_issued_ranges(),
+        "unbound" : Share.get_unbound_ranges()
+    }
+
+    errors = []
+    events = []
+    for (line, row,) in rows:
+        try:
+            events.append(check_event(row, owners, certificates, state))
+        except ValueError as e:
+            errors.append(RowError(line = line, message = str(e)))
+
+    if events and not dry_run:
+        insert_history(events, certificates)
+
+    return ImportReport(errors = errors, imported = len(events))
+
+
+
+def check_event(row, owners, certificates, state):
+    """
+    Check that given row of history makes sense, both alone and after the rows
+    checked before it, and if so, apply it to the certificates and unbound
+    ranges (as held in memory) and return it as a dict. Otherwise raise a
+    ValueError telling what is wrong.
+    """
+    try:
+        recorded_on = datetime.datetime.strptime(
+            row.get("recorded_on", ""), "%Y-%m-%d"
+        ).date()
+    except ValueError:
+        raise ValueError("recorded_on: Give date as YYYY-MM-DD")
+    try:
+        lower = int(row.get("first_share"))
+        upper = int(row.get("last_share"))
+    except (TypeError, ValueError):
+        raise ValueError("first_share, last_share: Not a valid integer value")
+    try:
+        price = decimal.Decimal(row.get("price") or 0)
+    except decimal.InvalidOperation:
+        raise ValueError("price: Use '.' as decimal point")
+
+    buyer = owners.get(row.get("buyer"))
+    seller = owners.get(row.get("seller"))
+    if recorded_on > datetime.date.today():
+        raise ValueError("recorded_on: Cannot be in the future")
+    elif not buyer:
+        raise ValueError("buyer: No shareholder with this email")
+    elif row.get("seller") and not seller:
+        raise ValueError("seller: No shareholder with this email")
+    elif not price.is_finite() or price < 0:
+        raise ValueError("price: Must be positive number")
+    elif len(row.get("remarks", "")) > 255:
+        raise ValueError("remarks: Maximum 255 characters")
+
+    if not seller:
+        c = check_issue(lower, upper, recorded_on, state)
+        certificates[(lower, upper,)] = c
+    else:
+        c = certificates.get((lower, upper,))
+        if not c:
+            raise ValueError("No valid certificate for shares %s—%s" % (
+                lower, upper,))
+        elif c["owner_id"] != seller:
+            raise ValueError("seller: Not the owner of the certificate")
+        elif buyer == seller:
+            raise ValueError("buyer: Cannot be same as current owner")
+        elif recorded_on < c["last_event"]:
+            raise ValueError("recorded_on: Cannot be earlier than date of last"
+                             " transaction")
+        c["moved"] = c["id"] is not None
+
+    c["last_event"] = recorded_on
+    c["owner_id"] = buyer
+
+    return {
+        "buyer_id" : buyer,
+        "certificate" : c,
+        "price" : int(100 * price),
+        "recorded_on" : recorded_on,
+        "remarks" : row.get("remarks") or None,
+        "seller_id" : seller
+    }
+
+
+
+def check_issue(lower, upper, issued_on, state):
+    """
+    Check that shares lower to upper can be bound to a new certificate on given
+    date, like the certificate form does, but against the unbound ranges, issue
+    dates and cancellation dates held in memory. If so, cut the range out of
+    the unbound ranges, and return the certificate.
+    """
+    if upper < lower:
+        raise ValueError("last_share: Must be at least %s" % lower)
+    elif lower < 1:
+        raise ValueError("first_share: Numbering of shares starts from 1")
+    elif upper > state["cap"]:
+        raise ValueError("last_share: Shares have only been issued up to %s" % (
+            state["cap"],))
+    elif not is_within_range((lower, upper,), state["unbound"]):
+        raise ValueError("One or more shares within this range is already"
+                         " bound to a certificate")
+
+    dates = [ d for (a, b, d,) in (
+        find_overlapping_ranges((lower, upper,), state["issued"])
+        + find_overlapping_ranges((lower, upper,), state["canceled"])
+    ) if d ]
+    earliest = max(dates) if dates else None
+    if earliest and issued_on < earliest:
+        raise ValueError("recorded_on: Earliest possible date is %s" % earliest)
+
+    state["unbound"] = subtract_ranges(state["unbound"], [ (lower, upper,) ])
+    return {
+        "first_share" : lower,
+        "id" : None,
+        "issued_on" : issued_on,
+        "last_share" : upper,
+        "share_count" : upper - lower + 1
+    }
+
+
+
+def insert_history(events, certificates):
+    """
+    Insert the certificates issued and the transactions recorded by given
+    events, in batches, and bring the rest of the register up to date with
+    them: compositions and votes of new certificates, owners of already
+    existing ones, unbound ranges and checkpoints.
+    """
+    issued = [ c for c in certificates.values() if c["id"] is None ]
+    for c in issued:
+        c["id"] = add_certificate(c).id
+        if len(db.session.new) >= BATCH_SIZE:
+            db.session.flush()
+    db.session.flush()
+
+    if issued:
+        params = [ { "id" : c["id"] } for c in issued ]
+        db.session.execute(sql["CERTIFICATE"]["COMPOSE"], params)
+        db.session.execute(sql["CERTIFICATE"]["UPDATE_VOTES"], params)
+
+    moved = [ c for c in certificates.values() if c.get("moved") ]
+    if moved:
+        db.session.execute(sql["CERTIFICATE"]["UPDATE_OWNER"], [ {
+            "id" : c["id"],
+            "owner_id" : c["owner_id"]
+        } for c in moved ])
+
+    # Transactions on the same day are told apart by time of creation
+    created_on = datetime.datetime.now()
+    for (i, e,) in enumerate([ e for e in events if e["seller_id"] ]):
+        t = Transaction()
+        t.buyer_id = e["buyer_id"]
+        t.certificate_id = e["certificate"]["id"]
+        t.created_on = created_on + datetime.timedelta(microseconds = i)
+        t.price = e["price"]
+        t.price_per_share = int(e["price"] / e["certificate"]["share_count"])
+        t.recorded_on = e["recorded_on"]
+        t.remarks = e["remarks"]
+        t.seller_id = e["seller_id"]
+        db.session.add(t)
+        if len(db.session.new) >= BATCH_SIZE:
+            db.session.flush()
+
+    UnboundRange.rebuild()
+    Checkpoint.invalidate_from(min([ e["recorded_on"] for e in events ]))
+    db.session.flush()
+    db.session.info.pop("cache_tags", None)
+    db.commit_and_invalidate(
+        "certificate",
+        "certificate:*",
+        "share",
+        "shareholder",
+        "shareholder:*",
+        "transaction",
+        "unbound_range"
+    )
+
+
+
+def add_certificate(c):
+    """
+    Add the certificate held in given dict to the session, with the owner it
+    has after all imported events.
+    """
+    certificate = Certificate()
+    certificate.first_share = c["first_share"]
+    certificate.issued_on = c["issued_on"]
+    certificate.last_share = c["last_share"]
+    certificate.owner_id = c["owner_id"]
+    certificate.share_count = c["share_count"]
+    db.session.add(certificate)
+
+    return certificate
+
+
+
+def find_latest_cancellations(ranges):
+    """
+    Look up the certificates ever canceled within the span of given ranges of
+    shares (as read from file), all with one query, and return the latest date
+    of cancellation of each share as sorted ranges (first, last, date), so that
+    those relevant to any range can be found with find_overlapping_ranges.
+    """
+    bounds = [
+        int(v) for (lower, upper,) in ranges for v in (lower, upper,)
+        if is_int(v)
+    ]
+    if not bounds:
+        return []
+
+    stmt = sql["CERTIFICATE"]["FIND_CANCELED_IN_RANGE"]
+    return flatten_dated_ranges([
+        (r.first_share, r.last_share, to_date(r.canceled_on),)
+        for r in db.session.execute(stmt, {
+            "lower" : min(bounds),
+            "upper" : max(bounds)
+        })
+    ])
+
+
+
+def find_valid_certificates(first_shares):
+    """
+    Look up valid certificates starting from any of given share numbers, and
+    return them as dicts keyed by range, with their current owner and date of
+    last event (transaction or issue).
+    """
+    certificates = {}
+    values = sorted(set([ int(v) for v in first_shares if is_int(v) ]))
+    for i in range(0, len(values), BATCH_SIZE):
+        stmt = sql["CERTIFICATE"]["FIND_VALID_BY_FIRST_SHARE"]
+        for r in db.session.execute(stmt, {
+            "values" : values[i:i + BATCH_SIZE]
+        }):
+            certificates[(r.first_share, r.last_share,)] = {
+                "id" : r.id,
+                "last_event" : to_date(r.last_transaction) \
+                               or to_date(r.issued_on),
+                "moved" : False,
+                "owner_id" : r.owner_id,
+                "share_count" : r.share_count
+            }
+
+    return certificates
+
+
+
+def find_shareholder_ids(emails):
+    """
+    Look up the ids of shareholders with any of given emails, as a dict.
+    """
+    return dict([
+        (r.email, r.id,)
+        for r in find_in_batches(sql["SHAREHOLDER"]["FIND_BY_EMAIL"], emails)
+    ])
+
+
+
+def import_shareholders(lines, dry_run = False):
+    """
+    Import shareholders from CSV lines with the fields of the shareholder forms
+    as columns, plus 'type' ('natural' or 'juridical'). Without a 'has_access'
+    column, imported shareholders can log in, as when created through the form.
+    Valid rows are committed in batches.
+    """
+    rows = read_rows(lines, ("email", "password", "type",))
+    if isinstance(rows, RowError):
+        return ImportReport(errors = [ rows ], imported = 0)
+
+    errors = []
+    forms = []
+    for (line, row,) in rows:
+        row.setdefault("has_access", "y")
+        (form_class, model,) = SHAREHOLDER_FORMS.get(row.get("type"),
+                                                     (None, None,))
+        if not form_class:
+            errors.append(RowError(
+                line = line,
+                message = "type: Must be either natural or juridical"
+            ))
+            continue
+
+        f = form_class(MultiDict(row), meta = { "csrf" : False })
+        for field in f:
+            field.validators = [
+                v for v in field.validators if not isinstance(v, Unique)
+            ]
+        if f.validate():
+            forms.append((line, f, model,))
+        else:
+            errors.append(RowError(line = line, message = "; ".join([
+                "%s: %s" % (name, ", ".join(messages),)
+                for (name, messages,) in sorted(f.errors.items())
+            ])))
+
+    (forms, duplicates,) = check_unique(forms, (
+        ("email", "shareholder", "Email",),
+        ("business_id", "juridical_person", "Business ID",)
+    ))
+    errors = sorted(errors + duplicates)
+    if not dry_run:
+        committed = False
+        try:
+            with ThreadPoolExecutor(max_workers = HASH_WORKERS) as pool:
+                for i in range(0, len(forms), BATCH_SIZE):
+                    insert_shareholders(forms[i:i + BATCH_SIZE], pool)
+                    committed = True
+        finally:
+            # Batches already committed stay in, even if a later one fails, so
+            # the cache must hear of them either way
+            if committed:
+                db.session.rollback()
+                db.session.info.pop("cache_tags", None)
+                db.commit_and_invalidate("shareholder")
+
+    return ImportReport(errors = errors, imported = len(forms))
+
+
+
+def check_unique(forms, columns):
+    """
+    Check given (line, form, model) tuples for values that must be unique but
+    are not, either because they already are in DB, or because they come up
+    more than once in the file, in given columns (field name, table, label).
+    Return the tuples that pass, and errors on the rest.
+    """
+    errors = {}
+    for (name, table, label,) in columns:
+        seen = set()
+        values = [ f[name].data for (line, f, m,) in forms if name in f ]
+        stmt = sql["_COMMON"]["FIND_EXISTING"](table, name)
+        taken = set([ r.value for r in find_in_batches(stmt, values) ])
+
+        for (line, f, m,) in forms:
+            if name not in f:
+                continue
+            elif f[name].data in taken:
+                errors[line] = "%s: %s already in use by another shareholder" \
+                               % (name, label,)
+            elif f[name].data in seen:
+                errors[line] = "%s: %s given twice in file" % (name, label,)
+            seen.add(f[name].data)
+
+    return (
+        [ t for t in forms if t[0] not in errors ],
+        [ RowError(line = l, message = m) for (l, m,) in errors.items() ],
+    )
+
+
+
+def insert_shareholders(forms, pool):
+    """
+    Hash the passwords of one batch of (line, form, model) tuples in given
+    thread pool, and commit the shareholders. The cache is not invalidated
+    here, but once after all batches.
+    """
+    hashes = pool.map(hashPassword, [ f.password.data for (l, f, m,) in forms ])
+    for ((line, f, model,), pw_hash,) in zip(forms, hashes):
+        s = model()
+        del f.id # keep the generated id instead of 'new'
+        f.populate_obj(s)
+        s.pw_hash = pw_hash
+        s.update_display_name()
+        db.session.add(s)
+
+    db.session.flush()
+    db.session.info.pop("cache_tags", None)
+    db.session.commit()
+
+
+
+def find_in_batches(stmt, values):
+    """
+    Run given statement with an expanding 'values' parameter for given values,
+    a batch at a time, and generate the resulting rows.
+    """
+    values = sorted(set([ v for v in values if v ]))
+    for i in range(0, len(values), BATCH_SIZE):
+        params = { "values" : values[i:i + BATCH_SIZE] }
+        for r in db.session.execute(stmt, params):
+            yield r
+
+
+
+def is_int(value):
+    try:
+        int(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+
+def read_rows(lines, required):
+    """
+    Read CSV lines into (line number, row) tuples, where the row is a dict with
+    values stripped and empty values left out. If the header lacks any of given
+    required columns, return a RowError instead.
+    """
+    reader = csv.DictReader(lines)
+    missing = sorted(set(required) - set(reader.fieldnames or ()))
+    if missing:
+        return RowError(
+            line = 1,
+            message = "Missing column(s): %s" % ", ".join(missing)
+        )
+
+    rows = []
+    for row in reader:
+        rows.append((reader.line_num, {
+            k : v.strip() for (k, v,) in row.items() if k and v and v.strip()
+        },))
+
+    return rows
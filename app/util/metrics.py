@@ -0,0 +1,162 @@
+"""
+    This module contains the instrumentation of cached functions (see util/cache).
+    For each cached function, it records hits, misses, entries computed, time
+    spent computing, size of the latest entry, evictions (entries that vanished
+    before they were invalidated, e.g. expired or pruned), and computations
+    avoided by waiting or by serving stale values.
+
+    Counting must not cost a cache round trip on every hit, so counts are first
+    collected in process memory, and every few seconds added to totals kept in
+    the cache itself. Since the cache may be shared, so are the totals: they are
+    readable from any worker, and from the command line. Each total is its own
+    counter in the cache, added to with an atomic increment (where the backend
+    has one, e.g. Redis or Memcached), so that workers flushing at the same time
+    do not overwrite each other's counts. Time spent computing is kept in whole
+    milliseconds for the same reason.
+"""
+
+import pickle
+import time
+
+from collections import (
+    Counter,
+    defaultdict,
+    OrderedDict
+)
+from threading import Lock
+
+# Totals kept per cached function; compute_time is in milliseconds
+COUNTERS = (
+    "compute_time",
+    "computed",
+    "evictions",
+    "hits",
+    "misses",
+    "size",
+    "stale_served",
+    "waited",
+    "warm_ups_canceled",
+    "warmed_up"
+)
+
+# Max number of recently computed keys to remember, for detecting evictions
+RECENT_KEYS = 10000
+
+
+
+class CacheMetrics(object):
+    def __init__(self, cache, flush_interval = 5):
+        self.cache = cache
+        self.flush_interval = flush_interval
+        self.flushed_at = time.time()
+        self.latest = {}
+        self.lock = Lock()
+        self.names = set()
+        self.pending = defaultdict(Counter)
+        self.recent_keys = OrderedDict()
+
+    def record(self, name, **counts):
+        with self.lock:
+            self.pending[name].update(counts)
+
+        if time.time() - self.flushed_at > self.flush_interval:
+            self.flush()
+
+    def record_computed(self, name, key, value, seconds):
+        """
+        Record the computing of an entry, taking note of its key so that if it
+        goes missing before being invalidated, that is counted as eviction. The
+        value is only measured at flush time, and only the latest one per name.
+        """
+        with self.lock:
+            self.recent_keys[key] = True
+            if len(self.recent_keys) > RECENT_KEYS:
+                self.recent_keys.popitem(last = False)
+            self.latest[name] = value
+
+        self.record(name, computed = 1, compute_time = 1000 * seconds)
+
+    def record_miss(self, name, key):
+        with self.lock:
+            evicted = self.recent_keys.pop(key, None)
+
+        if evicted:
+            self.record(name, evictions = 1, misses = 1)
+        else:
+            self.record(name, misses = 1)
+
+    def flush(self):
+        """
+        Add counts collected in this process to the totals kept in the cache,
+        and note the size of the latest entry computed per name.
+
+        The list of names is only rewritten when this process knows of names
+        missing from it, so should two workers race to add theirs, the one that
+        lost adds its names again on its next flush.
+        """
+        with self.lock:
+            (pending, self.pending,) = (self.pending, defaultdict(Counter),)
+            (latest, self.latest,) = (self.latest, {},)
+            self.flushed_at = time.time()
+
+        for (name, counts,) in pending.items():
+            for (counter, n,) in counts.items():
+                n = int(round(n))
+                if n:
+                    key = "metrics/%s/%s" % (name, counter,)
+                    self.cache.add(key, 0, timeout = 0)
+                    self.cache.cache.inc(key, n)
+        for (name, value,) in latest.items():
+            self.cache.set(
+                "metrics/%s/size" % name,
+                len(pickle.dumps(value)),
+                timeout = 0
+            )
+
+        self.names |= set(pending) | set(latest)
+        names = set(self.cache.get("metrics/_names") or ())
+        if not self.names <= names:
+            self.cache.set("metrics/_names", names | self.names, timeout = 0)
+
+    def get_all(self):
+        """
+        Return the totals for all cached functions as a dict, keyed by name of
+        function (or key prefix), with hit ratio and mean time of computing (in
+        milliseconds) worked out for convenience.
+        """
+        self.flush()
+
+        names = sorted(self.cache.get("metrics/_names") or ())
+        values = self.cache.get_many(*[
+            "metrics/%s/%s" % (name, counter,)
+            for name in names for counter in COUNTERS
+        ])
+
+        metrics = {}
+        for (i, name,) in enumerate(names):
+            m = dict(zip(COUNTERS, [
+                v or 0 for v in values[i * len(COUNTERS):(i + 1) * len(COUNTERS)]
+            ]))
+
+            lookups = m["hits"] + m["misses"]
+            m["hit_ratio"] = m["hits"] / lookups if lookups else None
+            m["mean_compute_time"] = m["compute_time"] / m["computed"] \
+                                     if m["computed"] else None
+            metrics[name] = m
+
+        return metrics
+
+    def get_backend_usage(self):
+        """
+        Return the number of entries and bytes held by the cache backend, if it
+        is an in-process cache whose contents can be inspected (i.e. 'simple'),
+        otherwise None.
+        """
+        entries = getattr(self.cache.cache, "_cache", None)
+        if entries is None:
+            return None
+
+        return {
+            "bytes" : sum([ len(v) for (expires, v,) in list(entries.values()) ]),
+            "entries" : len(entries)
+        }
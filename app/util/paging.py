@@ -0,0 +1,117 @@
+"""
+    This module contains helpers for serving long lists one page at a time to
+    DataTables in 'server-side processing' mode, so that neither the query nor
+    the HTML grows with the number of rows.
+
+    Sorting and searching are done in SQL (see sql.find_list_page). Pages are
+    found by keyset rather than by offset whenever possible: each response
+    tells the sort key of its last row ('next'), and when the browser moves on
+    to the next page, it sends that key back ('after'), so that the DB can seek
+    straight to the right row instead of counting its way there. Only columns
+    stored on the listed table itself can be sought this way (with an index
+    ending in id); pages sorted by a computed column, such as a sum, are always
+    found by offset.
+"""
+
+import json
+
+from .util import to_json_value
+from collections import namedtuple
+from markupsafe import escape
+
+# Max number of rows served on one page, whatever the browser asks for
+MAX_PAGE_LENGTH = 100
+
+PAGE_LENGTH = 10
+
+# Transaction histories can only be sorted by date (and id, see sql)
+HISTORY_COLUMNS = ("recorded_on",)
+
+Page = namedtuple("Page", (
+    "after",
+    "descending",
+    "limit",
+    "offset",
+    "order",
+    "search"
+))
+
+
+
+def get_first_page(columns):
+    """
+    Return the page shown before the browser asks for anything, i.e. the first
+    page sorted by the first column, which can be rendered with the HTML.
+    """
+    return Page(
+        after = None,
+        descending = False,
+        limit = PAGE_LENGTH,
+        offset = 0,
+        order = columns[0],
+        search = ""
+    )
+
+
+
+def parse_page_request(args, columns, computed = ()):
+    """
+    Read the page requested by DataTables from given query string. The columns
+    of the table are given in the order they are shown, named as in the list
+    query; these are the only columns that can be sorted by, so anything else
+    asked for falls back to the first column. Of those, the ones computed by
+    the list query are given separately, and when sorting by them, the sort key
+    sent along is ignored in favour of the offset.
+    """
+    i = args.get("order[0][column]", 0, type = int)
+    order = columns[i] if 0 <= i < len(columns) else columns[0]
+    after = parse_after(args.get("after")) if order not in computed else None
+
+    return Page(
+        after = after,
+        descending = args.get("order[0][dir]") == "desc",
+        limit = min(
+            max(args.get("length", PAGE_LENGTH, type = int), 1),
+            MAX_PAGE_LENGTH
+        ),
+        offset = 0 if after else max(args.get("start", 0, type = int), 0),
+        order = order,
+        search = args.get("search[value]", "").strip().lower()
+    )
+
+
+
+def parse_after(after):
+    try:
+        (value, id,) = json.loads(after)
+        if isinstance(id, str) and isinstance(value, (float, int, str)):
+            return (value, id,)
+    except (TypeError, ValueError):
+        pass
+
+    return None
+
+
+
+def make_page_response(args, page, rows, filtered, total, to_cells):
+    """
+    Compose the JSON response for a DataTable. Cells are converted to strings
+    and escaped here, since DataTables inserts them into the table as HTML.
+    Each row links to its entity through its id, as on the HTML list pages.
+    """
+    data = []
+    for r in rows:
+        row = { str(i) : str(escape(c)) for (i, c,) in enumerate(to_cells(r)) }
+        row["DT_RowAttr"] = { "data-href" : r["id"] }
+        data.append(row)
+
+    return {
+        "data" : data,
+        "draw" : args.get("draw", 0, type = int),
+        "next" : json.dumps(
+            [ rows[-1][page.order], rows[-1]["id"] ],
+            default = to_json_value
+        ) if rows else None,
+        "recordsFiltered" : filtered,
+        "recordsTotal" : total
+    }
@@ -6,9 +6,15 @@
     needed for WTForm transformations (passed into a field as 'filters').
 """
 
+import datetime
+import dateutil.parser as dtp
+import decimal
+import heapq
 import re
 import uuid
 
+from bisect import bisect_right
+
 
 
 def apply_lower(s):
@@ -44,6 +50,66 @@ def apply_upper(s):
 
 
 
+def find_overlapping_ranges(t, ts):
+    """
+    Find all ranges among the given ranges (ts) that share at least one number
+    with the given integer pair (t). t must be a tuple, and ts a list of tuples
+    (first, last, ...) that is _SORTED_ and free of overlaps. Any extra items in
+    the tuples (e.g. dates) are carried along as is.
+
+    The ranges are located with binary search, so this takes O(log n) time plus
+    the number of matches.
+    """
+    (a, b,) = t
+    i = max(bisect_right(ts, (a, float("inf"),)) - 1, 0)
+    j = bisect_right(ts, (b, float("inf"),))
+
+    return [ r for r in ts[i:j] if r[1] >= a ]
+
+
+
+def flatten_dated_ranges(ts):
+    """
+    Flatten integer ranges with dates (tuples (first, last, date)), which may
+    overlap, into a sorted list of ranges free of overlaps, where each number
+    is dated with the latest date of the given ranges covering it. E.g. with
+    d1 < d2, [ (1, 10, d1), (5, 20, d2) ] becomes [ (1, 4, d1), (5, 20, d2) ].
+    The result can be searched with find_overlapping_ranges.
+    """
+    ts = sorted(ts)
+    bounds = sorted(set(
+        [ l for (l, u, d,) in ts ] + [ u + 1 for (l, u, d,) in ts ]
+    ))
+    covering = []
+    res = []
+    i = 0
+    for (l, next_l,) in zip(bounds, bounds[1:]):
+        while i < len(ts) and ts[i][0] <= l:
+            (first, last, date,) = ts[i]
+            heapq.heappush(covering, (-date.toordinal(), last, date,))
+            i += 1
+        while covering and covering[0][1] < l:
+            heapq.heappop(covering)
+
+        if not covering:
+            continue
+        elif res and res[-1][2] == covering[0][2] and res[-1][1] + 1 == l:
+            res[-1] = (res[-1][0], next_l - 1, res[-1][2],)
+        else:
+            res.append( (l, next_l - 1, covering[0][2],) )
+    return res
+
+
+
+def format_price(cents):
+    """
+    Format a price given in cents as euros, with commas as thousand separators
+    and two decimals, as prices are shown on pages.
+    """
+    return "{:,.2f}".format(cents / 100)
+
+
+
 def format_share_range(lower, upper, places = 0):
     """
     Pad the two given numbers with zeroes on left to requested number of places,
@@ -60,28 +126,6 @@ def format_share_range(lower, upper, places = 0):
 
 
 
-def get_consecutive_ranges(ns):
-    """
-    Find all ranges of consecutive numbers from a _SORTED_ integer list. Return
-    the first and last numbers of each range as a tuple (first, last).
-    """
-    res = []
-    if not ns:
-        return res
-
-    prev = first = ns[0] - 2
-    for n in ns:
-        if n != prev + 1:
-            if prev != ns[0] - 2:
-                res.append( (first, prev,) )
-            first = n
-        prev = n
-
-    res.append( (first, prev,) )
-    return res
-
-
-
 def get_uuid():
     """
     Return a v4 UUID as string without dashes in the middle.
@@ -97,13 +141,30 @@ def get_uuid():
 def is_within_range(t, ts):
     """
     Check whether the given integer pair (t) is within at least one of the given
-    ranges (ts). t must be a tuple, and ts a list of tuples.
+    ranges (ts). t must be a tuple, and ts a list of tuples that is _SORTED_ and
+    free of overlaps (like e.g. unbound share ranges), so that the only possible
+    candidate can be located with binary search in O(log n) time.
     """
     (a, b,) = t
+    i = bisect_right(ts, (a, float("inf"),)) - 1
+
+    return i >= 0 and ts[i][0] <= a and b <= ts[i][1]
+
+
+
+def merge_ranges(ts):
+    """
+    Coalesce a _SORTED_ list of integer ranges (tuples (first, last)) so that
+    overlapping or directly adjacent ranges become one, e.g. [ (1, 5), (6, 9) ]
+    becomes [ (1, 9) ].
+    """
+    res = []
     for (l, u,) in ts:
-        if l <= a and b <= u:
-            return True
-    return False
+        if res and l <= res[-1][1] + 1:
+            res[-1] = (res[-1][0], max(u, res[-1][1]),)
+        else:
+            res.append( (l, u,) )
+    return res
 
 
 
@@ -116,3 +177,56 @@ def rs_to_dict(rs):
     for r in rs:
         res.append({ key : r[key] for key in rs.keys() })
     return res
+
+
+
+def subtract_ranges(ts, us):
+    """
+    Remove from integer ranges (ts) all numbers covered by other ranges (us),
+    and return what remains as a list of tuples (first, last). Both lists must
+    be _SORTED_ and free of overlaps within themselves, so that the difference
+    can be found in one pass over the two.
+    """
+    res = []
+    i = 0
+    for (l, u,) in ts:
+        while i < len(us) and us[i][1] < l:
+            i += 1
+
+        j = i
+        while j < len(us) and us[j][0] <= u:
+            if l < us[j][0]:
+                res.append( (l, us[j][0] - 1,) )
+            l = max(l, us[j][1] + 1)
+            j += 1
+
+        if l <= u:
+            res.append( (l, u,) )
+    return res
+
+
+
+def to_date(value):
+    """
+    Return given DB value as a date. (SQLite hands out dates as strings from raw
+    queries, whereas PostgreSQL gives proper date objects.)
+    """
+    if value is None or isinstance(value, datetime.date):
+        return value
+    else:
+        return dtp.parse(value).date()
+
+
+
+def to_json_value(value):
+    """
+    Return given DB value in a form that JSON can hold: dates as ISO strings,
+    and decimals (which PostgreSQL gives for sums) as integers. Meant to be
+    passed as 'default' to json.dumps.
+    """
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    elif isinstance(value, decimal.Decimal):
+        return int(value)
+    else:
+        raise TypeError("Not JSON serializable: %r" % (value,))
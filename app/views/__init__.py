@@ -6,6 +6,9 @@
 from . import (
     auth,
     certificate,
+    metrics,
+    register,
+    report,
     share,
     shareclass,
     shareholder,
@@ -26,6 +29,9 @@ from flask_login import (
 def init_views(app):
     app.register_blueprint(auth.bp)
     app.register_blueprint(certificate.bp)
+    app.register_blueprint(metrics.bp)
+    app.register_blueprint(register.bp)
+    app.register_blueprint(report.bp)
     app.register_blueprint(share.bp)
     app.register_blueprint(shareclass.bp)
     app.register_blueprint(shareholder.bp)
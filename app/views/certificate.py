@@ -3,6 +3,7 @@
     Certificates are funky so the views and operations are not vanilla CRUD.
 """
 
+from app import cache
 from app.forms.certificate import (
     CancellationForm,
     CertificateForm
@@ -13,8 +14,16 @@ from app.models.shareholder import Shareholder
 from app.models.transaction import Transaction
 from app.util import notify
 from app.util.auth import login_required
+from app.util.paging import (
+    get_first_page,
+    HISTORY_COLUMNS,
+    make_page_response,
+    parse_page_request
+)
+from app.util.util import format_price
 from flask import (
     Blueprint,
+    jsonify,
     redirect,
     render_template,
     request,
@@ -43,8 +52,6 @@ def bundle():
         c = Certificate()
         f.populate_obj(c)
         c.share_count = c.last_share - c.first_share + 1
-
-        c.save_or_update()
         Certificate.bind_shares(c)
 
         notify.create_ok("certificate")
@@ -62,25 +69,56 @@ def bundle():
 
 @bp.route("/<id>", methods = ("GET",))
 @login_required("ADMIN")
+@cache.conditional("certificate:{id}", "share", "share_class", "shareholder")
 def details(id):
     """
     Show page with certificate basic information, share composition breakdown by
     share class, and transaction history.
     """
     certificate = Certificate.query.get_or_404(id)
-    shareclasses = Certificate.get_share_composition(id)
 
     return render_template(
         "certificate/details.html",
         certificate = certificate,
         current_owner = Certificate.get_current_owner(id),
-        shareclasses = shareclasses,
-        total_votes = sum([ s["votes"] for s in shareclasses ]),
-        transactions = Certificate.get_transactions(id)
+        shareclasses = Certificate.get_share_composition(id),
+        total_transactions = Certificate.count_transactions(id),
+        total_votes = certificate.votes,
+        transactions = Certificate.get_transactions(
+            id,
+            get_first_page(HISTORY_COLUMNS)
+        )
     )
 
 
 
+@bp.route("/<id>/transactions.json", methods = ("GET",))
+@login_required("ADMIN")
+@cache.conditional("certificate:{id}", "shareholder")
+def transactions_json(id):
+    """
+    Serve one page of a certificate's transaction history, as requested by the
+    DataTable on the details page.
+    """
+    page = parse_page_request(request.args, HISTORY_COLUMNS)
+
+    return jsonify(make_page_response(
+        request.args,
+        page,
+        filtered = Certificate.count_transactions(id, page.search),
+        rows = Certificate.get_transactions(id, page),
+        to_cells = lambda t: [
+            t["recorded_on"],
+            t["seller"],
+            t["buyer"],
+            format_price(t["price"]),
+            format_price(t["price_per_share"])
+        ],
+        total = Certificate.count_transactions(id)
+    ))
+
+
+
 @bp.route("/<id>/transfer", methods = ("GET", "POST",))
 @login_required("ADMIN")
 def transfer(id):
@@ -102,10 +140,9 @@ def transfer(id):
         t = Transaction()
         f.populate_obj(t)
 
-        c.owner_id = f.buyer_id.data
         t.price = int(100 * t.price)
         t.price_per_share = int(t.price / c.share_count)
-        t.save_or_update()
+        Certificate.transfer(c, t)
 
         notify.create_ok("transaction")
         return redirect(url_for("certificate.details", id = id))
@@ -0,0 +1,30 @@
+"""
+    This module contains the blueprint for exposing metrics on how the app is
+    doing, as JSON (currently only those of the cache).
+"""
+
+from app import cache
+from app.util.auth import login_required
+from flask import (
+    Blueprint,
+    jsonify
+)
+
+bp = Blueprint(
+    "metrics",
+    __name__,
+    url_prefix = "/metrics"
+)
+
+
+
+@bp.route("/", methods = ("GET",))
+@login_required("ADMIN")
+def list():
+    """
+    Show metrics of each cached function, and memory held by the cache.
+    """
+    return jsonify(
+        backend = cache.metrics.get_backend_usage(),
+        functions = cache.metrics.get_all()
+    )
@@ -0,0 +1,49 @@
+"""
+    This module contains the blueprint for viewing the register of shareholders
+    as it stood on any given date (e.g. the record date of a general meeting).
+"""
+
+import datetime
+
+from app.forms.register import RegisterForm
+from app.models.checkpoint import Checkpoint
+from app.util import notify
+from app.util.auth import login_required
+from flask import (
+    Blueprint,
+    render_template,
+    request
+)
+
+bp = Blueprint(
+    "register",
+    __name__,
+    url_prefix = "/register"
+)
+
+
+
+@bp.route("/", methods = ("GET",))
+@login_required("ADMIN")
+def list():
+    """
+    Show holdings, votes and certificates per shareholder as of the date given
+    in query string (defaulting to today).
+    """
+    f = RegisterForm(request.args)
+    if not request.args.get("date"):
+        f.date.data = datetime.date.today()
+
+    elif not f.validate():
+        notify.invalid_input()
+        return render_template(
+            "register/list.html",
+            form = f,
+            holdings = []
+        )
+
+    return render_template(
+        "register/list.html",
+        form = f,
+        holdings = Checkpoint.get_holdings_as_of(f.date.data)
+    )
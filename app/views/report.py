@@ -0,0 +1,132 @@
+"""
+    This module contains the blueprint for reports and exports. Reports can get
+    large, so they are streamed to the client as they are being generated,
+    instead of first rendering the whole thing in memory.
+"""
+
+import csv
+import json
+
+from app.models.shareholder import Shareholder
+from app.util.auth import login_required
+from app.util.export import (
+    EXPORTS,
+    FORMATS,
+    generate_export,
+    LineBuffer
+)
+from flask import (
+    abort,
+    Blueprint,
+    current_app,
+    Response,
+    stream_with_context
+)
+
+bp = Blueprint(
+    "report",
+    __name__,
+    url_prefix = "/report"
+)
+
+CAP_TABLE_CSV_COLUMNS = (
+    "name",
+    "type_id",
+    "email",
+    "street",
+    "street_ext",
+    "zip_code",
+    "city",
+    "country",
+    "certificate",
+    "share_count",
+    "votes"
+)
+
+
+
+def stream_template(name, **context):
+    """
+    Like render_template, but yield the rendered template piece by piece.
+    """
+    current_app.update_template_context(context)
+    return current_app.jinja_env.get_template(name).stream(context)
+
+
+
+@bp.route("/cap_table", methods = ("GET",))
+@login_required("ADMIN")
+def cap_table():
+    """
+    Show all shareholders in possession of shares, and under each one their
+    certificates and the votes those translate to.
+    """
+    return Response(stream_with_context(stream_template(
+        "report/cap_table.html",
+        shareholders = Shareholder.generate_cap_table()
+    )))
+
+
+
+@bp.route("/cap_table.csv", methods = ("GET",))
+@login_required("ADMIN")
+def cap_table_csv():
+    """
+    Same as above as CSV, one row per certificate.
+    """
+    def generate():
+        w = csv.writer(LineBuffer())
+        yield w.writerow(CAP_TABLE_CSV_COLUMNS)
+
+        for s in Shareholder.generate_cap_table():
+            for c in s["certificates"]:
+                yield w.writerow([ s[k] for k in CAP_TABLE_CSV_COLUMNS[:-3] ] + [
+                    c["title"],
+                    c["share_count"],
+                    c["votes"]
+                ])
+
+    return Response(
+        stream_with_context(generate()),
+        headers = { "Content-Disposition" : "attachment; filename=cap_table.csv" },
+        mimetype = "text/csv"
+    )
+
+
+
+@bp.route("/cap_table.json", methods = ("GET",))
+@login_required("ADMIN")
+def cap_table_json():
+    """
+    Same as above as a JSON array, one object per shareholder.
+    """
+    def generate():
+        yield "["
+        for (i, s,) in enumerate(Shareholder.generate_cap_table()):
+            yield ("," if i else "") + json.dumps(s)
+        yield "]"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype = "application/json"
+    )
+
+
+
+@bp.route("/export/<name>.<format>", methods = ("GET",))
+@login_required("ADMIN")
+def export(name, format):
+    """
+    Download a whole table of the register (see util/export for which ones) as
+    CSV or NDJSON.
+    """
+    if name not in EXPORTS or format not in FORMATS:
+        abort(404)
+
+    return Response(
+        stream_with_context(generate_export(name, format)),
+        headers = {
+            "Content-Disposition" : "attachment; filename=%s.%s" % (name, format,)
+        },
+        mimetype = "text/csv" if format == "csv" else "application/x-ndjson"
+    )
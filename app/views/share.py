@@ -3,14 +3,21 @@
     are funky so the views and operations are not vanilla CRUD.
 """
 
+from app import cache
 from app.forms.share import ShareForm
 from app.models.certificate import Certificate
 from app.models.share import Share
 from app.models.shareclass import ShareClass
 from app.util import notify
 from app.util.auth import login_required
+from app.util.paging import (
+    get_first_page,
+    make_page_response,
+    parse_page_request
+)
 from flask import (
     Blueprint,
+    jsonify,
     redirect,
     render_template,
     request,
@@ -23,10 +30,15 @@ bp = Blueprint(
     url_prefix = "/share"
 )
 
+# Columns of the certificate list, as named in the list query, in the order
+# they are shown (certificates are sorted by number of their first share)
+LIST_COLUMNS = ("first_share", "share_count", "owner", "votes",)
+
 
 
 @bp.route("/", methods = ("GET",))
 @login_required("ADMIN")
+@cache.conditional("certificate", "share", "shareholder", "unbound_range")
 def list():
     """
     Show the subindex for managing shares. (Okay it's not exactly a 'list' but
@@ -34,13 +46,58 @@ def list():
     """
     return render_template(
         "share/list.html",
-        certificates = Certificate.get_all_for_list(),
+        certificate_rows = render_certificate_rows(),
         last_share_number = Share.get_last_share_number(),
+        total = Certificate.count_for_list(),
         unbound_ranges = Share.get_unbound_ranges()
     )
 
 
 
+@bp.route("/list.json", methods = ("GET",))
+@login_required("ADMIN")
+@cache.conditional("certificate", "share", "shareholder")
+def list_json():
+    """
+    Serve one page of certificates, as requested by the DataTable on the list.
+    """
+    page = parse_page_request(request.args, LIST_COLUMNS)
+
+    return jsonify(make_page_response(
+        request.args,
+        page,
+        filtered = Certificate.count_for_list(page.search),
+        rows = Certificate.get_page_for_list(page),
+        to_cells = lambda c: [
+            c["title"],
+            c["share_count"],
+            c["owner"],
+            c["votes"]
+        ],
+        total = Certificate.count_for_list()
+    ))
+
+
+
+@cache.cached(
+    key_prefix = "certificate_rows",
+    stale = True,
+    tags = ("certificate", "share", "shareholder",)
+)
+def render_certificate_rows():
+    """
+    Render the rows on the first page of the certificate list, which are cached
+    as HTML for the same reasons as shareholder rows (see shareholder).
+    """
+    return render_template(
+        "share/certificate_rows.html",
+        certificates = Certificate.get_page_for_list(
+            get_first_page(LIST_COLUMNS)
+        )
+    )
+
+
+
 @bp.route("/new", methods = ("GET", "POST",))
 @login_required("ADMIN")
 def issue():
@@ -3,13 +3,20 @@
     spanning the standard CRUD operations.
 """
 
+from app import cache
 from app.forms.shareclass import ShareClassForm
 from app.models.shareclass import ShareClass
 from app.util import notify
 from app.util.auth import login_required
+from app.util.paging import (
+    get_first_page,
+    make_page_response,
+    parse_page_request
+)
 from flask import (
     abort,
     Blueprint,
+    jsonify,
     redirect,
     render_template,
     request,
@@ -22,19 +29,53 @@ bp = Blueprint(
     url_prefix = "/shareclass"
 )
 
+# Columns of the list, as named in the list query, in the order they are shown,
+# and those of them that the list query computes (which are paged by offset)
+LIST_COLUMNS = ("name", "votes", "count",)
+LIST_COMPUTED_COLUMNS = ("count",)
+
 
 
 @bp.route("/", methods = ("GET",))
 @login_required("ADMIN")
+@cache.conditional("share", "share_class")
 def list():
     """
-    Show all share classes on a list.
+    Show the first page of share classes on a list. The rest are fetched page
+    by page from list_json.
     """
     return render_template(
         "shareclass/list.html",
-        shareclasses = ShareClass.get_all_for_list()
+        shareclasses = ShareClass.get_page_for_list(
+            get_first_page(LIST_COLUMNS)
+        ),
+        total = ShareClass.count_for_list()
+    )
+
+
+
+@bp.route("/list.json", methods = ("GET",))
+@login_required("ADMIN")
+@cache.conditional("share", "share_class")
+def list_json():
+    """
+    Serve one page of share classes, as requested by the DataTable on the list.
+    """
+    page = parse_page_request(
+        request.args,
+        LIST_COLUMNS,
+        LIST_COMPUTED_COLUMNS
     )
 
+    return jsonify(make_page_response(
+        request.args,
+        page,
+        filtered = ShareClass.count_for_list(page.search),
+        rows = ShareClass.get_page_for_list(page),
+        to_cells = lambda s: [ s["name"], s["votes"], s["count"] ],
+        total = ShareClass.count_for_list()
+    ))
+
 
 
 @bp.route("/<id>", methods = ("GET",))
@@ -57,6 +98,23 @@ def form(id):
 
 
 
+@bp.route("/<id>/holders", methods = ("GET",))
+@login_required("ADMIN")
+@cache.conditional("certificate", "share_class", "shareholder")
+def holders(id):
+    """
+    Show all shareholders who currently own shares of given class.
+    """
+    s = ShareClass.query.get_or_404(id)
+
+    return render_template(
+        "shareclass/holders.html",
+        holders = ShareClass.get_holders(id),
+        shareclass = s
+    )
+
+
+
 @bp.route("/", methods = ("POST",))
 @login_required("ADMIN")
 def create_or_update():
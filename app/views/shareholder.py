@@ -8,6 +8,7 @@
     @login_required decorator.
 """
 
+from app import cache
 from app.forms.shareholder import (
     JuridicalPersonForm,
     NaturalPersonForm
@@ -23,9 +24,17 @@ from app.util.auth import (
     login_manager,
     login_required
 )
+from app.util.paging import (
+    get_first_page,
+    HISTORY_COLUMNS,
+    make_page_response,
+    parse_page_request
+)
+from app.util.util import format_price
 from flask import (
     abort,
     Blueprint,
+    jsonify,
     redirect,
     render_template,
     request,
@@ -39,23 +48,81 @@ bp = Blueprint(
     url_prefix = "/shareholder"
 )
 
+# Columns of the list, as named in the list query, in the order they are shown,
+# and those of them that the list query computes (which are paged by offset)
+LIST_COLUMNS = ("name", "type_id", "country", "share_count",)
+LIST_COMPUTED_COLUMNS = ("share_count",)
+
 
 
 @bp.route("/", methods = ("GET",))
 @login_required("ADMIN")
+@cache.conditional("shareholder")
 def list():
     """
-    Show all shareholders on a list.
+    Show the first page of shareholders on a list. The rest are fetched page
+    by page from list_json.
     """
     return render_template(
         "shareholder/list.html",
-        shareholders = Shareholder.get_all_for_list()
+        rows = render_rows(),
+        total = Shareholder.count_for_list()
+    )
+
+
+
+@bp.route("/list.json", methods = ("GET",))
+@login_required("ADMIN")
+@cache.conditional("shareholder")
+def list_json():
+    """
+    Serve one page of shareholders, as requested by the DataTable on the list.
+    """
+    page = parse_page_request(
+        request.args,
+        LIST_COLUMNS,
+        LIST_COMPUTED_COLUMNS
+    )
+
+    return jsonify(make_page_response(
+        request.args,
+        page,
+        filtered = Shareholder.count_for_list(page.search),
+        rows = Shareholder.get_page_for_list(page),
+        to_cells = lambda s: [
+            s["name"],
+            s["type_id"],
+            s["country"],
+            s["share_count"]
+        ],
+        total = Shareholder.count_for_list()
+    ))
+
+
+
+@cache.cached(
+    key_prefix = "shareholder_rows",
+    stale = True,
+    tags = ("shareholder",)
+)
+def render_rows():
+    """
+    Render the rows on the first page of the shareholder list. The rows hold
+    nothing specific to user or request, so the rendered HTML is cached as is,
+    and a cached list page is then rendered without looping over them again.
+    """
+    return render_template(
+        "shareholder/rows.html",
+        shareholders = Shareholder.get_page_for_list(
+            get_first_page(LIST_COLUMNS)
+        )
     )
 
 
 
 @bp.route("/<id>", methods = ("GET",))
 @login_required()
+@cache.conditional("share", "shareholder:{id}")
 def details(id):
     """
     Show basic information, certificates, and transaction history of one
@@ -74,12 +141,47 @@ def details(id):
         "shareholder/details.html",
         certificates = certificates,
         shareholder = shareholder,
+        total_transactions = Shareholder.count_shareholder_transactions(id),
         total_votes = sum([ c["votes"] for c in certificates ]),
-        transactions = Shareholder.get_shareholder_transactions(id)
+        transactions = Shareholder.get_shareholder_transactions(
+            id,
+            get_first_page(HISTORY_COLUMNS)
+        )
     )
 
 
 
+@bp.route("/<id>/transactions.json", methods = ("GET",))
+@login_required()
+@cache.conditional("share", "shareholder:{id}")
+def transactions_json(id):
+    """
+    Serve one page of a shareholder's transaction history, as requested by the
+    DataTable on the details page. Access is as to the details page.
+    """
+    if not current_user.is_admin and id != current_user.get_id():
+        return login_manager.unauthorized()
+
+    page = parse_page_request(request.args, HISTORY_COLUMNS)
+
+    return jsonify(make_page_response(
+        request.args,
+        page,
+        filtered = Shareholder.count_shareholder_transactions(id, page.search),
+        rows = Shareholder.get_shareholder_transactions(id, page),
+        to_cells = lambda t: [
+            t["recorded_on"],
+            t["certificate"],
+            t["seller"],
+            t["buyer"],
+            format_price(t["price"]),
+            format_price(t["price_per_share"])
+        ],
+        total = Shareholder.count_shareholder_transactions(id)
+    ))
+
+
+
 @bp.route("/edit/<id>", methods = ("GET",))
 @login_required()
 def form(id):
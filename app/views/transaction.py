@@ -4,12 +4,21 @@
     afterwards, the operations here are quite limited.
 """
 
+from app import cache
 from app.models.transaction import Transaction
 from app.util.auth import login_required
+from app.util.paging import (
+    get_first_page,
+    make_page_response,
+    parse_page_request
+)
+from app.util.util import format_price
 from flask import (
     abort,
     Blueprint,
-    render_template
+    jsonify,
+    render_template,
+    request
 )
 
 bp = Blueprint(
@@ -18,23 +27,84 @@ bp = Blueprint(
     url_prefix = "/transaction"
 )
 
+# Columns of the list, as named in the list query, in the order they are shown
+# (certificates are sorted by number of their first share)
+LIST_COLUMNS = (
+    "recorded_on",
+    "first_share",
+    "seller",
+    "buyer",
+    "price",
+    "price_per_share"
+)
+
 
 
 @bp.route("/", methods = ("GET",))
 @login_required("ADMIN")
+@cache.conditional("share", "shareholder", "transaction")
 def list():
     """
-    Show all transactions on a list.
+    Show the first page of transactions on a list. The rest are fetched page by
+    page from list_json.
     """
     return render_template(
         "transaction/list.html",
-        transactions = Transaction.get_all_for_list()
+        rows = render_rows(),
+        total = Transaction.count_for_list()
+    )
+
+
+
+@bp.route("/list.json", methods = ("GET",))
+@login_required("ADMIN")
+@cache.conditional("share", "shareholder", "transaction")
+def list_json():
+    """
+    Serve one page of transactions, as requested by the DataTable on the list.
+    """
+    page = parse_page_request(request.args, LIST_COLUMNS)
+
+    return jsonify(make_page_response(
+        request.args,
+        page,
+        filtered = Transaction.count_for_list(page.search),
+        rows = Transaction.get_page_for_list(page),
+        to_cells = lambda t: [
+            t["recorded_on"],
+            t["title"],
+            t["seller"],
+            t["buyer"],
+            format_price(t["price"]),
+            format_price(t["price_per_share"])
+        ],
+        total = Transaction.count_for_list()
+    ))
+
+
+
+@cache.cached(
+    key_prefix = "transaction_rows",
+    stale = True,
+    tags = ("share", "shareholder", "transaction",)
+)
+def render_rows():
+    """
+    Render the rows on the first page of the transaction list, which are cached
+    as HTML for the same reasons as shareholder rows (see shareholder).
+    """
+    return render_template(
+        "transaction/rows.html",
+        transactions = Transaction.get_page_for_list(
+            get_first_page(LIST_COLUMNS)
+        )
     )
 
 
 
 @bp.route("/<id>", methods = ("GET",))
 @login_required("ADMIN")
+@cache.conditional("share", "shareholder", "transaction:{id}")
 def details(id):
     """
     Show basic information of one transaction.
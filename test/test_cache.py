@@ -0,0 +1,183 @@
+from app import (
+    app,
+    cache
+)
+
+calls = []
+
+@cache.memoize(tags = ("test:{0}",))
+def get_thing(id):
+    calls.append(id)
+    return { "id" : id }
+
+def test_tagged_entries_are_invalidated_by_tag():
+    with app.app_context():
+        get_thing(1), get_thing(2)
+        get_thing(1), get_thing(2)
+        assert calls == [ 1, 2 ]
+
+        cache.invalidate("test:1")
+        get_thing(1), get_thing(2)
+        assert calls == [ 1, 2, 1 ]
+
+        cache.invalidate("test:*")
+        get_thing(1), get_thing(2)
+        assert calls == [ 1, 2, 1, 1, 2 ]
+
+def test_invalidation_is_shared_through_shared_cache(tmpdir):
+    from app.util.cache import TaggedCache
+    from flask import Flask
+
+    workers = []
+    for i in range(2):
+        a = Flask("worker%s" % i)
+        a.config.update(CACHE_DIR = str(tmpdir), CACHE_TYPE = "filesystem")
+        c = TaggedCache()
+        c.init_app(a)
+        workers.append((a, c,))
+
+    with workers[0][0].app_context():
+        before = workers[0][1].get_tag_versions([ "test:1" ])
+    with workers[1][0].app_context():
+        workers[1][1].invalidate("test:1")
+    with workers[0][0].app_context():
+        assert workers[0][1].get_tag_versions([ "test:1" ]) != before
+
+def test_concurrent_misses_compute_once():
+    import threading
+    import time
+
+    computed = []
+
+    @cache.cached(key_prefix = "test_slow", tags = ("test",))
+    def get_slow_thing():
+        time.sleep(0.2)
+        computed.append(1)
+        return "thing"
+
+    def worker(results):
+        with app.app_context():
+            results.append(get_slow_thing())
+
+    results = []
+    threads = [ threading.Thread(target = worker, args = (results,)) for i in range(5) ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert results == [ "thing" ] * 5
+    assert len(computed) == 1
+
+def test_lock_held_by_someone_else_is_left_alone():
+    with app.app_context():
+        (timeout, cache.lock_timeout,) = (cache.lock_timeout, 0.1)
+        cache.add("lock/test_locked/1", True, timeout = 30)
+        try:
+            assert cache.get_or_compute(
+                "test_locked", "test_locked", "1", lambda: "thing", None, False
+            ) == "thing"
+            assert cache.get("lock/test_locked/1")
+        finally:
+            cache.lock_timeout = timeout
+            cache.delete("lock/test_locked/1")
+
+def test_queued_warm_ups_are_dropped_per_key():
+    submitted = []
+    class Pool(object):
+        def submit(self, *args):
+            submitted.append(args)
+
+    done = []
+    saved = (cache.warm_up_pool, cache.warmers, cache.warm_up_keys,)
+    cache.warm_up_pool = Pool()
+    cache.warmers = {
+        "a" : (lambda: done.append("a"), { "x" },),
+        "b" : (lambda: done.append("b"), { "x", "y" },),
+        "c" : (lambda: done.append("c"), { "z" },)
+    }
+    cache.warm_up_keys = ("a", "b", "c",)
+    try:
+        with app.app_context():
+            m = cache.metrics.get_all().get("b", {})
+            canceled = m.get("warm_ups_canceled", 0)
+            cache.warm_up([ "x" ])
+            cache.warm_up([ "y", "z" ])
+            for (run, *args,) in submitted:
+                run(*args)
+            assert cache.metrics.get_all()["b"]["warm_ups_canceled"] == canceled + 1
+    finally:
+        (cache.warm_up_pool, cache.warmers, cache.warm_up_keys,) = saved
+
+    assert len(submitted) == 4
+    assert sorted(done) == [ "a", "b", "c" ]
+
+def test_metrics_are_counted_and_flushed_across_workers(tmpdir):
+    from app.util.cache import TaggedCache
+    from flask import Flask
+
+    workers = []
+    for i in range(2):
+        a = Flask("worker%s" % i)
+        a.config.update(CACHE_DIR = str(tmpdir), CACHE_TYPE = "filesystem")
+        c = TaggedCache()
+        c.init_app(a)
+        workers.append((a, c,))
+
+    for (a, c,) in workers:
+        with a.app_context():
+            for i in range(2):
+                c.get_or_compute("f", "f", "1", lambda: "thing", None, False)
+            c.metrics.flush()
+    with workers[0][0].app_context():
+        workers[0][1].delete("f/1")
+        workers[0][1].get_or_compute("f", "f", "1", lambda: "thing", None, False)
+        m = workers[0][1].metrics.get_all()["f"]
+
+    assert (m["hits"], m["misses"], m["evictions"], m["computed"],) == (3, 2, 1, 2,)
+    assert m["hit_ratio"] == 0.6
+    assert isinstance(m["compute_time"], int)
+    assert m["size"] > 0
+
+def test_pages_rendered_from_stale_entries_get_no_etag():
+    from flask import g
+
+    @cache.conditional("test")
+    def view(stale):
+        if stale:
+            g.cache_served_stale = True
+        return "page"
+
+    with app.test_request_context("/"):
+        assert view(stale = False).get_etag()[0]
+        rv = view(stale = True)
+        assert rv.get_etag() == (None, None,)
+        assert rv.headers["Cache-Control"] == "no-store"
+
+def test_unit_of_work_commits_and_invalidates_once():
+    from app import db
+    from sqlalchemy import event
+
+    commits = []
+    def count_commit(session):
+        commits.append(session)
+
+    with app.app_context():
+        event.listen(db.session, "after_commit", count_commit)
+        before = cache.get_tag_versions([ "test:1", "test:2" ])
+        try:
+            with db.unit_of_work("test:1"):
+                with db.unit_of_work():
+                    db.commit_and_invalidate("test:2")
+                db.commit_and_invalidate()
+                assert commits == []
+                assert cache.get_tag_versions([ "test:1", "test:2" ]) == before
+        finally:
+            event.remove(db.session, "after_commit", count_commit)
+
+        after = cache.get_tag_versions([ "test:1", "test:2" ])
+        assert len(commits) == 1
+        assert all([ a != b for (a, b,) in zip(
+            after.split(".")[1:],
+            before.split(".")[1:]
+        ) ])
@@ -0,0 +1,54 @@
+import pytest
+
+from app.sql import get_statements
+from app.util import engine
+from sqlalchemy.engine.url import make_url
+
+PROFILES = {
+    "default" : {},
+    "sqlite" : { "pragmas" : { "journal_mode" : "wal", "synchronous" : 1 } }
+}
+
+def test_profile_is_picked_by_name_or_backend():
+    url = make_url("sqlite:///sholdr.db")
+
+    assert engine.get_profile(PROFILES, None, url)[0] == "sqlite"
+    assert engine.get_profile(PROFILES, "default", url)[0] == "default"
+    assert engine.get_profile(PROFILES, None, make_url("mysql://x"))[0] \
+        == "default"
+    assert engine.get_profile(
+        dict(PROFILES, postgresql = {}),
+        None,
+        make_url("postgres://u:p@host/db")
+    )[0] == "postgresql"
+    with pytest.raises(ValueError):
+        engine.get_profile(PROFILES, "nope", url)
+
+def test_pragmas_that_did_not_take_effect_are_found():
+    report = [ ("journal_mode", "delete",), ("synchronous", 1,) ]
+
+    assert engine.find_mismatches(report, PROFILES["sqlite"]) \
+        == [ "journal_mode = delete (wanted wal)" ]
+
+def test_statements_are_built_once_for_reuse():
+    sql = get_statements("postgresql")
+
+    assert sql["_COMMON"]["COUNT_ALL"]("shareholder") \
+        is sql["_COMMON"]["COUNT_ALL"]("shareholder")
+    assert "DISTINCT ON" in str(sql["CHECKPOINT"]["INSERT_AS_OF"])
+    assert "DISTINCT ON" not in str(
+        get_statements("sqlite")["CHECKPOINT"]["INSERT_AS_OF"]
+    )
+
+def test_statement_timeout_is_set_for_heroku_style_urls():
+    from unittest import mock
+
+    with mock.patch.object(engine.sqlalchemy, "create_engine") as create:
+        engine.create_profiled_engine(
+            make_url("postgres://u:p@host/db"),
+            {},
+            { "statement_timeout" : 30000 }
+        )
+
+    assert create.call_args[1]["connect_args"] \
+        == { "options" : "-c statement_timeout=30000" }
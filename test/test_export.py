@@ -0,0 +1,31 @@
+import datetime
+import json
+
+from app.util import export
+
+def generate_fake_rows(stmt):
+    yield ("id", "name", "issued_on",)
+    for i in range(5):
+        yield (i, "Shareholder, %s" % i, datetime.date(2018, 6, i + 1),)
+
+def test_csv_export_is_written_in_chunks(monkeypatch):
+    monkeypatch.setattr(export, "CHUNK_SIZE", 2)
+    monkeypatch.setattr(export, "generate_rows", generate_fake_rows)
+
+    chunks = list(export.generate_export("shareholders", "csv"))
+    assert len(chunks) == 4
+    lines = "".join(chunks).splitlines()
+    assert lines[0] == "id,name,issued_on"
+    assert lines[1] == '0,"Shareholder, 0",2018-06-01'
+    assert len(lines) == 6
+
+def test_ndjson_export_has_one_object_per_line(monkeypatch):
+    monkeypatch.setattr(export, "generate_rows", generate_fake_rows)
+
+    lines = "".join(export.generate_export("shareholders", "ndjson")).splitlines()
+    assert len(lines) == 5
+    assert json.loads(lines[4]) == {
+        "id" : 4,
+        "issued_on" : "2018-06-05",
+        "name" : "Shareholder, 4"
+    }
@@ -0,0 +1,66 @@
+import datetime
+import io
+import pytest
+
+from app.util import importer
+
+def test_rows_are_read_with_line_numbers_and_without_empty_values():
+    rows = importer.read_rows(io.StringIO(
+        "email,type\n"
+        " fred@x.io ,natural\n"
+        "\n"
+        "barney@x.io,\n"
+    ), ("email",))
+
+    assert rows == [
+        (2, { "email" : "fred@x.io", "type" : "natural" },),
+        (4, { "email" : "barney@x.io" },)
+    ]
+    assert importer.read_rows(io.StringIO("email\n"), ("email", "type",)) \
+        == importer.RowError(line = 1, message = "Missing column(s): type")
+
+def test_transfers_are_checked_against_preceding_rows():
+    c = {
+        "id" : "c1",
+        "last_event" : datetime.date(2018, 6, 1),
+        "moved" : False,
+        "owner_id" : "fred",
+        "share_count" : 10
+    }
+    certificates = { (1, 10,) : c }
+    owners = { "barney@x.io" : "barney", "fred@x.io" : "fred" }
+    row = {
+        "buyer" : "barney@x.io",
+        "first_share" : "1",
+        "last_share" : "10",
+        "price" : "12.50",
+        "recorded_on" : "2018-06-02",
+        "seller" : "fred@x.io"
+    }
+
+    e = importer.check_event(row, owners, certificates, {})
+    assert e["price"] == 1250
+    assert c["owner_id"] == "barney" and c["moved"]
+
+    with pytest.raises(ValueError, match = "Not the owner"):
+        importer.check_event(row, owners, certificates, {})
+
+def test_issues_are_checked_against_issue_and_cancellation_dates():
+    state = {
+        "canceled" : [ (5, 8, datetime.date(2018, 3, 1),) ],
+        "cap" : 20,
+        "issued" : [
+            (1, 10, datetime.date(2018, 1, 1),),
+            (11, 20, datetime.date(2018, 2, 1),)
+        ],
+        "unbound" : [ (1, 20,) ]
+    }
+
+    with pytest.raises(ValueError, match = "date is 2018-03-01"):
+        importer.check_issue(1, 10, datetime.date(2018, 2, 1), state)
+    with pytest.raises(ValueError, match = "date is 2018-02-01"):
+        importer.check_issue(9, 12, datetime.date(2018, 1, 15), state)
+
+    c = importer.check_issue(11, 20, datetime.date(2018, 2, 1), state)
+    assert c["share_count"] == 10
+    assert state["unbound"] == [ (1, 10,) ]
@@ -0,0 +1,47 @@
+from app.util.paging import (
+    MAX_PAGE_LENGTH,
+    parse_page_request
+)
+from werkzeug.datastructures import MultiDict
+
+COLUMNS = ("name", "share_count",)
+
+def test_parse_page_request():
+    page = parse_page_request(MultiDict({
+        "length" : "25",
+        "order[0][column]" : "1",
+        "order[0][dir]" : "desc",
+        "search[value]" : " Acme ",
+        "start" : "50"
+    }), COLUMNS)
+    assert (page.order, page.descending, page.limit, page.offset,) == \
+        ("share_count", True, 25, 50,)
+    assert page.search == "acme"
+    assert page.after is None
+
+def test_parse_page_request_with_cursor():
+    page = parse_page_request(MultiDict({
+        "after" : '["Acme Oy", "abc"]',
+        "start" : "50"
+    }), COLUMNS)
+    assert page.after == ("Acme Oy", "abc",)
+    assert page.offset == 0
+
+def test_parse_page_request_refuses_bad_input():
+    page = parse_page_request(MultiDict({
+        "after" : '[{"a" : 1}, "abc"]',
+        "length" : "100000",
+        "order[0][column]" : "7"
+    }), COLUMNS)
+    assert page.after is None
+    assert page.limit == MAX_PAGE_LENGTH
+    assert page.order == "name"
+
+def test_parse_page_request_pages_computed_columns_by_offset():
+    args = MultiDict({
+        "after" : '[12, "abc"]',
+        "order[0][column]" : "1",
+        "start" : "50"
+    })
+    page = parse_page_request(args, COLUMNS, ("share_count",))
+    assert (page.order, page.after, page.offset,) == ("share_count", None, 50,)
@@ -0,0 +1,72 @@
+from app import app, db
+from app.models.certificate import Certificate
+from app.models.share import Share
+from app.models.shareclass import ShareClass
+from app.models.shareholder import Shareholder
+from datetime import date
+from sqlalchemy import text
+
+LOWER = 9000001
+
+def test_reclassify_straddling_two_ranges_and_a_certificate():
+    (d1, d2,) = (date(2001, 1, 1), date(2002, 2, 2),)
+    with app.app_context():
+        a = ShareClass()
+        (a.name, a.votes,) = ("Test A", 1,)
+        b = ShareClass()
+        (b.name, b.votes,) = ("Test B", 5,)
+        for sc in (a, b):
+            sc.save_or_update()
+
+        try:
+            Share.issue(LOWER, LOWER + 49, a.id, d1)
+            Share.issue(LOWER + 50, LOWER + 99, a.id, d2)
+
+            c = Certificate()
+            c.first_share = LOWER + 40
+            c.last_share = LOWER + 51
+            c.share_count = 12
+            c.owner_id = Shareholder.query.first().id
+            c.issued_on = d2
+            c.save_or_update()
+            Certificate.bind_shares(c)
+
+            Share.reclassify(LOWER + 44, LOWER + 54, b.id)
+
+            ranges = Share.query.filter(
+                Share.first_share >= LOWER
+            ).order_by(Share.first_share).all()
+            assert [
+                (r.first_share - LOWER, r.last_share - LOWER, r.share_class_id, r.issued_on,)
+                for r in ranges
+            ] == [
+                (0, 43, a.id, d1,),
+                (44, 49, b.id, d1,),
+                (50, 54, b.id, d2,),
+                (55, 99, a.id, d2,)
+            ]
+
+            composition = db.session.execute(text(
+                "SELECT share_class_id, share_count, votes "
+                "FROM certificate_composition WHERE certificate_id = :id"
+            ).params(id = c.id)).fetchall()
+            assert sorted(tuple(row) for row in composition) == sorted([
+                (a.id, 4, 4,),
+                (b.id, 8, 40,)
+            ])
+            db.session.refresh(c)
+            assert c.votes == 44
+        finally:
+            db.session.rollback()
+            for stmt in (
+                "DELETE FROM certificate_composition WHERE certificate_id IN "
+                "( SELECT id FROM certificate WHERE first_share >= :lower )",
+                "DELETE FROM certificate WHERE first_share >= :lower",
+                "DELETE FROM unbound_range WHERE first_share >= :lower",
+                "DELETE FROM share_range WHERE first_share >= :lower"
+            ):
+                db.session.execute(text(stmt).params(lower = LOWER))
+            db.session.execute(text(
+                "DELETE FROM share_class WHERE id IN ( :a, :b )"
+            ).params(a = a.id, b = b.id))
+            db.session.commit()
@@ -0,0 +1,21 @@
+from app.models.shareholder import (
+    JuridicalPerson,
+    NaturalPerson,
+    Shareholder
+)
+
+def test_display_name_and_type_id_are_filled_in_per_type():
+    s = NaturalPerson()
+    (s.first_name, s.last_name, s.nin,) = ("Fred", "Flint", "070770-7071",)
+    s.update_display_name()
+    assert (s.display_name, s.type_id,) == ("Flint, Fred", "070770-7071",)
+
+    s = JuridicalPerson()
+    (s.name, s.business_id,) = ("Acme Oy", "1234567-8",)
+    s.update_display_name()
+    assert (s.display_name, s.type_id,) == ("Acme Oy", "1234567-8",)
+
+    s = Shareholder()
+    s.email = "fred@x.io"
+    s.update_display_name()
+    assert (s.display_name, s.type_id,) == ("fred@x.io", "",)
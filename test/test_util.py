@@ -0,0 +1,56 @@
+import datetime
+
+from app.util.util import (
+    find_overlapping_ranges,
+    flatten_dated_ranges,
+    is_within_range,
+    merge_ranges,
+    subtract_ranges
+)
+
+RANGES = [ (1, 10, "a"), (21, 30, "b"), (41, 50, "c") ]
+
+def test_find_overlapping_ranges():
+    assert find_overlapping_ranges((11, 20), RANGES) == []
+    assert find_overlapping_ranges((5, 5), RANGES) == [ (1, 10, "a") ]
+    assert find_overlapping_ranges((10, 21), RANGES) == RANGES[:2]
+    assert find_overlapping_ranges((0, 100), RANGES) == RANGES
+    assert find_overlapping_ranges((51, 60), RANGES) == []
+    assert find_overlapping_ranges((1, 1), []) == []
+
+def test_flatten_dated_ranges():
+    (d1, d2, d3,) = [ datetime.date(2018, m, 1) for m in (1, 2, 3,) ]
+    assert flatten_dated_ranges([]) == []
+    assert flatten_dated_ranges([ (1, 10, d1), (5, 20, d2) ]) \
+        == [ (1, 4, d1), (5, 20, d2) ]
+    assert flatten_dated_ranges([ (1, 20, d2), (5, 10, d1), (30, 40, d1) ]) \
+        == [ (1, 20, d2), (30, 40, d1) ]
+    assert flatten_dated_ranges([ (1, 20, d1), (5, 10, d3), (8, 12, d2) ]) \
+        == [ (1, 4, d1), (5, 10, d3), (11, 12, d2), (13, 20, d1) ]
+
+def test_is_within_range():
+    assert is_within_range((1, 10), RANGES)
+    assert is_within_range((22, 29), RANGES)
+    assert is_within_range((50, 50), RANGES)
+    assert not is_within_range((0, 5), RANGES)
+    assert not is_within_range((5, 21), RANGES)
+    assert not is_within_range((11, 11), RANGES)
+    assert not is_within_range((51, 51), RANGES)
+    assert not is_within_range((1, 1), [])
+
+def test_merge_ranges():
+    assert merge_ranges([]) == []
+    assert merge_ranges([ (1, 5), (6, 9), (12, 15) ]) == [ (1, 9), (12, 15) ]
+    assert merge_ranges([ (1, 10), (3, 4), (8, 12) ]) == [ (1, 12) ]
+
+def test_subtract_ranges():
+    assert subtract_ranges([ (1, 100) ], []) == [ (1, 100) ]
+    assert subtract_ranges([ (1, 100) ], [ (1, 100) ]) == []
+    assert subtract_ranges(
+        [ (1, 100) ],
+        [ (1, 10), (20, 30), (95, 100) ]
+    ) == [ (11, 19), (31, 94) ]
+    assert subtract_ranges(
+        [ (1, 10), (21, 30) ],
+        [ (5, 25) ]
+    ) == [ (1, 4), (26, 30) ]